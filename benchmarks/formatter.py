@@ -0,0 +1,170 @@
+"""
+Benchmark of the host side trace pipeline, using synthetic agent messages so
+no device is needed.
+
+Each stage is timed separately on the same set of records:
+
+  decode     json.loads of the message text, which Frida does per message
+  message    TraceFormatter.on_message, from the decoded message to console
+             text and output records
+  output     TraceFormatter._update_output_buffer alone
+  backtrace  TraceFormatter._print_backtrace alone
+
+The peak memory allocated while handling every message is measured in a
+separate pass with tracemalloc, which would otherwise slow down the timings.
+
+Usage: python benchmarks/formatter.py [--records N] [--output-format FORMAT]
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from synthetic import SyntheticTrace
+
+from jnitrace.formatter import ConsoleWriter, TraceFormatter
+from jnitrace.output import create_writer
+
+# pylint: disable=protected-access
+
+RESULT_HEADER_FORMAT = "{:<12s}{:>10s}{:>12s}{:>14s}".format
+RESULT_ROW_FORMAT = "{:<12s}{:10d}{:12.3f}{:14.0f}".format
+PEAK_MEMORY_FORMAT = "\npeak memory {:.1f} MiB for {:d} messages".format
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark jnitrace message formatting."
+    )
+    parser.add_argument("--records", type=int, default=10000,
+                        help="Number of trace records to generate.")
+    parser.add_argument("--batch-size", type=int, default=1,
+                        help="Records per agent message.")
+    parser.add_argument("--blob-size", type=int, default=4096,
+                        help="Largest byte array captured by a call.")
+    parser.add_argument("--backtrace-depth", type=int, default=12,
+                        help="Number of frames in each backtrace.")
+    parser.add_argument("--stacks", type=int, default=512,
+                        help="Number of distinct backtraces the records are "
+                        "traced from.")
+    parser.add_argument("--output-format", choices=["ndjson", "binary", "none"],
+                        default="ndjson",
+                        help="Format of the trace file written while "
+                        "benchmarking, or none to only format for display.")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed for the synthetic trace.")
+    parser.add_argument("--json", action="store_true",
+                        help="Print the results as JSON.")
+    return parser.parse_args()
+
+def _create_formatter(args, console, directory):
+    writers = []
+    if args.output_format != "none":
+        writers.append(create_writer(
+            os.path.join(directory, "trace." + args.output_format),
+            args.output_format
+        ))
+    return TraceFormatter({
+        "show_backtrace": True,
+        "show_data": True,
+        "color": True
+    }, writers, console)
+
+def _decode(messages):
+    return [(json.loads(text), data) for text, data in messages]
+
+def _records(decoded):
+    for message, data in decoded:
+        payload = message["payload"]
+        if payload["type"] == "trace_data":
+            yield payload, data
+        elif payload["type"] == "trace_batch":
+            yield from TraceFormatter._unpack_batch(payload, data)
+
+def _time(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+def _run_messages(formatter, decoded):
+    for message, data in decoded:
+        formatter.on_message(message, data)
+    formatter.flush()
+
+def _run_output(formatter, payloads):
+    for payload, data in payloads:
+        formatter._update_output_buffer(payload, data)
+    formatter.flush()
+
+def _run_backtrace(formatter, payloads):
+    for payload, _ in payloads:
+        formatter._color_manager.update_current_color(payload["thread_id"])
+        formatter._parts = []
+        formatter._print_backtrace(
+            payload["backtrace"], payload["backtrace_id"]
+        )
+
+def _peak_memory(args, messages, console, directory):
+    formatter = _create_formatter(args, console, directory)
+    tracemalloc.start()
+    _run_messages(formatter, _decode(messages))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    formatter.close()
+    return peak
+
+def main():
+    args = _parse_args()
+    trace = SyntheticTrace(args.seed, blob_size=args.blob_size,
+                           backtrace_depth=args.backtrace_depth,
+                           stacks=args.stacks)
+    messages = trace.messages(args.records, args.batch_size)
+
+    results = {}
+    with open(os.devnull, "w") as null, \
+            tempfile.TemporaryDirectory() as directory:
+        console = ConsoleWriter(null)
+
+        decoded = []
+        results["decode"] = _time(lambda: decoded.extend(_decode(messages)))
+
+        formatter = _create_formatter(args, console, directory)
+        results["message"] = _time(lambda: _run_messages(formatter, decoded))
+
+        # The formatter resolved the backtrace modules of each payload in
+        # place, so the stages below see payloads as on_message passes them.
+        payloads = list(_records(decoded))
+        if args.output_format != "none":
+            results["output"] = _time(
+                lambda: _run_output(formatter, payloads)
+            )
+        results["backtrace"] = _time(
+            lambda: _run_backtrace(formatter, payloads)
+        )
+        formatter.close()
+
+        peak = _peak_memory(args, messages, console, directory)
+
+    if args.json:
+        print(json.dumps({
+            "records": args.records,
+            "seconds": results,
+            "records_per_second": {
+                stage: args.records / seconds
+                for stage, seconds in results.items()
+            },
+            "peak_memory_bytes": peak
+        }, indent=4))
+        return
+
+    print(RESULT_HEADER_FORMAT("stage", "records", "seconds", "records/s"))
+    for stage, seconds in results.items():
+        print(RESULT_ROW_FORMAT(
+            stage, args.records, seconds, args.records / seconds
+        ))
+    print(PEAK_MEMORY_FORMAT(peak / (1 << 20), len(messages)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+/*
+ * Micro-benchmark of the per-call method dispatch in DataTransport.
+ *
+ * Compares selecting the argument encoder, return encoder and enrichment
+ * caches of a call by matching on the method name and argument types every
+ * time (with state updaters memoised by name, as before codecs), against
+ * looking up a per-method codec built once. Only the dispatch is measured;
+ * the encoders themselves are stubs.
+ *
+ * Usage: node benchmarks/method_dispatch.js [calls]
+ */
+
+const CALLS = parseInt(process.argv[2] || "2000000", 10);
+
+// A call mix dominated by the hot loop methods seen in large apps.
+const METHODS = [
+    { name: "GetArrayLength", args: ["JNIEnv*", "jarray"], ret: "jsize", weight: 30 },
+    { name: "CallIntMethod", args: ["JNIEnv*", "jobject", "jmethodID", "..."], ret: "jint", weight: 25 },
+    { name: "GetIntField", args: ["JNIEnv*", "jobject", "jfieldID"], ret: "jint", weight: 20 },
+    { name: "GetByteArrayRegion", args: ["JNIEnv*", "jbyteArray", "jsize", "jsize", "jbyte*"], ret: "void", weight: 10 },
+    { name: "DeleteLocalRef", args: ["JNIEnv*", "jobject"], ret: "void", weight: 8 },
+    { name: "NewStringUTF", args: ["JNIEnv*", "char*"], ret: "jstring", weight: 4 },
+    { name: "GetObjectClass", args: ["JNIEnv*", "jobject"], ret: "jclass", weight: 2 },
+    { name: "FindClass", args: ["JNIEnv*", "char*"], ret: "jclass", weight: 1 }
+];
+
+const stub = () => null;
+
+function isComplexObjectType (type) {
+    return ["jobject", "jclass", "jweak"].includes(type);
+}
+
+function stateUpdater (name) {
+    if (name === "GetArrayLength") {
+        return stub;
+    } else if (name.startsWith("New") && name.endsWith("Array")) {
+        return stub;
+    } else if (["GetMethodID", "GetStaticMethodID"].includes(name)) {
+        return stub;
+    } else if (["GetFieldID", "GetStaticFieldID"].includes(name)) {
+        return stub;
+    } else if (["FindClass", "DefineClass"].includes(name)) {
+        return stub;
+    } else if (name.startsWith("New") && name.endsWith("Ref")) {
+        return stub;
+    } else if (name.startsWith("Delete") && name.endsWith("Ref")) {
+        return stub;
+    } else if (name === "GetObjectClass") {
+        return stub;
+    } else if (name.startsWith("Call")) {
+        return stub;
+    } else if (name === "NewStringUTF") {
+        return stub;
+    }
+    return null;
+}
+
+function argEncoder (name) {
+    if (name === "DefineClass" || name === "FindClass" ||
+            name === "ThrowNew" || name === "FatalError") {
+        return stub;
+    } else if (name.endsWith("ID")) {
+        return stub;
+    } else if (name === "NewString") {
+        return stub;
+    } else if (name.startsWith("Get") && name.endsWith("Chars") ||
+            name.startsWith("Get") && name.endsWith("Elements") ||
+            name.startsWith("Get") && name.endsWith("ArrayCritical") ||
+            name === "GetStringCritical") {
+        return stub;
+    } else if (name.startsWith("Release") && name.endsWith("Chars")) {
+        return stub;
+    } else if (name.endsWith("Region")) {
+        return stub;
+    } else if (name === "NewStringUTF" || name === "RegisterNatives" ||
+            name === "GetJavaVM" || name === "ReleaseStringCritical") {
+        return stub;
+    } else if (name.startsWith("Release") && name.endsWith("Elements") ||
+            name.startsWith("Release") && name.endsWith("ArrayCritical")) {
+        return stub;
+    }
+    return stub;
+}
+
+function retEncoder (name) {
+    if (name.startsWith("Get") && name.endsWith("Elements") ||
+            name.startsWith("Get") && name.endsWith("ArrayCritical")) {
+        return stub;
+    }
+    return stub;
+}
+
+function nameCache (type) {
+    if (isComplexObjectType(type)) {
+        return "jobjects";
+    } else if (type === "jmethodID") {
+        return "jmethodIDs";
+    } else if (type === "jfieldID") {
+        return "jfieldIDs";
+    } else if (type === "jstring") {
+        return "jstrings";
+    }
+    return null;
+}
+
+const updaters = new Map();
+
+function dispatchByName (method) {
+    let work = 0;
+    let updater = updaters.get(method.name);
+    if (updater === undefined) {
+        updater = stateUpdater(method.name);
+        updaters.set(method.name, updater);
+    }
+    if (updater !== null) {
+        updater();
+    }
+    argEncoder(method.name)();
+    retEncoder(method.name)();
+    for (let i = 0; i < method.args.length; i++) {
+        if (method.args[i] === "...") {
+            break;
+        }
+        if (nameCache(method.args[i]) !== null) {
+            work++;
+        }
+    }
+    if (nameCache(method.ret) !== null) {
+        work++;
+    }
+    return work;
+}
+
+function createCodec (method) {
+    const slots = [];
+    let i = 0;
+    for (; i < method.args.length; i++) {
+        if (method.args[i] === "...") {
+            break;
+        }
+        const names = nameCache(method.args[i]);
+        if (names !== null) {
+            slots.push({ index: i, names: names });
+        }
+    }
+    return {
+        updateState: stateUpdater(method.name),
+        encodeArgs: argEncoder(method.name),
+        encodeRet: retEncoder(method.name),
+        argSlots: slots,
+        javaParamsOffset: i,
+        retNames: nameCache(method.ret)
+    };
+}
+
+const codecs = new Map();
+
+function dispatchByCodec (method) {
+    let work = 0;
+    let codec = codecs.get(method.name);
+    if (codec === undefined) {
+        codec = createCodec(method);
+        codecs.set(method.name, codec);
+    }
+    if (codec.updateState !== null) {
+        codec.updateState();
+    }
+    codec.encodeArgs();
+    codec.encodeRet();
+    for (let i = 0; i < codec.argSlots.length; i++) {
+        work++;
+    }
+    if (codec.retNames !== null) {
+        work++;
+    }
+    return work;
+}
+
+function buildCalls () {
+    const pool = [];
+    METHODS.forEach((method) => {
+        for (let i = 0; i < method.weight; i++) {
+            pool.push(method);
+        }
+    });
+    const calls = new Array(CALLS);
+    let seed = 1;
+    for (let i = 0; i < CALLS; i++) {
+        seed = (seed * 1103515245 + 12345) % 2147483648;
+        calls[i] = pool[seed % pool.length];
+    }
+    return calls;
+}
+
+function measure (label, dispatch, calls) {
+    let work = 0;
+    for (let i = 0; i < calls.length / 10; i++) {
+        work += dispatch(calls[i]);
+    }
+    const start = process.hrtime.bigint();
+    for (let i = 0; i < calls.length; i++) {
+        work += dispatch(calls[i]);
+    }
+    const elapsed = Number(process.hrtime.bigint() - start);
+    console.log(
+        label.padEnd(20) +
+        (elapsed / calls.length).toFixed(1).padStart(8) + " ns/call" +
+        "  (" + work + ")"
+    );
+}
+
+const calls = buildCalls();
+measure("match by name", dispatchByName, calls);
+measure("per-method codec", dispatchByCodec, calls);
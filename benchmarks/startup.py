@@ -0,0 +1,75 @@
+"""
+Startup benchmark for jnitrace.
+
+Measures the time taken to import the jnitrace CLI module in a fresh
+interpreter, and the time taken to create the agent script in a Frida
+session, compiling it from source against loading the cached bytecode. The
+script is created in a local process, so no device is needed, but the agent
+must have been built with npm run build.
+
+Usage: python benchmarks/startup.py [runs]
+"""
+
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import frida
+
+from jnitrace.agent import AgentLoader
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); " \
+    "import jnitrace.jnitrace; print(time.perf_counter() - t)"
+
+RESULT_FORMAT = "{:<28s}{:10.1f} ms (median of {:d})".format
+
+def time_import(runs):
+    samples = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, "-c", IMPORT_SNIPPET])
+        samples.append(float(output))
+    return samples
+
+def time_create_script(session, loader, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        loader.create_script(session)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def report(name, samples):
+    print(RESULT_FORMAT(name, statistics.median(samples) * 1000, len(samples)))
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    report("import jnitrace.jnitrace", time_import(runs))
+
+    target = subprocess.Popen([sys.executable, "-c", "input()"],
+                              stdin=subprocess.PIPE)
+    try:
+        session = frida.attach(target.pid)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            source = AgentLoader(cache=False)
+            source.get_source()
+            report("agent from source", time_create_script(session, source, runs))
+
+            cached = AgentLoader(cache_dir=cache_dir)
+            cached.create_script(session)
+            samples = []
+            for _ in range(runs):
+                # A new loader per run, as each jnitrace run starts from the
+                # cache file rather than bytecode held in memory.
+                samples.extend(time_create_script(
+                    session, AgentLoader(cache_dir=cache_dir), 1
+                ))
+            report("agent from cached bytecode", samples)
+        session.detach()
+    finally:
+        target.kill()
+
+if __name__ == "__main__":
+    main()
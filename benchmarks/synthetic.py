@@ -0,0 +1,285 @@
+"""
+Synthetic Frida messages shaped like the ones the JNITrace agent sends, for
+benchmarking the host side of jnitrace without a device.
+
+The generated mix follows what DataTransport sends for a busy app: varargs
+Call*Method calls with their java_params, field and array accessors,
+RegisterNatives with a method list, byte array regions carrying binary data,
+and backtraces. Records refer to their backtrace by the id of a stack sent
+once in a backtrace_stack message, whose frames refer to modules announced by
+backtrace_module messages.
+Messages are produced as JSON text, as Frida delivers them, so every run
+decodes fresh payloads.
+"""
+
+import json
+import random
+
+MODULES = [
+    ("libnative-lib.so", "/data/app/com.example/lib/arm64/libnative-lib.so"),
+    ("libcrypto.so", "/data/app/com.example/lib/arm64/libcrypto.so"),
+    ("libart.so", "/apex/com.android.art/lib64/libart.so"),
+    ("libc.so", "/apex/com.android.runtime/lib64/bionic/libc.so")
+]
+
+JAVA_TYPES = ["jint", "jboolean", "jlong", "jobject", "jstring", "jdouble"]
+RETURN_TYPES = {
+    "Void": "void",
+    "Int": "jint",
+    "Boolean": "jboolean",
+    "Object": "jobject",
+    "Long": "jlong"
+}
+SIGNATURE_CODES = {
+    "jint": "I",
+    "jboolean": "Z",
+    "jlong": "J",
+    "jobject": "Ljava/lang/Object;",
+    "jstring": "Ljava/lang/String;",
+    "jdouble": "D"
+}
+
+# pylint: disable=too-many-instance-attributes,too-many-arguments
+class SyntheticTrace:
+    """
+    SyntheticTrace generates a reproducible stream of agent messages.
+    """
+    def __init__(self, seed=0, threads=8, blob_size=4096, backtrace_depth=12,
+                 stacks=512):
+        self._random = random.Random(seed)
+        self._threads = [1000 + i for i in range(threads)]
+        self._blob_size = blob_size
+        self._backtrace_depth = backtrace_depth
+        self._stack_count = stacks
+        self._stacks = {}
+        self._timestamp = 0
+        self._kinds = [
+            (self._call_method, 40),
+            (self._get_field, 25),
+            (self._byte_array_region, 15),
+            (self._find_class, 10),
+            (self._register_natives, 2),
+            (self._get_env, 8)
+        ]
+
+    def _pointer(self):
+        return hex(self._random.randrange(0x7000000000, 0x7fffffffff))
+
+    def _backtrace(self):
+        frames = []
+        for _ in range(self._backtrace_depth):
+            module = self._random.randrange(len(MODULES))
+            base = 0x7000000000 + module * 0x1000000
+            address = hex(base + self._random.randrange(0x100000))
+            name = None
+            if self._random.random() < 0.7:
+                name = "sub_{:x}+0x{:x}".format(
+                    self._random.randrange(0x100000),
+                    self._random.randrange(0x400)
+                )
+            frames.append({
+                "address": address,
+                "module": module,
+                "symbol": {
+                    "address": address,
+                    "name": name,
+                    "moduleName": MODULES[module][0],
+                    "fileName": "",
+                    "lineNumber": 0
+                }
+            })
+        return frames
+
+    def _stack_id(self):
+        # A busy app calls JNI from a limited number of call stacks, so the
+        # same stacks are referred to again and again.
+        stack_id = self._random.randrange(self._stack_count)
+        if stack_id not in self._stacks:
+            self._stacks[stack_id] = self._backtrace()
+        return stack_id
+
+    def _stack_messages(self, records, announced):
+        messages = []
+        for record, _ in records:
+            stack_id = record["backtrace_id"]
+            if stack_id not in announced:
+                announced.add(stack_id)
+                messages.append(({"type": "send", "payload": {
+                    "type": "backtrace_stack",
+                    "id": stack_id,
+                    "frames": self._stacks[stack_id]
+                }}, None))
+        return messages
+
+    def _record(self, call_type, name, arg_types, ret_type, args, ret):
+        self._timestamp += self._random.randrange(1, 4)
+        return {
+            "type": "trace_data",
+            "call_type": call_type,
+            "method": {"name": name, "args": arg_types, "ret": ret_type},
+            "args": args,
+            "ret": ret,
+            "thread_id": self._random.choice(self._threads),
+            "timestamp": self._timestamp,
+            "backtrace_id": self._stack_id()
+        }
+
+    def _java_value(self, java_type):
+        if java_type in ("jobject", "jstring"):
+            return self._pointer()
+        if java_type == "jboolean":
+            return self._random.randrange(2)
+        if java_type == "jdouble":
+            return self._random.random() * 1000
+        return self._random.randrange(-2 ** 31, 2 ** 31)
+
+    def _call_method(self):
+        kind = self._random.choice(sorted(RETURN_TYPES))
+        ret_type = RETURN_TYPES[kind]
+        params = [
+            self._random.choice(JAVA_TYPES)
+            for _ in range(self._random.randrange(0, 5))
+        ]
+        signature = "run({}){}".format(
+            "".join(SIGNATURE_CODES[param] for param in params),
+            "V" if ret_type == "void" else SIGNATURE_CODES[ret_type]
+        )
+        args = [
+            {"value": self._pointer()},
+            {"value": self._pointer(), "metadata": "com/example/Worker"},
+            {"value": self._pointer(), "metadata": signature}
+        ] + [{"value": self._java_value(param)} for param in params]
+
+        ret = {}
+        if ret_type != "void":
+            ret = {"value": self._java_value(ret_type)}
+        record = self._record(
+            "JNIEnv", "Call" + kind + "Method",
+            ["JNIEnv*", "jobject", "jmethodID", "..."], ret_type, args, ret
+        )
+        record["java_params"] = params
+        return record, None
+
+    def _get_field(self):
+        return self._record(
+            "JNIEnv", "GetIntField", ["JNIEnv*", "jobject", "jfieldID"],
+            "jint",
+            [
+                {"value": self._pointer()},
+                {"value": self._pointer()},
+                {"value": self._pointer(), "metadata": "count:I"}
+            ],
+            {"value": self._random.randrange(1 << 16)}
+        ), None
+
+    def _byte_array_region(self):
+        size = self._random.randrange(self._blob_size // 2, self._blob_size + 1)
+        blob = self._random.getrandbits(size * 8).to_bytes(size, "little")
+        return self._record(
+            "JNIEnv", "GetByteArrayRegion",
+            ["JNIEnv*", "jbyteArray", "jsize", "jsize", "jbyte*"], "void",
+            [
+                {"value": self._pointer()},
+                {"value": self._pointer(), "metadata": "[B"},
+                {"value": 0},
+                {"value": size},
+                {"value": self._pointer(), "data_for": 4}
+            ],
+            {}
+        ), blob
+
+    def _find_class(self):
+        name = "com/example/Class{:d}".format(self._random.randrange(500))
+        return self._record(
+            "JNIEnv", "FindClass", ["JNIEnv*", "char*"], "jclass",
+            [{"value": self._pointer()}, {"value": self._pointer(), "data": name}],
+            {"value": self._pointer(), "metadata": name}
+        ), None
+
+    def _register_natives(self):
+        methods = [{
+            "name": {"value": self._pointer(), "data": "native{:d}".format(i)},
+            "sig": {"value": self._pointer(), "data": "([BI)I"},
+            "addr": {"value": self._pointer()}
+        } for i in range(self._random.randrange(4, 32))]
+        return self._record(
+            "JNIEnv", "RegisterNatives",
+            ["JNIEnv*", "jclass", "JNINativeMethod*", "jint"], "jint",
+            [
+                {"value": self._pointer()},
+                {"value": self._pointer(), "metadata": "com/example/Native"},
+                {"value": self._pointer(), "data": methods},
+                {"value": len(methods)}
+            ],
+            {"value": 0}
+        ), None
+
+    def _get_env(self):
+        return self._record(
+            "JavaVM", "GetEnv", ["JavaVM*", "void**", "jint"], "jint",
+            [
+                {"value": self._pointer()},
+                {"value": self._pointer(), "data": self._pointer()},
+                {"value": 65542}
+            ],
+            {"value": 0}
+        ), None
+
+    def records(self, count):
+        """
+        Generate trace records.
+        :param count - the number of records to generate
+        :return - a list of (record, data) pairs
+        """
+        kinds, weights = zip(*self._kinds)
+        return [
+            self._random.choices(kinds, weights)[0]()
+            for _ in range(count)
+        ]
+
+    def messages(self, count, batch_size=1):
+        """
+        Generate the messages the agent sends for a trace, starting with the
+        tracked library and backtrace modules. Each stack is sent before the
+        first message that refers to it.
+        :param count - the number of trace records to generate
+        :param batch_size - the number of records per trace_batch message,
+        or 1 to send each record in its own message
+        :return - a list of (JSON text, data) pairs
+        """
+        messages = [({
+            "type": "send",
+            "payload": {"type": "tracked_library", "library": MODULES[0][1]}
+        }, None)]
+        for module_id, (name, path) in enumerate(MODULES):
+            messages.append(({"type": "send", "payload": {
+                "type": "backtrace_module",
+                "id": module_id,
+                "module": {
+                    "name": name,
+                    "base": hex(0x7000000000 + module_id * 0x1000000),
+                    "size": 0x1000000,
+                    "path": path
+                }
+            }}, None))
+
+        records = self.records(count)
+        announced = set()
+        if batch_size == 1:
+            for record, data in records:
+                messages.extend(
+                    self._stack_messages([(record, data)], announced)
+                )
+                messages.append(({"type": "send", "payload": record}, data))
+        else:
+            for start in range(0, len(records), batch_size):
+                batch = records[start:start + batch_size]
+                messages.extend(self._stack_messages(batch, announced))
+                lengths = [-1 if data is None else len(data) for _, data in batch]
+                messages.append(({"type": "send", "payload": {
+                    "type": "trace_batch",
+                    "records": [record for record, _ in batch],
+                    "data_lengths": lengths
+                }}, b"".join(data for _, data in batch if data is not None)))
+
+        return [(json.dumps(message), data) for message, data in messages]
@@ -0,0 +1,133 @@
+"""
+Loading of the bundled JNITrace agent. Compiling the agent from source is on
+the critical path of a spawned application's startup, so the bytecode Frida
+compiles it to is cached on disk and reused by later runs with the same agent
+and Frida version.
+"""
+
+import hashlib
+import os
+import threading
+
+import frida
+
+# pylint: disable=C0209
+
+AGENT_PATH = os.path.join(os.path.dirname(__file__), "build", "jnitrace.js")
+CACHE_FILE_FORMAT = "agent-{}-{}.qjs".format
+
+def get_cache_dir():
+    """
+    Get the directory compiled agents are cached in.
+    :return - the cache directory path
+    """
+    base = os.environ.get("XDG_CACHE_HOME") or \
+        os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "jnitrace")
+
+# pylint: disable=too-many-instance-attributes
+class AgentLoader:
+    """
+    AgentLoader creates the JNITrace script in a Frida session. The agent is
+    read from the package once, and when caching is enabled it is compiled
+    once and later created from the cached bytecode. Any failure to compile,
+    load or store the bytecode falls back to creating the script from source.
+    """
+    def __init__(self, path=AGENT_PATH, cache=True, cache_dir=None):
+        self._path = path
+        self._cache = cache
+        self._cache_dir = cache_dir or get_cache_dir()
+        self._lock = threading.Lock()
+        self._raw = None
+        self._source = None
+        self._bytecode = None
+        self._cache_path = None
+
+    def _get_raw(self):
+        if self._raw is None:
+            with open(self._path, "rb") as agent:
+                self._raw = agent.read()
+        return self._raw
+
+    def get_source(self):
+        """
+        Get the source of the agent, set up to run outside of the Frida REPL.
+        :return - the agent source
+        """
+        if self._source is None:
+            self._source = self._get_raw().decode().replace(
+                "IS_IN_REPL = true", "IS_IN_REPL = false"
+            )
+        return self._source
+
+    def get_cache_path(self):
+        """
+        Get the path the compiled agent is cached at. The name is keyed by
+        the Frida version and a hash of the agent, so an upgrade of either
+        never loads stale bytecode.
+        :return - the cache file path
+        """
+        if self._cache_path is None:
+            digest = hashlib.sha256(self._get_raw()).hexdigest()[:16]
+            self._cache_path = os.path.join(
+                self._cache_dir, CACHE_FILE_FORMAT(frida.__version__, digest)
+            )
+        return self._cache_path
+
+    def _read_cache(self):
+        try:
+            with open(self.get_cache_path(), "rb") as cached:
+                return cached.read()
+        except OSError:
+            return None
+
+    def _write_cache(self, bytecode):
+        path = self.get_cache_path()
+        temp_path = "{}.{:d}.tmp".format(path, os.getpid())
+        try:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            with open(temp_path, "wb") as cached:
+                cached.write(bytecode)
+            os.replace(temp_path, path)
+        except OSError:
+            pass
+
+    def _discard_cache(self):
+        with self._lock:
+            self._bytecode = None
+            try:
+                os.remove(self.get_cache_path())
+            except OSError:
+                pass
+
+    def _get_bytecode(self, session):
+        with self._lock:
+            if self._bytecode is None:
+                self._bytecode = self._read_cache()
+            if self._bytecode is None:
+                try:
+                    self._bytecode = session.compile_script(
+                        self.get_source(), name="jnitrace"
+                    )
+                except (frida.InvalidArgumentError, frida.NotSupportedError):
+                    return None
+                self._write_cache(self._bytecode)
+            return self._bytecode
+
+    def create_script(self, session):
+        """
+        Create the JNITrace script in a session.
+        :param session - the Frida session attached to the target
+        :return - the created script, ready to be loaded
+        """
+        if self._cache:
+            bytecode = self._get_bytecode(session)
+            if bytecode is not None:
+                try:
+                    return session.create_script_from_bytes(bytecode)
+                except (frida.InvalidArgumentError,
+                        frida.NotSupportedError):
+                    # Bytecode from another Frida server version.
+                    self._discard_cache()
+
+        return session.create_script(self.get_source())
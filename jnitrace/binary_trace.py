@@ -0,0 +1,516 @@
+"""
+Compact binary trace format for jnitrace output.
+
+A trace file starts with a magic header followed by a sequence of entries.
+Every entry is a one byte tag, a four byte little endian length and a body.
+Method definitions, thread ids, strings, modules and backtrace frames are
+written once as definition entries and records refer to them by index.
+Argument values and captured buffers are stored as typed fixed width or
+length prefixed fields, so binary data is kept raw instead of hex encoded.
+"""
+
+import json
+import mmap
+import re
+import struct
+import time
+
+# pylint: disable=C0209
+
+MAGIC = b"JNITRC\x00\x01"
+
+TAG_STRING = b"S"
+TAG_METHOD = b"M"
+TAG_THREAD = b"T"
+TAG_MODULE = b"D"
+TAG_FRAME = b"F"
+TAG_RECORD = b"R"
+
+VALUE_NONE = 0
+VALUE_INT = 1
+VALUE_FLOAT = 2
+VALUE_POINTER = 3
+VALUE_STR = 4
+VALUE_BYTES = 5
+VALUE_BOOL = 6
+VALUE_JSON = 7
+VALUE_INTERNED = 8
+
+FIELD_DATA = 0x01
+FIELD_METADATA = 0x02
+FIELD_DATA_FOR = 0x04
+FIELD_HAS_DATA = 0x08
+FIELD_CAPTURE = 0x10
+FIELD_DIGEST = 0x20
+
+RECORD_BACKTRACE = 0x01
+RECORD_JAVA_PARAMS = 0x02
+RECORD_SOURCE = 0x04
+RECORD_TIMING = 0x08
+
+RECORD_FLAGS = (
+    ("backtrace", RECORD_BACKTRACE),
+    ("java_params", RECORD_JAVA_PARAMS),
+    ("duration_us", RECORD_TIMING),
+    ("target", RECORD_SOURCE)
+)
+
+ENTRY_HEADER = struct.Struct("<cI")
+RECORD_HEADER = struct.Struct("<BIIIqH")
+CAPTURE = struct.Struct("<QII")
+U8 = struct.Struct("<B")
+U16 = struct.Struct("<H")
+U32 = struct.Struct("<I")
+I64 = struct.Struct("<q")
+U64 = struct.Struct("<Q")
+F64 = struct.Struct("<d")
+
+DIGEST_SIZE = 32
+
+INT64_MIN = -(1 << 63)
+INT64_MAX = (1 << 63) - 1
+POINTER_PATTERN = re.compile(r"0x[0-9a-f]+\Z")
+
+def _is_pointer(value):
+    return POINTER_PATTERN.match(value) is not None and \
+        hex(int(value, 16)) == value and int(value, 16) < (1 << 64)
+
+# pylint: disable=too-many-instance-attributes
+class BinaryTraceWriter:
+    """
+    BinaryTraceWriter streams trace records to a file in the compact binary
+    trace format, interning repeated definitions as they are first seen.
+    """
+    def __init__(self, path, flush_interval=1.0, flush_size=1048576):
+        # pylint: disable=consider-using-with
+        self._file = open(path, "wb")
+        self._file.write(MAGIC)
+        self._flush_interval = flush_interval
+        self._flush_size = flush_size
+        self._last_flush = time.monotonic()
+        self._buffer = bytearray()
+        self._strings = {}
+        self._methods = {}
+        self._threads = {}
+        self._modules = {}
+        self._frames = {}
+
+    def _write_entry(self, tag, body):
+        self._buffer += ENTRY_HEADER.pack(tag, len(body))
+        self._buffer += body
+
+    def _intern_string(self, value):
+        index = self._strings.get(value)
+        if index is None:
+            index = len(self._strings)
+            self._strings[value] = index
+            self._write_entry(TAG_STRING, value.encode("utf-8"))
+        return index
+
+    def _intern_method(self, method):
+        index = self._methods.get(method["name"])
+        if index is None:
+            index = len(self._methods)
+            self._methods[method["name"]] = index
+            self._write_entry(TAG_METHOD, json.dumps(method).encode("utf-8"))
+        return index
+
+    def _intern_thread(self, thread_id):
+        index = self._threads.get(thread_id)
+        if index is None:
+            index = len(self._threads)
+            self._threads[thread_id] = index
+            self._write_entry(TAG_THREAD, U32.pack(thread_id))
+        return index
+
+    def _intern_module(self, module):
+        if not module:
+            return 0
+        key = (module["name"], module["base"])
+        index = self._modules.get(key)
+        if index is None:
+            index = len(self._modules) + 1
+            self._modules[key] = index
+            self._write_entry(TAG_MODULE, json.dumps(module).encode("utf-8"))
+        return index
+
+    def _intern_frame(self, frame):
+        module = frame["module"]
+        if module:
+            key = (frame["address"], module["name"], module["base"])
+        else:
+            key = (frame["address"], None, None)
+        index = self._frames.get(key)
+        if index is None:
+            index = len(self._frames)
+            self._frames[key] = index
+            body = U32.pack(self._intern_module(module)) + json.dumps({
+                "address": frame["address"],
+                "symbol": frame["symbol"]
+            }).encode("utf-8")
+            self._write_entry(TAG_FRAME, body)
+        return index
+
+    # pylint: disable=too-many-return-statements
+    def _encode_value(self, value, intern=False):
+        if value is None:
+            return U8.pack(VALUE_NONE)
+        if isinstance(value, bool):
+            return U8.pack(VALUE_BOOL) + U8.pack(value)
+        if isinstance(value, int) and INT64_MIN <= value <= INT64_MAX:
+            return U8.pack(VALUE_INT) + I64.pack(value)
+        if isinstance(value, float):
+            return U8.pack(VALUE_FLOAT) + F64.pack(value)
+        if isinstance(value, str):
+            if intern:
+                return U8.pack(VALUE_INTERNED) \
+                    + U32.pack(self._intern_string(value))
+            if _is_pointer(value):
+                return U8.pack(VALUE_POINTER) + U64.pack(int(value, 16))
+            encoded = value.encode("utf-8")
+            return U8.pack(VALUE_STR) + U32.pack(len(encoded)) + encoded
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return U8.pack(VALUE_BYTES) + U32.pack(len(value)) + bytes(value)
+        encoded = json.dumps(value).encode("utf-8")
+        return U8.pack(VALUE_JSON) + U32.pack(len(encoded)) + encoded
+
+    def _encode_field(self, field):
+        flags = 0
+        body = self._encode_value(field["value"])
+        if "data" in field:
+            flags |= FIELD_DATA
+            body += self._encode_value(field["data"])
+        if "data_for" in field:
+            flags |= FIELD_DATA_FOR
+            body += U16.pack(field["data_for"])
+        if field.get("has_data"):
+            flags |= FIELD_HAS_DATA
+        if "data_length" in field:
+            flags |= FIELD_CAPTURE
+            body += CAPTURE.pack(
+                field["data_length"], field["data_head"],
+                field["data_checksum"]
+            )
+        if "metadata" in field:
+            flags |= FIELD_METADATA
+            body += self._encode_value(field["metadata"], intern=True)
+        if "data_digest" in field:
+            flags |= FIELD_DIGEST
+            body += bytes.fromhex(field["data_digest"])
+        return U8.pack(flags) + body
+
+    def write_record(self, record):
+        """
+        Append a record to the output file.
+        :param record - the trace record to write
+        """
+        flags = 0
+        for key, flag in RECORD_FLAGS:
+            if key in record:
+                flags |= flag
+
+        struct_type = self._intern_string(record["struct"])
+        method = self._intern_method(record["method"])
+        thread = self._intern_thread(record["thread_id"])
+        frames = []
+        if "backtrace" in record:
+            frames = [self._intern_frame(b_t) for b_t in record["backtrace"]]
+        java_params = []
+        if "java_params" in record:
+            java_params = [
+                self._intern_string(p) for p in record["java_params"]
+            ]
+
+        body = bytearray(RECORD_HEADER.pack(
+            flags,
+            struct_type,
+            method,
+            thread,
+            record["timestamp"],
+            len(record["args"])
+        ))
+        for arg in record["args"]:
+            body += self._encode_field(arg)
+        body += self._encode_field(record["ret"])
+        if "java_params" in record:
+            body += U16.pack(len(java_params))
+            for param in java_params:
+                body += U32.pack(param)
+        if "backtrace" in record:
+            body += U16.pack(len(frames))
+            for frame in frames:
+                body += U32.pack(frame)
+        # Timings are typed values, so an integer duration reads back as
+        # an integer, and come before the source as in NDJSON records.
+        if "duration_us" in record:
+            body += self._encode_value(record["start_us"])
+            body += self._encode_value(record["duration_us"])
+        if "target" in record:
+            body += U32.pack(self._intern_string(record["target"]))
+            body += U32.pack(record["pid"])
+
+        self._write_entry(TAG_RECORD, body)
+
+        if len(self._buffer) >= self._flush_size or \
+                time.monotonic() - self._last_flush >= self._flush_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Flush all written records to disk.
+        """
+        self._file.write(self._buffer)
+        self._file.flush()
+        self._buffer = bytearray()
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        """
+        Flush and close the output file.
+        """
+        self.flush()
+        self._file.close()
+
+class BinaryTraceReader:
+    """
+    BinaryTraceReader memory maps a binary trace file and lazily decodes the
+    records it contains. Only the definition tables are kept in memory.
+    """
+    def __init__(self, path):
+        with open(path, "rb") as trace:
+            if trace.read(len(MAGIC)) != MAGIC:
+                raise ValueError("{} is not a jnitrace binary trace".format(path))
+            trace.seek(0, 2)
+            if trace.tell() == len(MAGIC):
+                self._map = b""
+            else:
+                self._map = mmap.mmap(
+                    trace.fileno(), 0, access=mmap.ACCESS_READ
+                )
+        self._strings = []
+        self._methods = []
+        self._threads = []
+        self._modules = [None]
+        self._frames = []
+        self._loaded = len(MAGIC)
+        self.definition_offsets = []
+
+    @classmethod
+    def is_binary_trace(cls, path):
+        """
+        Check whether a file is stored in the binary trace format.
+        :param path - the path of the trace file
+        :return - True if the file starts with the binary trace header
+        """
+        with open(path, "rb") as trace:
+            return trace.read(len(MAGIC)) == MAGIC
+
+    def close(self):
+        """
+        Release the memory map of the trace file.
+        """
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def __iter__(self):
+        for _, record in self.iter_records():
+            yield record
+
+    def _iter_entries(self):
+        offset = len(MAGIC)
+        end = len(self._map)
+        while offset < end:
+            # A trace left by a jnitrace that was killed mid write can end
+            # with a partial entry, which is skipped.
+            if offset + ENTRY_HEADER.size > end:
+                return
+            tag, length = ENTRY_HEADER.unpack_from(self._map, offset)
+            body_offset = offset + ENTRY_HEADER.size
+            if body_offset + length > end:
+                return
+            if tag != TAG_RECORD and offset >= self._loaded:
+                self._load_definition(tag, body_offset, length)
+                self.definition_offsets.append(offset)
+            next_offset = body_offset + length
+            self._loaded = max(self._loaded, next_offset)
+            if tag == TAG_RECORD:
+                yield offset, body_offset
+            offset = next_offset
+
+    def iter_records(self):
+        """
+        Lazily decode the records in the trace file.
+        :return - a generator of (offset, record) tuples
+        """
+        for offset, body_offset in self._iter_entries():
+            yield offset, self._decode_record(body_offset)
+
+    def iter_index(self):
+        """
+        Walk the trace decoding only the fields needed to index a record.
+        :return - a generator of (offset, method name, thread id, timestamp)
+        tuples
+        """
+        for offset, body_offset in self._iter_entries():
+            _, _, method, thread, timestamp, _ = \
+                RECORD_HEADER.unpack_from(self._map, body_offset)
+            yield offset, self._methods[method]["name"], \
+                self._threads[thread], timestamp
+
+    def load_definitions(self, offsets=None):
+        """
+        Load every definition in the trace, so any record can be decoded
+        with read_record.
+        :param offsets - the offsets of all definition entries, if known from
+        an earlier walk of the trace
+        """
+        if offsets is None:
+            for _ in self._iter_entries():
+                pass
+            return
+
+        for offset in offsets:
+            if offset >= self._loaded:
+                tag, length = ENTRY_HEADER.unpack_from(self._map, offset)
+                self._load_definition(
+                    tag, offset + ENTRY_HEADER.size, length
+                )
+        self._loaded = len(self._map)
+
+    def read_record(self, offset):
+        """
+        Decode the record stored at an offset. The definitions the record
+        refers to must have been loaded, see load_definitions.
+        :param offset - the offset of the record entry
+        :return - the decoded record
+        """
+        return self._decode_record(offset + ENTRY_HEADER.size)
+
+    def _load_definition(self, tag, offset, length):
+        body = self._map[offset:offset + length]
+        if tag == TAG_STRING:
+            self._strings.append(body.decode("utf-8"))
+        elif tag == TAG_METHOD:
+            self._methods.append(json.loads(body))
+        elif tag == TAG_THREAD:
+            self._threads.append(U32.unpack(body)[0])
+        elif tag == TAG_MODULE:
+            self._modules.append(json.loads(body))
+        elif tag == TAG_FRAME:
+            frame = json.loads(body[U32.size:])
+            self._frames.append({
+                "address": frame["address"],
+                "module": self._modules[U32.unpack_from(body)[0]],
+                "symbol": frame["symbol"]
+            })
+
+    # pylint: disable=too-many-return-statements
+    def _decode_value(self, offset):
+        value_type = self._map[offset]
+        offset += U8.size
+        if value_type == VALUE_NONE:
+            return None, offset
+        if value_type == VALUE_BOOL:
+            return bool(self._map[offset]), offset + U8.size
+        if value_type == VALUE_INT:
+            return I64.unpack_from(self._map, offset)[0], offset + I64.size
+        if value_type == VALUE_FLOAT:
+            return F64.unpack_from(self._map, offset)[0], offset + F64.size
+        if value_type == VALUE_POINTER:
+            value = U64.unpack_from(self._map, offset)[0]
+            return hex(value), offset + U64.size
+        if value_type == VALUE_INTERNED:
+            index = U32.unpack_from(self._map, offset)[0]
+            return self._strings[index], offset + U32.size
+
+        length = U32.unpack_from(self._map, offset)[0]
+        offset += U32.size
+        body = self._map[offset:offset + length]
+        if value_type == VALUE_STR:
+            return body.decode("utf-8"), offset + length
+        if value_type == VALUE_BYTES:
+            return bytes(body), offset + length
+        return json.loads(body), offset + length
+
+    def _decode_field(self, offset):
+        flags = self._map[offset]
+        value, offset = self._decode_value(offset + U8.size)
+        field = {
+            "value": value
+        }
+        if flags & FIELD_DATA:
+            field["data"], offset = self._decode_value(offset)
+        if flags & FIELD_DATA_FOR:
+            field["data_for"] = U16.unpack_from(self._map, offset)[0]
+            offset += U16.size
+        if flags & FIELD_HAS_DATA:
+            field["has_data"] = True
+        if flags & FIELD_CAPTURE:
+            field["data_length"], field["data_head"], \
+                field["data_checksum"] = CAPTURE.unpack_from(self._map, offset)
+            offset += CAPTURE.size
+        if flags & FIELD_METADATA:
+            field["metadata"], offset = self._decode_value(offset)
+        if flags & FIELD_DIGEST:
+            field["data_digest"] = \
+                self._map[offset:offset + DIGEST_SIZE].hex()
+            offset += DIGEST_SIZE
+        return field, offset
+
+    def _decode_refs(self, table, offset):
+        count = U16.unpack_from(self._map, offset)[0]
+        offset += U16.size
+        refs = [
+            table[i] for i in
+            struct.unpack_from("<{}I".format(count), self._map, offset)
+        ]
+        return refs, offset + count * U32.size
+
+    def _decode_record(self, offset):
+        flags, struct_type, method, thread, timestamp, nargs = \
+            RECORD_HEADER.unpack_from(self._map, offset)
+        offset += RECORD_HEADER.size
+
+        args = []
+        for _ in range(nargs):
+            arg, offset = self._decode_field(offset)
+            args.append(arg)
+        ret, offset = self._decode_field(offset)
+
+        java_params = None
+        if flags & RECORD_JAVA_PARAMS:
+            java_params, offset = self._decode_refs(self._strings, offset)
+
+        record = {
+            "struct": self._strings[struct_type],
+            "method": self._methods[method],
+            "thread_id": self._threads[thread],
+            "timestamp": timestamp
+        }
+
+        if flags & RECORD_BACKTRACE:
+            record["backtrace"], offset = \
+                self._decode_refs(self._frames, offset)
+
+        record["args"] = args
+        record["ret"] = ret
+
+        if java_params is not None:
+            record["java_params"] = java_params
+
+        if flags & RECORD_TIMING:
+            record["start_us"], offset = self._decode_value(offset)
+            record["duration_us"], offset = self._decode_value(offset)
+
+        if flags & RECORD_SOURCE:
+            target, pid = struct.unpack_from("<II", self._map, offset)
+            record["target"] = self._strings[target]
+            record["pid"] = pid
+
+        return record
@@ -0,0 +1,116 @@
+"""
+Content addressed storage of captured buffers. Each unique buffer is written
+once to a file named by its SHA-256 digest, and trace records written with
+--blob-dir refer to buffers by digest instead of holding their bytes.
+"""
+
+import collections
+import hashlib
+import os
+import tempfile
+import threading
+
+# pylint: disable=C0209
+
+DIGEST_PREFIX_LENGTH = 2
+CACHE_SIZE = 64
+
+def _get_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+class BlobStore:
+    """
+    BlobStore keeps buffers in a directory, with a subdirectory per digest
+    prefix as git does for objects. Without a directory, buffers are kept in
+    a temporary directory removed when the store is closed. A few recently
+    read buffers are cached, as the same buffers tend to be read repeatedly.
+    """
+    def __init__(self, directory=None):
+        self._temp = None
+        if directory is None:
+            # pylint: disable=consider-using-with
+            self._temp = tempfile.TemporaryDirectory(prefix="jnitrace-blobs-")
+            directory = self._temp.name
+        self.directory = directory
+        self._stored = set()
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_path(self, digest):
+        """
+        Get the path a buffer is stored at.
+        :param digest - the hex SHA-256 digest of the buffer
+        :return - the path of the blob file
+        """
+        return os.path.join(
+            self.directory, digest[:DIGEST_PREFIX_LENGTH],
+            digest[DIGEST_PREFIX_LENGTH:]
+        )
+
+    def put(self, data):
+        """
+        Store a buffer, unless a buffer with the same contents is stored.
+        :param data - the buffer to store
+        :return - the hex SHA-256 digest of the buffer
+        """
+        digest = _get_digest(data)
+        with self._lock:
+            if digest in self._stored:
+                return digest
+
+        path = self.get_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = "{}.{:d}.{:d}.tmp".format(
+                path, os.getpid(), threading.get_ident()
+            )
+            with open(temp_path, "wb") as blob:
+                blob.write(data)
+            os.replace(temp_path, path)
+
+        with self._lock:
+            self._stored.add(digest)
+        return digest
+
+    def get(self, digest):
+        """
+        Read a stored buffer.
+        :param digest - the hex SHA-256 digest of the buffer
+        :return - the buffer, or None if it is not stored
+        """
+        with self._lock:
+            data = self._cache.get(digest)
+            if data is not None:
+                self._cache.move_to_end(digest)
+                return data
+
+        try:
+            with open(self.get_path(digest), "rb") as blob:
+                data = blob.read()
+        except OSError:
+            return None
+
+        with self._lock:
+            self._cache[digest] = data
+            if len(self._cache) > CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return data
+
+    def resolve_record(self, record):
+        """
+        Replace the digests in a record read from a trace with the buffers
+        they refer to.
+        :param record - the trace record
+        :return - the record with captured buffers as bytes
+        """
+        for field in record["args"] + [record["ret"]]:
+            if "data_digest" in field:
+                field["data"] = self.get(field.pop("data_digest"))
+        return record
+
+    def close(self):
+        """
+        Remove the temporary directory of a store created without one.
+        """
+        if self._temp is not None:
+            self._temp.cleanup()
@@ -0,0 +1,211 @@
+"""
+The command channel read from stdin while tracing. Commands change the
+filters, backtrace mode, data capture and sampling of every running session
+in place, so a noisy trace can be narrowed without restarting the app.
+"""
+
+import re
+import shlex
+
+from colorama import Fore, Style
+
+# pylint: disable=C0209
+
+PROMPT_FORMAT = "{}Tracing. Type help for commands, or press enter to " \
+    "{}...{}".format
+COMMAND_ERROR_FORMAT = "{}{}{}\n".format
+
+HELP = """Commands:
+  include [regex ...]          Only trace the methods matching a regex.
+                               Without a regex every method is traced.
+  exclude [regex ...]          Do not trace the methods matching a regex.
+  backtrace accurate|fuzzy|none
+                               Change how backtraces are taken.
+  data on|off                  Show or hide the contents of arguments.
+  max-data-bytes N             Capture at most N bytes of each buffer, or
+                               whole buffers with 0.
+  sample-every N               Only trace every Nth call to each method.
+  rate-limit N [burst]         Trace at most N calls per second of each
+                               method, or every call with 0.
+  rate-limit-by method|thread  Sample each method, or each method on each
+                               thread.
+  dump                         Send the calls held by the flight recorder.
+  quit                         Stop tracing.
+"""
+
+BACKTRACE_MODES = ("accurate", "fuzzy", "none")
+RATE_LIMIT_MODES = ("method", "thread")
+SWITCHES = {"on": True, "off": False}
+QUIT_COMMANDS = ("q", "quit", "exit")
+
+class CommandError(Exception):
+    """
+    CommandError is raised for a command with invalid parameters.
+    """
+
+def _parse_choice(params, choices):
+    if len(params) != 1 or params[0] not in choices:
+        raise CommandError("expected one of " + ", ".join(choices))
+    return params[0]
+
+def _parse_number(params, minimum=0, kind=int):
+    if len(params) != 1:
+        raise CommandError("expected a single number")
+    try:
+        value = kind(params[0])
+    except ValueError as error:
+        raise CommandError("{} is not a number".format(params[0])) from error
+    if value < minimum:
+        raise CommandError("expected a number of at least {}".format(minimum))
+    return value
+
+def _parse_patterns(params):
+    for pattern in params:
+        try:
+            re.compile(pattern)
+        except re.error as error:
+            raise CommandError(
+                "invalid regex {}: {}".format(pattern, error)
+            ) from error
+    return params
+
+class CommandChannel:
+    """
+    CommandChannel reads commands until tracing is stopped and applies them
+    to every session. The parsed arguments are updated along with the
+    sessions, so they always describe the current settings.
+    """
+    def __init__(self, args, sessions):
+        self._args = args
+        self._sessions = sessions
+        self._commands = {
+            "include": self._include,
+            "exclude": self._exclude,
+            "backtrace": self._backtrace,
+            "data": self._data,
+            "max-data-bytes": self._max_data_bytes,
+            "sample-every": self._sample_every,
+            "rate-limit": self._rate_limit,
+            "rate-limit-by": self._rate_limit_by,
+            "dump": self._dump,
+            "help": self._help
+        }
+
+    def _configure(self, options=None, formatter=None):
+        for session in self._sessions:
+            session.configure(options or {}, formatter or {})
+
+    def _configure_sampling(self):
+        self._configure({
+            "sample_every": self._args.sample_every,
+            "rate_limit": self._args.rate_limit,
+            "rate_burst": self._args.rate_burst or self._args.rate_limit,
+            "rate_limit_by": self._args.rate_limit_by
+        })
+
+    def _include(self, params):
+        self._args.include = _parse_patterns(params)
+        self._configure({"include": self._args.include})
+
+    def _exclude(self, params):
+        self._args.exclude = _parse_patterns(params)
+        self._configure({"exclude": self._args.exclude})
+
+    def _backtrace(self, params):
+        self._args.backtrace = _parse_choice(params, BACKTRACE_MODES)
+        self._configure(
+            {"backtrace": self._args.backtrace},
+            {"show_backtrace": self._args.backtrace != "none"}
+        )
+
+    def _data(self, params):
+        show_data = SWITCHES[_parse_choice(params, SWITCHES)]
+        self._args.hide_data = not show_data
+        self._configure(formatter={"show_data": show_data})
+
+    def _max_data_bytes(self, params):
+        self._args.max_data_bytes = _parse_number(params)
+        self._configure({"max_data_bytes": self._args.max_data_bytes})
+
+    def _sample_every(self, params):
+        self._args.sample_every = _parse_number(params, 1)
+        self._configure_sampling()
+
+    def _rate_limit(self, params):
+        if len(params) not in (1, 2):
+            raise CommandError("expected a rate and an optional burst")
+        rate = _parse_number(params[:1], kind=float)
+        burst = None
+        if len(params) == 2:
+            burst = _parse_number(params[1:], 1)
+        self._args.rate_limit = rate
+        self._args.rate_burst = burst
+        self._configure_sampling()
+
+    def _rate_limit_by(self, params):
+        self._args.rate_limit_by = _parse_choice(params, RATE_LIMIT_MODES)
+        self._configure_sampling()
+
+    def _dump(self, params):
+        if params:
+            raise CommandError("dump takes no parameters")
+        for session in self._sessions:
+            session.dump_flight_recorder()
+
+    @classmethod
+    def _help(cls, _):
+        print(HELP)
+
+    def execute(self, line):
+        """
+        Run a single command.
+        :param line - the command line as typed
+        :return - False if tracing should stop, otherwise True
+        """
+        try:
+            words = shlex.split(line)
+        except ValueError as error:
+            print(
+                COMMAND_ERROR_FORMAT(Fore.RED, error, Style.RESET_ALL), end=""
+            )
+            return True
+
+        if not words:
+            # Enter dumps the flight recorder when one is running, and
+            # otherwise quits as it always has.
+            if self._args.flight_recorder > 0:
+                self._dump([])
+                return True
+            return False
+
+        name, params = words[0], words[1:]
+        if name in QUIT_COMMANDS:
+            return False
+
+        command = self._commands.get(name)
+        try:
+            if command is None:
+                raise CommandError(
+                    "unknown command {}, type help for commands".format(name)
+                )
+            command(params)
+        except CommandError as error:
+            print(
+                COMMAND_ERROR_FORMAT(Fore.RED, error, Style.RESET_ALL), end=""
+            )
+        return True
+
+    def run(self):
+        """
+        Read and run commands from stdin until tracing is stopped.
+        """
+        action = "quit"
+        if self._args.flight_recorder > 0:
+            action = "dump the flight recorder, or type quit to stop"
+        print(PROMPT_FORMAT(Fore.GREEN, action, Style.RESET_ALL))
+
+        try:
+            while self.execute(input()):
+                pass
+        except (EOFError, KeyboardInterrupt):
+            pass
@@ -0,0 +1,829 @@
+"""
+Formatting of the messages sent by the JNITrace agent into the coloured trace
+shown on the console, and into the records written to output files.
+"""
+
+import collections
+import sys
+import threading
+import time
+
+from colorama import Fore, Style
+
+from jnitrace.hexview import hex_lines, truncated_hex_lines
+from jnitrace.summary import CLEAR_SCREEN
+
+# pylint: disable=C0209
+
+PALETTE = [
+    Fore.CYAN,
+    Fore.MAGENTA,
+    Fore.YELLOW,
+    Fore.GREEN,
+    Fore.RED,
+    Fore.BLUE
+]
+
+CAPTURE_KEYS = ("data_length", "data_head", "data_checksum")
+
+# The number of stacks the agent keeps interned. Stacks it has evicted are
+# sent again under a new id, so older ones are dropped here too.
+STACK_CAPACITY = 65536
+
+TIMESTAMP_FORMAT = "{:7d} ms ".format
+THREAD_ID_FORMAT = "{}{}           /* TID {:d} */{}\n".format
+TAGGED_THREAD_ID_FORMAT = "{}{}           /* {} TID {:d} */{}\n".format
+SESSION_HEADER_FORMAT = "{}{}:{}\n".format
+METHOD_NAME_FORMAT = "{}[+] {}->{}{}\n".format
+TIMED_METHOD_NAME_FORMAT = "{}[+] {}->{} ({:.1f} us){}\n".format
+TYPED_DATA_FORMAT = "{}|{} {}{:{}s}: {}".format
+UNTYPED_DATA_FORMAT = "{}|{} {}{}".format
+DATA_METADATA_FORMAT = "    {{ {} }}".format
+BACKTRACE_HEADER_FORMAT = "{}{padding}Backtrace{padding}{}\n".format
+BACKTRACE_FRAME_FORMAT = "{}|-> {:>{}s}: {:>{}s} ({}:{}){}\n".format
+BACKTRACE_FRAME_LENGTH_FORMAT = "|-> {:>{}s}: {} ({}:{})".format
+ERROR_FORMAT = "{}ERROR: {}{}\n".format
+DROPPED_FORMAT = "{}Dropped {:d} calls: {}{}\n\n".format
+DROPPED_METHOD_FORMAT = "{} ({:d})".format
+FLIGHT_RECORDER_FORMAT = "{}Flight recorder dump on {}: {:d} calls{}{}\n\n".format
+FLIGHT_RECORDER_OVERWRITTEN_FORMAT = ", {:d} older calls overwritten".format
+LIBRARY_FORMAT = 'Traced library "{}" loaded from path "{}".\n\n'.format
+
+class ColorManager:
+    """
+    ColorManager manages the current output color used by the formatter.
+    It also stores the thread to color assignments.
+    """
+    def __init__(self, palette=None):
+        self._palette = palette or PALETTE
+        self._current_color = None
+        self._next_color = 0
+        self._thread_colors = {}
+
+    def update_current_color(self, thread_id):
+        """
+        Get or assign a color to a thread.
+        :param thread_id - the thread id to assign the color to
+        """
+        color = self._thread_colors.get(thread_id)
+        if color is None:
+            color = self._palette[self._next_color]
+            self._next_color += 1
+            if self._next_color >= len(self._palette):
+                self._next_color = 0
+            self._thread_colors[thread_id] = color
+        self._current_color = color
+        return color
+
+    def get_current_color(self):
+        """
+        Get the current color in use for the formatter.
+        May return None.
+        :return - the current color in use
+        """
+        return self._current_color
+
+class ConsoleWriter:
+    """
+    ConsoleWriter collects formatted output and writes it to a stream in
+    large chunks. Pending output is written once the chunk size is reached or
+    after a short idle period, so a quiet trace is still displayed promptly.
+    """
+    def __init__(self, stream, chunk_size=65536, flush_interval=0.1):
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._flush_interval = flush_interval
+        self._pending = []
+        self._pending_size = 0
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def write(self, text):
+        """
+        Queue text to be written to the stream.
+        :param text - the formatted text to write
+        """
+        with self._lock:
+            self._pending.append(text)
+            self._pending_size += len(text)
+            if self._pending_size >= self._chunk_size:
+                self._flush_pending()
+            elif self._timer is None:
+                self._timer = threading.Timer(
+                    self._flush_interval, self.flush
+                )
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """
+        Write all pending text to the stream.
+        """
+        with self._lock:
+            self._flush_pending()
+
+    def _flush_pending(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        if self._pending:
+            self._stream.write("".join(self._pending))
+            self._stream.flush()
+            self._pending = []
+            self._pending_size = 0
+
+# pylint: disable=too-many-instance-attributes
+class TraceFormatter:
+    """
+    TraceFormatter class to take output from the Frida script and print it in
+    a readable way for the user.
+    """
+    # pylint: disable=too-many-arguments
+    def __init__(self, _config, _writers, _console=None, _summary=None,
+                 _stats=None, _blobs=None, _refs=None):
+        self._config = _config
+        self._writers = _writers
+        self._console = _console or ConsoleWriter(sys.stdout)
+        self._summary = _summary
+        self._stats = _stats
+        self._blobs = _blobs
+        self._refs = _refs
+
+        if _config.get("color", True):
+            self._white = Fore.WHITE
+            self._red = Fore.RED
+            self._reset = Style.RESET_ALL
+            self._color_manager = ColorManager()
+        else:
+            self._white = ""
+            self._red = ""
+            self._reset = ""
+            self._color_manager = ColorManager([""])
+
+        self._current_ts = None
+        self._timestamp = None
+        self._prefix = None
+        self._parts = []
+        self._is_64b = False
+        self._modules = {}
+        self._stacks = collections.OrderedDict()
+        self._rendered_stacks = {}
+        self._dropped = {}
+
+    def _print_thread_id(self, thread_id):
+        if self._config.get("tag"):
+            self._parts.append(TAGGED_THREAD_ID_FORMAT(
+                self._white,
+                self._color_manager.get_current_color(),
+                self._config["tag"],
+                thread_id,
+                self._reset
+            ))
+            return
+
+        self._parts.append(THREAD_ID_FORMAT(
+            self._white,
+            self._color_manager.get_current_color(),
+            thread_id,
+            self._reset
+        ))
+
+    def _print_method_name(self, struct_type, name, duration=None):
+        if duration is not None:
+            self._parts.append(TIMED_METHOD_NAME_FORMAT(
+                self._prefix,
+                struct_type,
+                name,
+                duration,
+                self._reset
+            ))
+            return
+
+        self._parts.append(METHOD_NAME_FORMAT(
+            self._prefix,
+            struct_type,
+            name,
+            self._reset
+        ))
+
+    @classmethod
+    def _get_data_metadata(cls, arg_type, value):
+        opt = None
+        if arg_type == "jboolean":
+            if value == 0:
+                opt = "false"
+            else:
+                opt = "true"
+        return opt
+
+    # pylint: disable=too-many-arguments
+    def _print_data_value(self, sym, value, arg_type=None, opt=None, padding=0):
+        if not opt:
+            opt = self._get_data_metadata(arg_type, value)
+
+        if arg_type:
+            line = TYPED_DATA_FORMAT(
+                self._prefix, sym, " " * padding, arg_type, 17 - padding, value
+            )
+        else:
+            line = UNTYPED_DATA_FORMAT(self._prefix, sym, " " * padding, value)
+
+        if opt:
+            line += DATA_METADATA_FORMAT(opt)
+
+        self._parts.append(line + self._reset + "\n")
+
+    def _print_data(self, block, arg_type, padding, data):
+        self._print_data_value(
+            block["sym"],
+            block["data"]["value"],
+            arg_type=arg_type,
+            opt=block["data"].get("metadata"),
+            padding=padding
+        )
+
+        if self._config["show_data"]:
+            self._print_additional_data(block["data"], data)
+
+    def _print_arg_data(self, arg, arg_type=None, padding=0, data=None):
+        block = {
+            "sym": "-",
+            "data": arg
+        }
+        self._print_data(block, arg_type, padding, data)
+
+    def _print_arg_sub_data(self, arg, arg_type=None, opt=None, padding=4):
+        self._print_data_value(
+            ":",
+            arg,
+            arg_type=arg_type,
+            opt=opt,
+            padding=padding
+        )
+
+    def _print_ret_data(self, ret, ret_type=None, padding=0, data=None):
+        block = {
+            "sym": "=",
+            "data": ret
+        }
+        self._print_data(block, ret_type, padding, data)
+
+    def _print_additional_data(self, arg, data):
+        if "data" in arg and isinstance(arg["data"], list):
+            for jni_method in arg["data"]:
+                self._print_arg_sub_data(
+                    "{} - {}{}".format(
+                        jni_method["addr"]["value"],
+                        jni_method["name"]["data"],
+                        jni_method["sig"]["data"]
+                    )
+                )
+        else:
+            h_d_data = None
+            if "data_for" in arg or "has_data" in arg:
+                h_d_data = data
+            elif "data" in arg:
+                if isinstance(arg["data"], (str, int)):
+                    self._print_arg_sub_data(
+                        arg["data"]
+                    )
+                else:
+                    h_d_data = arg["data"]
+
+            if h_d_data:
+                self._print_hex_data(arg, h_d_data)
+
+    def _print_hex_data(self, arg, data):
+        if "data_length" in arg:
+            lines = truncated_hex_lines(
+                data, arg["data_length"], arg["data_head"],
+                arg["data_checksum"]
+            )
+        else:
+            lines = hex_lines(data)
+
+        line_prefix = UNTYPED_DATA_FORMAT(self._prefix, ":", " " * 4, "")
+        line_suffix = self._reset + "\n"
+        self._parts.append("".join(
+            line_prefix + line + line_suffix for line in lines
+        ))
+
+    def _print_args(self, method, args, java_params, data):
+        jni_args = method["args"]
+        add_java_args = False
+        for i, _ in enumerate(jni_args):
+            arg_type = method["args"][i]
+            if arg_type in ["...", "va_list", "jvalue*"]:
+                add_java_args = True
+
+            if arg_type == "...":
+                break
+
+            arg = args[i]
+
+            self._print_arg_data(
+                arg,
+                arg_type=arg_type,
+                data=data
+            )
+
+        if add_java_args:
+            if method["args"][-1] == "...":
+                arg_offset = 1
+                padding = 0
+            else:
+                padding = 4
+                arg_offset = 0
+            for i, java_param in enumerate(java_params):
+                arg = args[i + len(jni_args) - arg_offset]
+                self._print_arg_sub_data(
+                    arg["value"],
+                    arg_type=java_param,
+                    opt=arg.get("metadata"),
+                    padding=padding
+                )
+
+    @classmethod
+    def _create_backtrace_symbol(cls, module, symbol):
+        symbol_name = symbol["name"]
+        module_name = module["name"]
+        if not symbol_name:
+            symbol_name = hex(
+                int(symbol["address"], 16) - int(module["base"], 16)
+            )
+        if "+" not in symbol_name:
+            return module_name + "!" + symbol_name
+        return symbol_name
+
+    def _calculate_backtrace_lengths(self, backtrace):
+        max_name = 0
+        max_len = 0
+        size = 10
+
+        for b_t in backtrace:
+            if not b_t["module"]:
+                break
+
+            if len(b_t["address"]) > 10:
+                self._is_64b = True
+
+            if self._is_64b:
+                size = 18
+            else:
+                size = 10
+
+            break
+
+        for b_t in backtrace:
+            if not b_t["module"]:
+                break
+
+            symbol_name = self._create_backtrace_symbol(
+                b_t["module"], b_t["symbol"]
+            )
+
+            b_t_len = len(BACKTRACE_FRAME_LENGTH_FORMAT(
+                b_t["address"],
+                size,
+                symbol_name,
+                b_t["module"]["name"],
+                b_t["module"]["base"]
+            ))
+
+            max_len = max(max_len, b_t_len)
+            max_name = max(max_name, len(symbol_name))
+
+        return max_len, max_name, size
+
+    def _render_backtrace(self, backtrace):
+        max_len, max_name, size = self._calculate_backtrace_lengths(backtrace)
+
+        padding = "-" * (round(max_len / 2) - int(len("Backtrace") / 2))
+        lines = [BACKTRACE_HEADER_FORMAT(
+            "",
+            self._reset,
+            padding=padding
+        )]
+
+        for b_t in backtrace:
+            if not b_t["module"]:
+                break
+
+            symbol_name = self._create_backtrace_symbol(
+                b_t["module"], b_t["symbol"]
+            )
+
+            lines.append(BACKTRACE_FRAME_FORMAT(
+                "",
+                b_t["address"],
+                size,
+                symbol_name,
+                max_name,
+                b_t["module"]["name"],
+                b_t["module"]["base"],
+                self._reset
+            ))
+
+        return lines
+
+    def _print_backtrace(self, backtrace, stack_id=None):
+        # Lines are rendered without the timestamp and thread color prefix,
+        # so the lines of an interned stack are rendered once and reused.
+        if stack_id is None:
+            lines = self._render_backtrace(backtrace)
+        else:
+            lines = self._rendered_stacks.get(stack_id)
+            if lines is None:
+                lines = self._render_backtrace(backtrace)
+                self._rendered_stacks[stack_id] = lines
+
+        prefix = self._timestamp + self._color_manager.get_current_color()
+        self._parts.append(prefix + prefix.join(lines))
+        self._parts.append("\n")
+
+    def _is_error(self, message):
+        if message["type"] != "send" or message["payload"]["type"] == "error":
+            self._console.write(ERROR_FORMAT(
+                self._red,
+                str(message),
+                self._reset
+            ))
+            return True
+        return False
+
+    def _is_meta_message(self, payload):
+        if payload["type"] == "tracked_library":
+            self._console.write(LIBRARY_FORMAT(
+                payload["library"].split("/")[-1],
+                "/".join(payload["library"].split("/")[0:-1])
+            ))
+            return True
+        if payload["type"] == "flight_recorder_dump":
+            self._on_flight_recorder_dump(payload)
+            return True
+        return False
+
+    def _print_method_call(self, payload, data):
+        struct_type = payload["call_type"]
+        method = payload["method"]
+        args = payload["args"]
+
+        self._print_thread_id(payload["thread_id"])
+        self._print_method_name(
+            struct_type, method["name"], payload.get("duration_us")
+        )
+
+        args = payload["args"]
+        self._print_args(method, args, payload.get("java_params"), data)
+
+        if payload["ret"].get("value") is not None:
+            self._print_ret_data(
+                payload["ret"],
+                ret_type=method["ret"],
+                data=data
+            )
+
+        self._parts.append("\n")
+
+    @classmethod
+    def _copy_capture(cls, field, output_field):
+        if "data_length" in field:
+            for key in CAPTURE_KEYS:
+                output_field[key] = field[key]
+
+    def _copy_data(self, field, output_field, data):
+        # With a blob directory, records refer to captured buffers by digest
+        # and each buffer is only written once.
+        if data is not None and self._config.get("blob_refs"):
+            output_field["data_digest"] = \
+                field.get("data_digest") or self._blobs.put(data)
+        else:
+            output_field["data"] = data
+
+    def _update_output_buffer(self, payload, data):
+        record = {
+            "struct": payload["call_type"],
+            "method": payload["method"],
+            "thread_id": payload["thread_id"],
+            "timestamp": payload["timestamp"],
+        }
+
+        if "backtrace" in payload:
+            record["backtrace"] = payload["backtrace"]
+
+        args = []
+
+        for arg in payload["args"]:
+            output_arg = {
+                "value": arg["value"]
+            }
+            if "data_for" in arg:
+                self._copy_data(arg, output_arg, data)
+                output_arg["data_for"] = arg["data_for"]
+                self._copy_capture(arg, output_arg)
+            elif "data" in arg:
+                output_arg["data"] = arg["data"]
+            if "metadata" in arg:
+                output_arg["metadata"] = arg["metadata"]
+            args.append(output_arg)
+
+        record["args"] = args
+
+        ret = {
+            "value": payload["ret"].get("value")
+        }
+
+        if "has_data" in payload["ret"]:
+            self._copy_data(payload["ret"], ret, data)
+            ret["has_data"] = True
+            self._copy_capture(payload["ret"], ret)
+        if "metadata" in payload["ret"]:
+            ret["metadata"] = payload["ret"]["metadata"]
+
+        record["ret"] = ret
+
+        if "java_params" in payload:
+            record["java_params"] = payload["java_params"]
+
+        if "duration_us" in payload:
+            record["start_us"] = payload["start_us"]
+            record["duration_us"] = payload["duration_us"]
+
+        if "target" in self._config:
+            record["target"] = self._config["target"]
+            record["pid"] = self._config["pid"]
+
+        for writer in self._writers:
+            writer.write_record(record)
+
+    @classmethod
+    def _unpack_batch(cls, payload, data):
+        offset = 0
+        for record, length in zip(payload["records"], payload["data_lengths"]):
+            if length < 0:
+                yield record, None
+            else:
+                yield record, data[offset:offset + length]
+                offset += length
+
+    def on_message(self, message, data):
+        """
+        Frida on_message callback, for formatting output data.
+        :param message - JSON formatted output
+        :param data - binary data for some JNI method calls
+        """
+        if self._is_error(message):
+            return
+
+        payload = message["payload"]
+
+        if payload["type"] == "trace_batch":
+            for record, record_data in TraceFormatter._unpack_batch(
+                    payload, data):
+                self._on_payload(record, record_data)
+            return
+
+        self._on_payload(payload, data)
+
+    def flush(self):
+        """
+        Write any formatted output still waiting in the console buffer and
+        flush the output writers.
+        """
+        self._console.flush()
+        for writer in self._writers:
+            writer.flush()
+
+    def update_config(self, changes):
+        """
+        Change how records are printed from now on.
+        :param changes - the config keys to change
+        """
+        self._config.update(changes)
+
+    def close(self):
+        """
+        Flush all output and close the output writers.
+        """
+        self.flush()
+        for writer in self._writers:
+            writer.close()
+
+    def _resolve_backtrace(self, backtrace):
+        for b_t in backtrace:
+            if b_t["module"] is not None:
+                b_t["module"] = self._modules[b_t["module"]]
+
+    def _get_blob(self, payload):
+        for field in payload["args"] + [payload["ret"]]:
+            if "data_digest" in field:
+                return self._blobs.get(field["data_digest"])
+        return None
+
+    def _on_call_summary(self, payload):
+        if self._summary is None:
+            return
+
+        self._summary.update(payload["calls"], self._modules)
+        # A live table is only drawn for a single session, as sessions would
+        # otherwise take turns clearing the screen.
+        if self._config.get("color", True) and not self._config.get("tag"):
+            self._console.write(
+                CLEAR_SCREEN + self._summary.render(self._white, self._reset)
+            )
+
+    def _print_dropped(self, dropped):
+        ranked = sorted(dropped.items(), key=lambda item: item[1], reverse=True)
+        self._console.write(DROPPED_FORMAT(
+            self._red,
+            sum(dropped.values()),
+            ", ".join(
+                DROPPED_METHOD_FORMAT(method, count)
+                for method, count in ranked
+            ),
+            self._reset
+        ))
+
+    def _on_dropped_calls(self, payload):
+        dropped = {}
+        for entry in payload["dropped"]:
+            dropped[entry["method"]] = entry["count"]
+            self._dropped[entry["method"]] = \
+                self._dropped.get(entry["method"], 0) + entry["count"]
+
+        if self._summary is None:
+            self._print_dropped(dropped)
+
+    def _on_tracer_stats(self, payload):
+        if self._stats is None:
+            return
+
+        self._console.write(
+            self._stats.update(payload, self._white, self._reset)
+        )
+
+    def _on_ref_pressure(self, payload):
+        if self._refs is None:
+            return
+
+        self._console.write(self._refs.update(
+            payload, self._modules, self._white, self._reset
+        ))
+
+    def _on_flight_recorder_dump(self, payload):
+        overwritten = ""
+        if payload["overwritten"]:
+            overwritten = FLIGHT_RECORDER_OVERWRITTEN_FORMAT(
+                payload["overwritten"]
+            )
+        self._console.write(FLIGHT_RECORDER_FORMAT(
+            self._white, payload["reason"], payload["records"], overwritten,
+            self._reset
+        ))
+
+    def print_final_report(self):
+        """
+        Print the final table of call counts when running in summary mode,
+        the total number of calls dropped by sampling, the time spent in
+        each stage of tracing when running in stats mode, and the live
+        references when profiling references.
+        """
+        if self._config.get("tag") and \
+                (self._summary or self._dropped or self._stats or self._refs):
+            self._console.write(SESSION_HEADER_FORMAT(
+                self._white, self._config["tag"], self._reset
+            ))
+        if self._summary is not None:
+            self._console.write(
+                self._summary.render(self._white, self._reset)
+            )
+        if self._dropped:
+            self._print_dropped(self._dropped)
+        if self._stats is not None:
+            self._console.write(self._stats.render(self._white, self._reset))
+        if self._refs is not None:
+            self._console.write(self._refs.render(self._white, self._reset))
+        self._console.flush()
+
+    def _is_definition(self, payload, data):
+        # Modules, stacks and buffers are sent once and referred to by the
+        # records that follow.
+        if payload["type"] == "backtrace_module":
+            self._modules[payload["id"]] = payload["module"]
+        elif payload["type"] == "backtrace_stack":
+            self._resolve_backtrace(payload["frames"])
+            self._add_stack(payload["id"], payload["frames"])
+        elif payload["type"] == "blob":
+            if self._blobs is not None:
+                self._blobs.put(data)
+        else:
+            return False
+        return True
+
+    def _add_stack(self, stack_id, frames):
+        self._stacks[stack_id] = frames
+        if len(self._stacks) > STACK_CAPACITY:
+            evicted, _ = self._stacks.popitem(last=False)
+            self._rendered_stacks.pop(evicted, None)
+
+    def _get_stack(self, stack_id):
+        # Records dropped from a full queue are not seen here, so a stack the
+        # agent still uses can already have been evicted. The record is then
+        # shown without its backtrace.
+        frames = self._stacks.get(stack_id)
+        if frames is not None:
+            self._stacks.move_to_end(stack_id)
+        return frames
+
+    def _on_payload(self, payload, data):
+        if self._is_definition(payload, data):
+            return
+
+        if payload["type"] in ("call_summary", "latency_histogram"):
+            self._on_call_summary(payload)
+            return
+
+        if payload["type"] == "dropped_calls":
+            self._on_dropped_calls(payload)
+            return
+
+        if payload["type"] == "tracer_stats":
+            self._on_tracer_stats(payload)
+            return
+
+        if payload["type"] == "ref_pressure":
+            self._on_ref_pressure(payload)
+            return
+
+        if self._is_meta_message(payload):
+            return
+
+        if self._blobs is not None and data is None:
+            data = self._get_blob(payload)
+
+        if "backtrace_id" in payload:
+            frames = self._get_stack(payload["backtrace_id"])
+            if frames is not None:
+                payload["backtrace"] = frames
+        elif "backtrace" in payload:
+            self._resolve_backtrace(payload["backtrace"])
+
+        start = time.perf_counter()
+        if self._writers:
+            self._update_output_buffer(payload, data)
+            if self._stats is not None:
+                self._stats.time_host("output", start)
+                start = time.perf_counter()
+
+        self._print_payload(payload, data)
+        if self._stats is not None:
+            self._stats.time_host("format", start)
+
+    def render_record(self, record):
+        """
+        Print a record read back from a saved trace in the same format used
+        while tracing.
+        :param record - the stored trace record
+        """
+        data = None
+        for field in record["args"] + [record["ret"]]:
+            if "data_for" in field or "has_data" in field:
+                data = field.get("data")
+
+        payload = {
+            "call_type": record["struct"],
+            "method": record["method"],
+            "args": record["args"],
+            "ret": record["ret"],
+            "thread_id": record["thread_id"],
+            "timestamp": record["timestamp"]
+        }
+        if "java_params" in record:
+            payload["java_params"] = record["java_params"]
+        if "backtrace" in record:
+            payload["backtrace"] = record["backtrace"]
+        if "duration_us" in record:
+            payload["duration_us"] = record["duration_us"]
+
+        self._print_payload(payload, data)
+
+    def _print_payload(self, payload, data):
+        self._current_ts = payload["timestamp"]
+
+        self._color_manager.update_current_color(payload["thread_id"])
+
+        self._timestamp = TIMESTAMP_FORMAT(self._current_ts)
+        self._prefix = self._white + self._timestamp \
+            + self._color_manager.get_current_color()
+        self._parts = []
+
+        self._print_method_call(payload, data)
+
+        if self._config["show_backtrace"] and "backtrace" in payload:
+            self._print_backtrace(
+                payload["backtrace"], payload.get("backtrace_id")
+            )
+
+        self._parts.append("\n")
+        self._console.write("".join(self._parts))
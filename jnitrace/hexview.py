@@ -0,0 +1,63 @@
+"""
+Hex and ASCII rendering of captured buffers. The whole buffer is converted in
+a few bulk operations and then sliced into lines, instead of formatting it a
+byte at a time.
+"""
+
+# pylint: disable=C0209
+
+LINE_BYTES = 16
+HALF_LINE_CHARS = 24
+HEX_WIDTH = 50
+
+HEX_BYTES = ["{:02X} ".format(byte) for byte in range(256)]
+ASCII_TABLE = bytes(
+    byte if 0x20 <= byte <= 0x7E else ord(".") for byte in range(256)
+)
+
+LINE_FORMAT = "{:07X}: {:{}s}{}".format
+OMITTED_FORMAT = \
+    "... {:d} bytes omitted, {:d} bytes total, fnv1a32 {:08x} ...".format
+
+def _split_hex(spaced):
+    if len(spaced) > HALF_LINE_CHARS:
+        return spaced[:HALF_LINE_CHARS] + " " + spaced[HALF_LINE_CHARS:]
+    return spaced
+
+def hex_lines(data, offset=0):
+    """
+    Format a buffer as lines of hex bytes followed by their printable ASCII
+    characters.
+    :param data - the buffer to format
+    :param offset - the address shown for the first byte
+    :return - a list of formatted lines
+    """
+    data = bytes(data)
+    spaced = "".join(map(HEX_BYTES.__getitem__, data))
+    text = data.translate(ASCII_TABLE).decode("ascii")
+
+    lines = []
+    for start in range(0, len(data), LINE_BYTES):
+        end = start + LINE_BYTES
+        lines.append(LINE_FORMAT(
+            offset + start,
+            _split_hex(spaced[start * 3:end * 3]),
+            HEX_WIDTH,
+            text[start:end]
+        ))
+    return lines
+
+def truncated_hex_lines(data, length, head, checksum):
+    """
+    Format a buffer that was cut down to its head and tail by the agent.
+    :param data - the captured head and tail of the buffer
+    :param length - the length of the complete buffer
+    :param head - the number of captured bytes from the start of the buffer
+    :param checksum - the FNV-1a checksum of the complete buffer
+    :return - a list of formatted lines
+    """
+    tail = len(data) - head
+    lines = hex_lines(data[:head])
+    lines.append(OMITTED_FORMAT(length - len(data), length, checksum))
+    lines.extend(hex_lines(data[head:], length - tail))
+    return lines
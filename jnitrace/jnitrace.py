@@ -4,450 +4,60 @@ process.
 """
 
 import argparse
-import binascii
-import json
 import re
+import sys
+import threading
 
 import frida
-import hexdump
-
-from pkg_resources import resource_string
-from pkg_resources import require
 
 from colorama import Fore, Style, init
 
-# pylint: disable=C0209
-
-__version__ = require("jnitrace")[0].version
+from jnitrace.agent import AgentLoader
+from jnitrace.blobs import BlobStore
+from jnitrace.commands import CommandChannel
+from jnitrace.formatter import ERROR_FORMAT, ConsoleWriter, TraceFormatter
+from jnitrace.latency import LatencySummary
+from jnitrace.refs import RefPressure
+from jnitrace.output import SharedWriter, TraceEventWriter, create_writer
+from jnitrace.pipeline import POLICIES, MessagePipeline
+from jnitrace.stats import TracerStats
+from jnitrace.summary import CallSummary
 
-init()
-
-PALETTE = [
-    Fore.CYAN,
-    Fore.MAGENTA,
-    Fore.YELLOW,
-    Fore.GREEN,
-    Fore.RED,
-    Fore.BLUE
-]
+# pylint: disable=C0209
 
 AUX_OPTION_PATTERN = re.compile(r"(.+)=\((string|bool|int)\)(.+)")
 
-class ColorManager:
-    """
-    ColorManager manages the current output color used by the formatter.
-    It also stores the thread to color assignments.
-    """
-    def __init__(self):
-        self._current_color = None
-        self._next_color = 0
-        self._thread_colors = {}
-
-    def update_current_color(self, thread_id):
-        """
-        Get or assign a color to a thread.
-        :param thread_id - the thread id to assign the color to
-        """
-        color = self._thread_colors.get(thread_id)
-        if not color:
-            color = PALETTE[self._next_color]
-            self._next_color += 1
-            if self._next_color >= len(PALETTE):
-                self._next_color = 0
-            self._thread_colors[thread_id] = color
-        self._current_color = color
-        return color
-
-    def get_current_color(self):
-        """
-        Get the current color in use for the formatter.
-        May return None.
-        :return - the current color in use
-        """
-        return self._current_color
+SESSION_TAG_FORMAT = "{} (pid {:d})".format
+REF_STATS_HEADER_FORMAT = "{:<16s}{:>10s}{:>10s}{:>12s}{:>12s}{:>12s}\n".format
+REF_STATS_ROW_FORMAT = "{:<16s}{:10d}{:10d}{:12d}{:12d}{:12d}\n".format
+QUEUE_DROPPED_FORMAT = "{}Dropped {:d} traced calls from the full " \
+    "message queue (maximum depth {:d}).{}\n".format
 
-class TraceFormatter:
+def _get_version():
+    # pylint: disable=import-outside-toplevel
+    try:
+        from importlib.metadata import version
+    except ImportError:
+        # importlib.metadata is only available from Python 3.8.
+        from pkg_resources import get_distribution
+        return get_distribution("jnitrace").version
+    return version("jnitrace")
+
+class _VersionAction(argparse.Action):
     """
-    TraceFormatter class to take output from the Frida script and print it in
-    a readable way for the user.
+    Print the installed version of jnitrace and exit. The version is only
+    looked up when the option is given, as finding it can import
+    pkg_resources, which is slow to load.
     """
-    def __init__(self, _config, _buffer_output):
-        self._config = _config
-        self._buffer_output = _buffer_output
-
-        self._current_ts = None
-        self._color_manager = ColorManager()
-        self._output_buffer = []
-        self._is_64b = False
-
-    def _print_thread_id(self, thread_id):
-        print("{}{:16s}/* TID {:d} */{}".format(
-            Fore.WHITE,
-            self._color_manager.get_current_color(),
-            thread_id,
-            Style.RESET_ALL
-        ))
-
-    def _print_method_name(self, struct_type, name):
-        print("{}{:7d} ms {}[+] {}->{}{}".format(
-            Fore.WHITE,
-            self._current_ts,
-            self._color_manager.get_current_color(),
-            struct_type,
-            name,
-            Style.RESET_ALL
-        ))
-
-    @classmethod
-    def _get_data_metadata(cls, arg_type, value):
-        opt = None
-        if arg_type == "jboolean":
-            if value == 0:
-                opt = "false"
-            else:
-                opt = "true"
-        return opt
-
-    def _print_data_prefix(self):
-        print("{}{:7d} ms {}|".format(
-            Fore.WHITE,
-            self._current_ts,
-            self._color_manager.get_current_color()
-        ), end="")
-
-    # pylint: disable=too-many-arguments
-    def _print_data_value(self, sym, value, arg_type=None, opt=None, padding=0):
-        if not opt:
-            opt = self._get_data_metadata(arg_type, value)
-
-        self._print_data_prefix()
-
-        print(sym, end=" ")
-
-        if padding > 0:
-            print(" " * padding, end="")
-
-        if arg_type:
-            print(("{:" + str(17 - padding) + "s}: {}").format(
-                arg_type,
-                value
-            ), end="")
-        else:
-            print(value, end="")
-
-        if opt:
-            print("    {{ {} }}".format(
-                opt
-            ), end="")
-
-        print(Style.RESET_ALL)
-
-    def _print_data(self, block, arg_type, padding, data):
-        self._print_data_value(
-            block["sym"],
-            block["data"]["value"],
-            arg_type=arg_type,
-            opt=block["data"].get("metadata"),
-            padding=padding
-        )
-
-        if self._config["show_data"]:
-            self._print_additional_data(block["data"], data)
-
-    def _print_arg_data(self, arg, arg_type=None, padding=0, data=None):
-        block = {
-            "sym": "-",
-            "data": arg
-        }
-        self._print_data(block, arg_type, padding, data)
-
-    def _print_arg_sub_data(self, arg, arg_type=None, opt=None, padding=4):
-        self._print_data_value(
-            ":",
-            arg,
-            arg_type=arg_type,
-            opt=opt,
-            padding=padding
-        )
-
-    def _print_ret_data(self, ret, ret_type=None, padding=0, data=None):
-        block = {
-            "sym": "=",
-            "data": ret
-        }
-        self._print_data(block, ret_type, padding, data)
-
-    def _print_additional_data(self, arg, data):
-        if "data" in arg and isinstance(arg["data"], list):
-            for jni_method in arg["data"]:
-                self._print_arg_sub_data(
-                    "{} - {}{}".format(
-                        jni_method["addr"]["value"],
-                        jni_method["name"]["data"],
-                        jni_method["sig"]["data"]
-                    )
-                )
-        else:
-            h_d_data = None
-            if "data_for" in arg or "has_data" in arg:
-                h_d_data = data
-            elif "data" in arg:
-                if isinstance(arg["data"], (str, int)):
-                    self._print_arg_sub_data(
-                        arg["data"]
-                    )
-                else:
-                    h_d_data = arg["data"]
-
-            if h_d_data:
-                h_d = hexdump.hexdump(h_d_data, result="return").split("\n")
-                for line in h_d:
-                    self._print_arg_sub_data(
-                        line[1:]
-                    )
-
-    def _print_args(self, method, args, java_params, data):
-        jni_args = method["args"]
-        add_java_args = False
-        for i, _ in enumerate(jni_args):
-            arg_type = method["args"][i]
-            if arg_type in ["...", "va_list", "jvalue*"]:
-                add_java_args = True
-
-            if arg_type == "...":
-                break
-
-            arg = args[i]
-
-            self._print_arg_data(
-                arg,
-                arg_type=arg_type,
-                data=data
-            )
-
-        if add_java_args:
-            if method["args"][-1] == "...":
-                arg_offset = 1
-                padding = 0
-            else:
-                padding = 4
-                arg_offset = 0
-            for i, java_param in enumerate(java_params):
-                arg = args[i + len(jni_args) - arg_offset]
-                self._print_arg_sub_data(
-                    arg["value"],
-                    arg_type=java_param,
-                    opt=arg.get("metadata"),
-                    padding=padding
-                )
-
-    @classmethod
-    def _create_backtrace_symbol(cls, module, symbol):
-        symbol_name = symbol["name"]
-        module_name = module["name"]
-        if not symbol_name:
-            symbol_name = hex(
-                int(symbol["address"], 16) - int(module["base"], 16)
-            )
-        if "+" not in symbol_name:
-            return module_name + "!" + symbol_name
-        return symbol_name
-
-    def _calculate_backtrace_lengths(self, backtrace):
-        max_name = 0
-        max_len = 0
-        size = 10
-
-        for b_t in backtrace:
-            if not b_t["module"]:
-                break
+    def __init__(self, option_strings, dest=argparse.SUPPRESS,
+                 default=argparse.SUPPRESS, help=None):
+        # pylint: disable=redefined-builtin
+        super().__init__(option_strings=option_strings, dest=dest,
+                         default=default, nargs=0, help=help)
 
-            if len(b_t["address"]) > 10:
-                self._is_64b = True
-
-            if self._is_64b:
-                size = 18
-            else:
-                size = 10
-
-            break
-
-        for b_t in backtrace:
-            if not b_t["module"]:
-                break
-
-            symbol_name = self._create_backtrace_symbol(
-                b_t["module"], b_t["symbol"]
-            )
-
-            b_t_len = len(("|-> {:>" + str(size) + "s}: {} ({}:{})").format(
-                b_t["address"],
-                symbol_name,
-                b_t["module"]["name"],
-                b_t["module"]["base"]
-            ))
-
-            if b_t_len > max_len:
-                max_len = b_t_len
-            if len(symbol_name) > max_name:
-                max_name = len(symbol_name)
-
-        return max_len, max_name, size
-
-    def _print_backtrace(self, backtrace):
-        max_len, max_name, size = self._calculate_backtrace_lengths(backtrace)
-
-        padding = "-" * (round(max_len / 2) - int(len("Backtrace") / 2))
-        print("{:7d} ms {}{padding}Backtrace{padding}{}".format(
-            self._current_ts,
-            self._color_manager.get_current_color(),
-            Style.RESET_ALL,
-            padding=padding
-        ))
-
-        for b_t in backtrace:
-            if not b_t["module"]:
-                break
-
-            symbol_name = self._create_backtrace_symbol(
-                b_t["module"], b_t["symbol"]
-            )
-
-            format_str = "{:7d} ms {}|-> {:>" \
-                            + str(size) + "s}: {:>" \
-                                + str(max_name) + "s} ({}:{}){}"
-
-            print(format_str.format(
-                self._current_ts,
-                self._color_manager.get_current_color(),
-                b_t["address"],
-                symbol_name,
-                b_t["module"]["name"],
-                b_t["module"]["base"],
-                Style.RESET_ALL
-            ))
-
-        print()
-
-    @classmethod
-    def _is_error(cls, message):
-        if message["type"] != "send" or message["payload"]["type"] == "error":
-            print("{}ERROR: {}{}".format(
-                Fore.RED,
-                str(message),
-                Style.RESET_ALL
-            ))
-            return True
-        return False
-
-    @classmethod
-    def _is_meta_message(cls, payload):
-        if payload["type"] == "tracked_library":
-            print('Traced library "{}" loaded from path "{}".'.format(
-                payload["library"].split("/")[-1],
-                "/".join(payload["library"].split("/")[0:-1])
-            ))
-            print()
-            return True
-        return False
-
-    def _print_method_call(self, payload, data):
-        struct_type = payload["call_type"]
-        method = payload["method"]
-        args = payload["args"]
-
-        self._print_thread_id(payload["thread_id"])
-        self._print_method_name(struct_type, method["name"])
-
-        args = payload["args"]
-        self._print_args(method, args, payload.get("java_params"), data)
-
-        if payload["ret"].get("value") is not None:
-            self._print_ret_data(
-                payload["ret"],
-                ret_type=method["ret"],
-                data=data
-            )
-
-        print()
-
-    def _update_output_buffer(self, payload, data):
-        record = {
-            "struct": payload["call_type"],
-            "method": payload["method"],
-            "thread_id": payload["thread_id"],
-            "timestamp": payload["timestamp"],
-        }
-
-        if "backtrace" in payload:
-            record["backtrace"] = payload["backtrace"]
-
-        args = []
-
-        for arg in payload["args"]:
-            output_arg = {
-                "value": arg["value"]
-            }
-            if "data_for" in arg:
-                output_arg["data"] = binascii.hexlify(data).decode()
-            elif "data" in arg:
-                output_arg["data"] = arg["data"]
-            if "metadata" in arg:
-                output_arg["metadata"] = arg["metadata"]
-            args.append(output_arg)
-
-        record["args"] = args
-
-        ret = {
-            "value": payload["ret"].get("value")
-        }
-
-        if "has_data" in payload["ret"]:
-            ret["data"] = binascii.hexlify(data).decode()
-        if "metadata" in payload["ret"]:
-            ret["metadata"] = payload["ret"]["metadata"]
-
-        record["ret"] = ret
-
-        if "java_params" in payload:
-            record["java_params"] = payload["java_params"]
-
-        self._output_buffer.append(record)
-
-    def get_output(self):
-        """
-        Get an array of the raw data displayed on the console.
-        :return - the raw output buffer
-        """
-        return self._output_buffer
-
-    def on_message(self, message, data):
-        """
-        Frida on_message callback, for formatting output data.
-        :param message - JSON formatted output
-        :param data - binary data for some JNI method calls
-        """
-        if TraceFormatter._is_error(message):
-            return
-
-        payload = message["payload"]
-
-        if TraceFormatter._is_meta_message(payload):
-            return
-
-        if self._buffer_output:
-            self._update_output_buffer(message["payload"], data)
-
-        self._current_ts = payload["timestamp"]
-
-        self._color_manager.update_current_color(payload["thread_id"])
-
-        self._print_method_call(payload, data)
-
-        if self._config["show_backtrace"]:
-            self._print_backtrace(payload["backtrace"])
-
-        print()
+    def __call__(self, parser, namespace, values, option_string=None):
+        sys.stdout.write("{} {}\n".format(parser.prog, _get_version()))
+        parser.exit()
 
 def _custom_script_on_message(message, data):
     print(message, data)
@@ -470,14 +80,20 @@ def _parse_aux_option(option):
 
     return (name, value)
 
-def _parse_args():
-    parser = argparse.ArgumentParser(usage="jnitrace [options] -l libname target")
+def _add_tracing_args(parser):
     parser.add_argument("-m", "--inject-method", choices=["spawn", "attach"],
                         default="spawn",
                         help="Specify how frida should inject into the "
                         "process.")
     parser.add_argument("-R", "--remote", nargs="?", const="127.0.0.1:27042",
-                        help="Connect to remote Frida server in the format IP:PORT")
+                        action="append", default=[],
+                        help="Connect to remote Frida server in the format "
+                        "IP:PORT. The option can be supplied multiple times "
+                        "to trace on several servers.")
+    parser.add_argument("-D", "--device", action="append", default=[],
+                        help="Trace on the device with an id. The option can "
+                        "be supplied multiple times. Defaults to the USB "
+                        "device when no device or remote is given.")
     parser.add_argument("-b", "--backtrace", choices=["fuzzy", "accurate", "none"],
                         default="accurate",
                         help="Print a backtrace from each JNI call.")
@@ -491,18 +107,142 @@ def _parse_args():
                         help="A list of library exports to avoid tracing from.")
     parser.add_argument("--hide-data", action="store_true",
                         help="Print contents of argument.")
+    parser.add_argument("--no-color", action="store_true",
+                        help="Print plain output without colors. This is "
+                        "the default when output is not a terminal.")
     parser.add_argument("--ignore-env", action="store_true",
                         help="Do not trace JNIEnv calls.")
     parser.add_argument("--ignore-vm", action="store_true",
                         help="Do not trace JavaVM calls.")
+    parser.add_argument("--no-agent-cache", action="store_true",
+                        help="Compile the agent from source instead of "
+                        "reusing the compiled agent cached by earlier runs.")
     parser.add_argument("-p", "--prepend", type=argparse.FileType("r"),
                         help="Prepend a Frida script to run before jnitrace does.")
     parser.add_argument("-a", "--append", type=argparse.FileType("r"),
                         help="Append a Frida script to run after jnitrace has started.")
-    parser.add_argument("-o", "--output", type=argparse.FileType("w"),
-                        help="Output trace data to a JSON formatted file.")
-    parser.add_argument("-v", "--version", action='version',
-                        version="%(prog)s " + __version__,
+    parser.add_argument("--batch-size", type=int, default=1,
+                        help="Number of trace records the agent packs into a "
+                        "single message. The default of 1 sends each record "
+                        "as soon as it is traced.")
+    parser.add_argument("--batch-interval", type=int, default=50,
+                        help="Maximum time in ms a batched record is held "
+                        "in the agent before being sent.")
+
+def _add_profiling_args(parser):
+    parser.add_argument("--summary", action="store_true",
+                        help="Count calls per method, thread and caller "
+                        "instead of printing each call.")
+    parser.add_argument("--top", type=int, default=20,
+                        help="Number of rows shown in the --summary, "
+                        "--latency-histogram and --ref-profile tables.")
+    parser.add_argument("--latency", action="store_true",
+                        help="Time each call with a monotonic clock from "
+                        "entry to return, and add its duration to the "
+                        "output.")
+    parser.add_argument("--latency-histogram", action="store_true",
+                        help="Collect a histogram of call durations per "
+                        "method and caller instead of printing each call, "
+                        "and show their percentiles.")
+    parser.add_argument("--ref-profile", action="store_true",
+                        help="Keep live local, global and weak global "
+                        "reference counts per thread and per call site "
+                        "instead of printing each call, and report threads "
+                        "close to filling their local reference table and "
+                        "call sites whose references keep growing.")
+    parser.add_argument("--local-ref-limit", type=int, default=512,
+                        help="Size of the local reference table --ref-profile "
+                        "warns about as a thread's local references near it.")
+    parser.add_argument("--stats", action="store_true",
+                        help="Measure the time the agent spends tracing each "
+                        "call and the time jnitrace spends formatting it. A "
+                        "status line is printed with each report from the "
+                        "agent, and a summary when tracing stops.")
+    parser.add_argument("--flight-recorder", type=int, default=0,
+                        metavar="N",
+                        help="Keep the last N calls in the agent and only "
+                        "send them when a trigger is hit: a call to "
+                        "FatalError or ThrowNew, an ExceptionOccurred call "
+                        "that finds a pending exception, a --flight-trigger "
+                        "match, or pressing enter. The default of 0 sends "
+                        "every call as it is traced.")
+    parser.add_argument("--flight-trigger", action="append", default=[],
+                        help="A regex matched against the JNIEnv or JavaVM "
+                        "method name and the export a call was made from. "
+                        "A match dumps the --flight-recorder calls.")
+    parser.add_argument("--report-interval", type=int, default=1000,
+                        help="Time in ms between the periodic reports sent "
+                        "by the agent.")
+
+def _add_capture_args(parser):
+    parser.add_argument("--max-data-bytes", type=int, default=0,
+                        help="Maximum number of bytes captured from each "
+                        "buffer. Larger buffers keep their head and tail "
+                        "along with their length and a checksum. The default "
+                        "of 0 captures whole buffers.")
+    parser.add_argument("--dedup-data", type=int, default=0, metavar="N",
+                        help="Send each captured buffer of at least N bytes "
+                        "from the agent only once, and refer to it by its "
+                        "digest in later calls. The default of 0 sends "
+                        "every buffer.")
+    parser.add_argument("--blob-dir",
+                        help="Store captured buffers once each in a content "
+                        "addressed directory, and write the digest of the "
+                        "buffer in -o records instead of its contents.")
+    parser.add_argument("--queue-size", type=int, default=10000,
+                        help="Maximum number of messages waiting to be "
+                        "formatted.")
+    parser.add_argument("--queue-policy", choices=POLICIES, default="block",
+                        help="What to do with new trace messages when the "
+                        "queue is full: wait for space, drop the oldest "
+                        "queued trace message, or drop the new one.")
+    parser.add_argument("--ref-capacity", type=int, default=65536,
+                        help="Maximum number of entries kept in each of the "
+                        "agent's reference name caches. The least recently "
+                        "used entries are evicted first. 0 disables the "
+                        "limit.")
+    parser.add_argument("--ref-stats", action="store_true",
+                        help="Print the size, hit and miss counters of the "
+                        "agent's reference name caches when tracing stops.")
+    parser.add_argument("--sample-every", type=int, default=1,
+                        help="Only trace every Nth call to each method.")
+    parser.add_argument("--rate-limit", type=float, default=0,
+                        help="Maximum number of calls per second traced for "
+                        "each method. The default of 0 disables the limit.")
+    parser.add_argument("--rate-burst", type=int, default=None,
+                        help="Number of calls that can be traced in a burst "
+                        "before --rate-limit applies. Defaults to the rate "
+                        "limit.")
+    parser.add_argument("--rate-limit-by", choices=["method", "thread"],
+                        default="method",
+                        help="Apply --sample-every and --rate-limit to each "
+                        "method, or to each method on each thread.")
+
+def _add_output_args(parser):
+    parser.add_argument("-o", "--output",
+                        help="Stream trace data to a file. When tracing "
+                        "several targets, records from all of them are "
+                        "written to the file unless the path contains "
+                        "{target} or {pid}, which gives each target its own "
+                        "file.")
+    parser.add_argument("--output-format", choices=["ndjson", "binary"],
+                        default="ndjson",
+                        help="The format of the -o file, either newline "
+                        "delimited JSON or the compact binary trace format.")
+    parser.add_argument("--trace-events",
+                        help="Stream trace data to a file in the Chrome "
+                        "trace event format, alongside any -o file, to view "
+                        "the calls of each thread on a timeline in Perfetto "
+                        "or chrome://tracing. Calls are drawn with their "
+                        "duration when traced with --latency.")
+
+def _parse_args():
+    parser = argparse.ArgumentParser(usage="jnitrace [options] -l libname target")
+    _add_tracing_args(parser)
+    _add_profiling_args(parser)
+    _add_capture_args(parser)
+    _add_output_args(parser)
+    parser.add_argument("-v", "--version", action=_VersionAction,
                         help="Show the installed version of jnitrace.")
     parser.add_argument("-l", "--libraries", required=True, action="append",
                         help="Specify a native libraries to track JNI "
@@ -512,126 +252,349 @@ def _parse_args():
     parser.add_argument("--aux", action="append", metavar="name=(string|bool|int)value",
                         dest="aux", default=[],
                         help="set aux option when spawning")
-    parser.add_argument("target",
-                        help="The name of the application to trace.")
+    parser.add_argument("target", nargs="+",
+                        help="The name of the application to trace. Several "
+                        "applications can be traced at once.")
     args = parser.parse_args()
 
     if args.ignore_env and args.ignore_vm:
         parser.error('Ignoring both the JavaVM and JNIEnv will result in no output.')
+    if args.summary and args.latency_histogram:
+        parser.error('--summary and --latency-histogram cannot be combined.')
 
     return args
 
-def _wait_for_finish():
-    print("{}Tracing. Press any key to quit...{}".format(
-        Fore.GREEN,
-        Style.RESET_ALL
-    ))
+def _flush_script(script):
     try:
-        input()
-    except KeyboardInterrupt:
+        script.exports.flush()
+    except (frida.InvalidOperationError, frida.TransportError):
         pass
 
-def _finish(args, device, pid, scripts):
-    print('Stopping application (name={}, pid={})...'.format(
-        args.target,
-        pid
-    ), end="")
+def _print_ref_stats(script):
     try:
-        if args.append:
-            scripts["append"].unload()
-        scripts["script"].unload()
-        if args.prepend:
-            scripts["prepend"].unload()
-
-        device.kill(pid)
-    except frida.InvalidOperationError:
-        pass
-    finally:
-        print("stopped.")
+        stats = script.exports.ref_stats()
+    except (frida.InvalidOperationError, frida.TransportError):
+        return
 
-def main():
+    print(REF_STATS_HEADER_FORMAT(
+        "Cache", "Size", "Capacity", "Hits", "Misses", "Evictions"
+    ), end="")
+    for name, cache in stats.items():
+        print(REF_STATS_ROW_FORMAT(
+            name, cache["size"], cache["capacity"], cache["hits"],
+            cache["misses"], cache["evictions"]
+        ), end="")
+    print()
+
+def _print_queue_stats(pipeline):
+    stats = pipeline.stats()
+    if stats["dropped"]:
+        print(QUEUE_DROPPED_FORMAT(
+            Fore.RED,
+            stats["dropped"],
+            stats["max_depth"],
+            Style.RESET_ALL
+        ))
+
+def _get_devices(args):
+    devices = []
+    if args.remote or args.device:
+        device_manager = frida.get_device_manager()
+        for remote in args.remote:
+            devices.append(device_manager.add_remote_device(remote))
+        for device_id in args.device:
+            devices.append(frida.get_device(device_id))
+    else:
+        devices.append(frida.get_usb_device(3))
+    return devices
+
+def _is_per_target_output(args):
+    return args.output is not None and \
+        ("{target}" in args.output or "{pid}" in args.output)
+
+def _create_config(args):
+    return {
+        "libraries": args.libraries,
+        "backtrace": args.backtrace,
+        "show_data": not args.hide_data,
+        "include": args.include,
+        "exclude": args.exclude,
+        "include_export": args.include_export,
+        "exclude_export": args.exclude_export,
+        "env": not args.ignore_env,
+        "vm": not args.ignore_vm,
+        "batch_size": args.batch_size,
+        "batch_interval": args.batch_interval,
+        "summary": args.summary,
+        "report_interval": args.report_interval,
+        "stats": args.stats,
+        "latency": args.latency,
+        "latency_histogram": args.latency_histogram,
+        "ref_profile": args.ref_profile,
+        "flight_recorder": args.flight_recorder,
+        "flight_trigger": args.flight_trigger,
+        "max_data_bytes": args.max_data_bytes,
+        "dedup_data": args.dedup_data,
+        "ref_capacity": args.ref_capacity,
+        "sample_every": args.sample_every,
+        "rate_limit": args.rate_limit,
+        "rate_burst": args.rate_burst or args.rate_limit,
+        "rate_limit_by": args.rate_limit_by
+    }
+
+# pylint: disable=too-many-instance-attributes
+class TraceSession:
     """
-    Main function to process command arguments and to inject Frida.
+    TraceSession traces one target on one device, with its own formatter
+    state and message queue. Several sessions can run at once and share the
+    console and output writers.
     """
-    jscode = resource_string("jnitrace.build", "jnitrace.js").decode()
-    jscode = jscode.replace("IS_IN_REPL = true", "IS_IN_REPL = false")
+    def __init__(self, args, device, target, options):
+        self._args = args
+        self._device = device
+        self._target = target
+        self._options = options
+        self._pid = None
+        self._scripts = {}
+        self._formatter = None
+        self._pipeline = None
+
+    def _create_formatter(self):
+        b_t = False
+
+        if self._args.backtrace == "accurate":
+            b_t = True
+        elif self._args.backtrace == "fuzzy":
+            b_t = True
+
+        writers = list(self._options["writers"])
+        if _is_per_target_output(self._args):
+            writers.append(create_writer(
+                self._args.output.format(target=self._target, pid=self._pid),
+                self._args.output_format
+            ))
 
-    args = _parse_args()
+        summary = None
+        if self._args.summary:
+            summary = CallSummary(self._args.top)
+        elif self._args.latency_histogram:
+            summary = LatencySummary(self._args.top)
+
+        config = {
+            "show_backtrace": b_t,
+            "show_data": not self._args.hide_data,
+            "color": self._options["color"],
+            "target": self._target,
+            "pid": self._pid,
+            "blob_refs": self._args.blob_dir is not None
+        }
+        if self._options["tagged"]:
+            config["tag"] = SESSION_TAG_FORMAT(self._target, self._pid)
 
-    b_t = False
+        stats = None
+        if self._args.stats:
+            stats = TracerStats()
 
-    if args.backtrace == "accurate":
-        b_t = True
-    elif args.backtrace == "fuzzy":
-        b_t = True
+        refs = None
+        if self._args.ref_profile:
+            refs = RefPressure(self._args.local_ref_limit, self._args.top)
 
-    formatter = TraceFormatter({
-        "show_backtrace": b_t,
-        "show_data": not args.hide_data
-    }, args.output is not None)
+        return TraceFormatter(
+            config, writers, self._options["console"], _summary=summary,
+            _stats=stats, _blobs=self._options["blobs"], _refs=refs
+        )
 
-    if args.remote:
-        device_manager = frida.get_device_manager()
-        device = device_manager.add_remote_device(args.remote)
-    else:
-        device = frida.get_usb_device(3)
-
-    if args.inject_method == "spawn":
-        aux_kwargs = {}
-        if args.aux is not None:
-            # pylint: disable=R1717
-            aux_kwargs = dict([_parse_aux_option(o) for o in args.aux])
-        pid = device.spawn([args.target], **aux_kwargs)
-    else:
-        pid = device.get_process(args.target).pid
+    def _load_custom_script(self, session, name, source):
+        script = session.create_script(source)
+        script.on("message", _custom_script_on_message)
+        script.load()
+        self._scripts[name] = script
 
-    session = device.attach(pid)
-    scripts = {}
+    def start(self):
+        """
+        Spawn or attach to the target and start tracing it.
+        """
+        args = self._args
+        if args.inject_method == "spawn":
+            aux_kwargs = {}
+            if args.aux is not None:
+                # pylint: disable=R1717
+                aux_kwargs = dict([_parse_aux_option(o) for o in args.aux])
+            self._pid = self._device.spawn([self._target], **aux_kwargs)
+        else:
+            self._pid = self._device.get_process(self._target).pid
 
-    if args.prepend:
-        prepend = session.create_script(args.prepend.read())
-        prepend.on("message", _custom_script_on_message)
-        prepend.load()
-        args.prepend.close()
-        scripts["prepend"] = prepend
-
-    script = session.create_script(jscode)
-    script.on("message", formatter.on_message)
-    script.load()
-    scripts["script"] = script
-
-    script.post({
-        "type": "config",
-        "payload": {
-            "libraries": args.libraries,
-            "backtrace": args.backtrace,
-            "show_data": not args.hide_data,
-            "include": args.include,
-            "exclude": args.exclude,
-            "include_export": args.include_export,
-            "exclude_export": args.exclude_export,
-            "env": not args.ignore_env,
-            "vm": not args.ignore_vm
-        }
-    })
+        self._formatter = self._create_formatter()
+        session = self._device.attach(self._pid)
 
-    if args.append:
-        append = session.create_script(args.append.read())
-        append.on("message", _custom_script_on_message)
-        append.load()
-        args.append.close()
-        scripts["append"] = append
+        if self._options["prepend"] is not None:
+            self._load_custom_script(
+                session, "prepend", self._options["prepend"]
+            )
+
+        self._pipeline = MessagePipeline(
+            self._formatter.on_message, args.queue_size, args.queue_policy
+        )
+
+        script = self._options["agent"].create_script(session)
+        script.on("message", self._pipeline.on_message)
+        script.load()
+        self._scripts["script"] = script
+
+        script.post({
+            "type": "config",
+            "payload": _create_config(args)
+        })
+
+        if self._options["append"] is not None:
+            self._load_custom_script(
+                session, "append", self._options["append"]
+            )
+
+        if args.inject_method == "spawn":
+            self._device.resume(self._pid)
+
+    def configure(self, options, formatter):
+        """
+        Change the settings of a running trace.
+        :param options - the agent config keys to change
+        :param formatter - the formatter config keys to change
+        """
+        self._formatter.update_config(formatter)
+        if not options:
+            return
+        try:
+            self._scripts["script"].exports.configure(options)
+        except (frida.InvalidOperationError, frida.TransportError):
+            pass
+
+    def dump_flight_recorder(self):
+        """
+        Ask the agent to send the calls held in its flight recorder.
+        """
+        try:
+            self._scripts["script"].exports.dump_flight_recorder()
+        except (frida.InvalidOperationError, frida.TransportError):
+            pass
 
-    if args.inject_method == "spawn":
-        device.resume(pid)
+    def report(self):
+        """
+        Write out everything traced so far along with the final reports.
+        """
+        script = self._scripts["script"]
+        _flush_script(script)
+        self._pipeline.drain()
+        self._formatter.flush()
+        self._formatter.print_final_report()
+        if self._args.ref_stats:
+            _print_ref_stats(script)
+
+        _print_queue_stats(self._pipeline)
+
+    def stop(self):
+        """
+        Unload the scripts, kill the target and close the output.
+        """
+        print('Stopping application (name={}, pid={})...'.format(
+            self._target,
+            self._pid
+        ), end="")
+        try:
+            for name in ("append", "script", "prepend"):
+                if name in self._scripts:
+                    self._scripts[name].unload()
+
+            self._device.kill(self._pid)
+        except frida.InvalidOperationError:
+            pass
+        finally:
+            print("stopped.")
+
+        self._pipeline.close()
+        self._formatter.close()
+
+def _start_sessions(sessions):
+    started = []
+
+    def start(session):
+        try:
+            session.start()
+        except (frida.InvalidOperationError, frida.InvalidArgumentError,
+                frida.ProcessNotFoundError, frida.ExecutableNotFoundError,
+                frida.NotSupportedError, frida.PermissionDeniedError,
+                frida.ServerNotRunningError, frida.TransportError,
+                frida.TimedOutError) as error:
+            print(ERROR_FORMAT(Fore.RED, str(error), Style.RESET_ALL), end="")
+            return
+        started.append(session)
 
-    _wait_for_finish()
+    threads = [
+        threading.Thread(target=start, args=(session,))
+        for session in sessions
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
 
-    if args.output:
-        json.dump(formatter.get_output(), args.output, indent=4)
-        args.output.close()
+    return [session for session in sessions if session in started]
+
+def main():
+    """
+    Main function to process command arguments and to inject Frida.
+    """
+    args = _parse_args()
+
+    color = not args.no_color and sys.stdout.isatty()
+    init(strip=not color)
+
+    devices = _get_devices(args)
+    count = len(devices) * len(args.target)
+
+    writers = []
+    if args.output and not _is_per_target_output(args):
+        writers.append(create_writer(args.output, args.output_format))
+    if args.trace_events:
+        writers.append(TraceEventWriter(args.trace_events))
+    if count > 1:
+        writers = [SharedWriter(writer) for writer in writers]
+
+    options = {
+        "agent": AgentLoader(cache=not args.no_agent_cache),
+        "color": color,
+        "console": ConsoleWriter(sys.stdout),
+        "writers": writers,
+        "tagged": count > 1,
+        "blobs": None,
+        "prepend": None,
+        "append": None
+    }
+    if args.dedup_data > 0 or args.blob_dir:
+        options["blobs"] = BlobStore(args.blob_dir)
+    if args.prepend:
+        options["prepend"] = args.prepend.read()
+        args.prepend.close()
+    if args.append:
+        options["append"] = args.append.read()
+        args.append.close()
 
-    _finish(args, device, pid, scripts)
+    sessions = _start_sessions([
+        TraceSession(args, device, target, options)
+        for device in devices for target in args.target
+    ])
+    if sessions:
+        CommandChannel(args, sessions).run()
+
+    for session in sessions:
+        session.report()
+    for session in sessions:
+        session.stop()
+
+    if count > 1:
+        for writer in writers:
+            writer.close_shared()
+    if options["blobs"] is not None:
+        options["blobs"].close()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,148 @@
+"""
+Latency histograms used by jnitrace --latency-histogram. Instead of a record
+per call, the agent periodically reports a histogram of call durations for
+each method and return address, which are merged here so percentiles cover
+the whole run.
+"""
+
+import time
+
+from jnitrace.summary import CallSummary, describe_caller
+
+# pylint: disable=C0209
+
+# The bucket layout matches getBucket in the agent's latency_histogram.ts:
+# exact nanoseconds below LINEAR_LIMIT, then SUB_BUCKETS buckets for every
+# power of two.
+LINEAR_LIMIT = 16
+SUB_BUCKETS = 8
+SUB_BUCKET_BITS = 3
+FIRST_EXPONENT = 4
+NS_PER_US = 1000
+US_PER_MS = 1000
+
+PERCENTILES = (50, 90, 99)
+
+LATENCY_HEADER_FORMAT = "{}{:>10s}  {:>10s}  {:>9s}  {:>9s}  {:>9s}  {:>9s}  " \
+    "{:>9s}  {:<40s}  {}{}\n".format
+LATENCY_ROW_FORMAT = "{:10d}  {:10.1f}  {:9.1f}  {:9.1f}  {:9.1f}  {:9.1f}  " \
+    "{:9.1f}  {:<40s}  {}\n".format
+LATENCY_FOOTER_FORMAT = "\n{} calls to {} call sites in {:.1f}s, " \
+    "times in us\n\n".format
+
+def get_bucket_range(bucket):
+    """
+    Get the durations counted by a histogram bucket.
+    :param bucket - the bucket index reported by the agent
+    :return - a tuple of the lowest and highest duration in ns
+    """
+    if bucket < LINEAR_LIMIT:
+        return bucket, bucket
+
+    exponent = (bucket - LINEAR_LIMIT) // SUB_BUCKETS + FIRST_EXPONENT
+    sub = (bucket - LINEAR_LIMIT) % SUB_BUCKETS
+    width = 1 << (exponent - SUB_BUCKET_BITS)
+    low = (SUB_BUCKETS + sub) * width
+    return low, low + width - 1
+
+class LatencyHistogram:
+    """
+    LatencyHistogram merges the durations of the calls made to a method from
+    a call site.
+    """
+    def __init__(self):
+        self.count = 0
+        self.total_us = 0.0
+        self.max_us = 0.0
+        self._buckets = {}
+
+    def update(self, call):
+        """
+        Add a report of durations from the agent.
+        :param call - an entry of a latency_histogram message
+        """
+        self.count += call["count"]
+        self.total_us += call["total_us"]
+        self.max_us = max(self.max_us, call["max_us"])
+        for bucket, count in call["buckets"]:
+            self._buckets[bucket] = self._buckets.get(bucket, 0) + count
+
+    def mean_us(self):
+        """
+        Get the mean duration of the calls.
+        :return - the mean duration in microseconds
+        """
+        if not self.count:
+            return 0.0
+        return self.total_us / self.count
+
+    def percentile(self, percent):
+        """
+        Estimate a percentile of the call durations from the buckets.
+        :param percent - the percentile to estimate, from 0 to 100
+        :return - the duration in microseconds
+        """
+        rank = self.count * percent / 100
+        seen = 0
+        for bucket in sorted(self._buckets):
+            seen += self._buckets[bucket]
+            if seen >= rank:
+                low, high = get_bucket_range(bucket)
+                return min((low + high) / 2 / NS_PER_US, self.max_us)
+        return self.max_us
+
+class LatencySummary(CallSummary):
+    """
+    LatencySummary accumulates the latency histograms reported by the agent
+    and renders the call sites that spent the most time in JNI calls.
+    """
+    def __init__(self, top=20):
+        super().__init__(top)
+        self._histograms = {}
+
+    def update(self, calls, modules):
+        """
+        Add a report of latency histograms from the agent.
+        :param calls - the histograms reported since the last update
+        :param modules - the backtrace modules reported by the agent
+        """
+        for call in calls:
+            key = (
+                call["call_type"] + "->" + call["method"],
+                describe_caller(call["caller"], modules)
+            )
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = LatencyHistogram()
+            histogram.update(call)
+            self._total += call["count"]
+
+    def render(self, color="", reset=""):
+        """
+        Render the call sites with the most time spent in calls so far.
+        :param color - the color to print the table header in
+        :param reset - the code to reset the color after the header
+        :return - the formatted table
+        """
+        parts = [LATENCY_HEADER_FORMAT(
+            color, "Calls", "Total ms", "Mean", "p50", "p90", "p99", "Max",
+            "Method", "Caller", reset
+        )]
+
+        ranked = sorted(
+            self._histograms.items(), key=lambda item: item[1].total_us,
+            reverse=True
+        )
+        for (method, caller), histogram in ranked[:self._top]:
+            parts.append(LATENCY_ROW_FORMAT(
+                histogram.count, histogram.total_us / US_PER_MS,
+                histogram.mean_us(),
+                *[histogram.percentile(p) for p in PERCENTILES],
+                histogram.max_us, method, caller
+            ))
+
+        parts.append(LATENCY_FOOTER_FORMAT(
+            self._total, len(self._histograms),
+            time.monotonic() - self._start
+        ))
+        return "".join(parts)
@@ -0,0 +1,323 @@
+"""
+Writers used to store the data traced by jnitrace, along with a tool to
+convert a stored trace into a pretty printed JSON array.
+"""
+
+import argparse
+import binascii
+import json
+import threading
+import time
+
+from jnitrace.binary_trace import BinaryTraceReader, BinaryTraceWriter
+from jnitrace.blobs import BlobStore
+
+# pylint: disable=C0209
+
+JSON_INDENT = "    "
+US_PER_MS = 1000
+UNKNOWN_PID = 0
+INTERNAL_KEYS = ("data_for", "has_data")
+
+def _encode_bytes(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return binascii.hexlify(value).decode()
+    raise TypeError("{} is not JSON serializable".format(type(value)))
+
+def _decode_bytes(field):
+    if ("data_for" in field or "has_data" in field) and \
+            isinstance(field.get("data"), str):
+        field["data"] = binascii.unhexlify(field["data"])
+
+class NDJSONWriter:
+    """
+    NDJSONWriter streams trace records to a file as they arrive, writing each
+    record as a single line of JSON with captured buffers hex encoded.
+    Records are never held in memory and the file is flushed periodically, so
+    a trace survives the tool being killed.
+    """
+    def __init__(self, path, flush_interval=1.0, flush_records=1000):
+        # pylint: disable=consider-using-with
+        self._file = open(path, "w", encoding="utf-8")
+        self._flush_interval = flush_interval
+        self._flush_records = flush_records
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def write_record(self, record):
+        """
+        Append a record to the output file.
+        :param record - the trace record to write
+        """
+        self._file.write(json.dumps(
+            record, separators=(",", ":"), default=_encode_bytes
+        ))
+        self._file.write("\n")
+        self._written()
+
+    def _written(self):
+        self._pending += 1
+
+        if self._pending >= self._flush_records or \
+                time.monotonic() - self._last_flush >= self._flush_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Flush all written records to disk.
+        """
+        self._file.flush()
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        """
+        Flush and close the output file.
+        """
+        self._file.close()
+
+def _describe_value(field):
+    if "metadata" in field:
+        return "{} {{ {} }}".format(field.get("value"), field["metadata"])
+    return field.get("value")
+
+class TraceEventWriter(NDJSONWriter):
+    """
+    TraceEventWriter streams trace records to a file in the Chrome trace
+    event format, which can be opened in Perfetto or chrome://tracing to see
+    the calls of each thread on a timeline. Calls timed with --latency are
+    drawn with their duration, and other calls as instant events. The file
+    is a JSON array written one event per line, and as the closing bracket
+    is optional in the format, a trace cut short can still be loaded.
+    """
+    def __init__(self, path, flush_interval=1.0, flush_records=1000):
+        super().__init__(path, flush_interval, flush_records)
+        self._separator = "[\n"
+        self._threads = set()
+
+    def _write_event(self, event):
+        self._file.write(self._separator)
+        self._file.write(json.dumps(event, separators=(",", ":")))
+        self._separator = ",\n"
+
+    def _write_thread_names(self, record, pid, tid):
+        # Perfetto names tracks by process and thread, which are described
+        # once with metadata events.
+        if pid not in self._threads and "target" in record:
+            self._threads.add(pid)
+            self._write_event({
+                "name": "process_name", "ph": "M", "pid": pid,
+                "args": {"name": record["target"]}
+            })
+        if (pid, tid) not in self._threads:
+            self._threads.add((pid, tid))
+            self._write_event({
+                "name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                "args": {"name": "TID {}".format(tid)}
+            })
+
+    def write_record(self, record):
+        """
+        Append a record to the output file as a trace event.
+        :param record - the trace record to write
+        """
+        pid = record.get("pid") or UNKNOWN_PID
+        tid = record["thread_id"]
+        self._write_thread_names(record, pid, tid)
+
+        method = record["method"]
+        # The arguments of a Java method called through ... follow the
+        # JNI arguments, as they do after a va_list or jvalue*.
+        arg_types = [
+            arg_type for arg_type in method["args"] if arg_type != "..."
+        ] + record.get("java_params", [])
+        args = {
+            "{}: {}".format(i, arg_type): _describe_value(arg)
+            for i, (arg_type, arg) in enumerate(zip(arg_types, record["args"]))
+        }
+        if method["ret"] != "void":
+            args["ret"] = _describe_value(record["ret"])
+
+        event = {
+            "name": method["name"],
+            "cat": record["struct"],
+            "pid": pid,
+            "tid": tid,
+            "args": args
+        }
+        if "duration_us" in record:
+            event.update(
+                ph="X", ts=record["start_us"], dur=record["duration_us"]
+            )
+        else:
+            event.update(ph="i", s="t", ts=record["timestamp"] * US_PER_MS)
+
+        self._write_event(event)
+        self._written()
+
+    def close(self):
+        """
+        Close the event array and the output file.
+        """
+        if self._separator == "[\n":
+            self._file.write("[")
+        self._file.write("\n]\n")
+        super().close()
+
+class SharedWriter:
+    """
+    SharedWriter lets several traced sessions write to the same output file.
+    Writes are serialised with a lock. Sessions closing the writer only flush
+    it, and the file is closed with close_shared once every session is done.
+    """
+    def __init__(self, writer):
+        self._writer = writer
+        self._lock = threading.Lock()
+
+    def write_record(self, record):
+        """
+        Append a record to the output file.
+        :param record - the trace record to write
+        """
+        with self._lock:
+            self._writer.write_record(record)
+
+    def flush(self):
+        """
+        Flush all written records to disk.
+        """
+        with self._lock:
+            self._writer.flush()
+
+    def close(self):
+        """
+        Flush the records written by a session that has finished.
+        """
+        self.flush()
+
+    def close_shared(self):
+        """
+        Close the output file.
+        """
+        with self._lock:
+            self._writer.close()
+
+def create_writer(path, output_format):
+    """
+    Create a writer for a trace output file.
+    :param path - the path of the output file
+    :param output_format - either "ndjson" or "binary"
+    :return - the trace writer
+    """
+    if output_format == "binary":
+        return BinaryTraceWriter(path)
+    return NDJSONWriter(path)
+
+def decode_record(record):
+    """
+    Decode the hex encoded buffers in a record read from an NDJSON trace.
+    :param record - the record parsed from JSON
+    :return - the record with captured buffers as bytes
+    """
+    for arg in record["args"]:
+        _decode_bytes(arg)
+    _decode_bytes(record["ret"])
+    return record
+
+def read_ndjson(path):
+    """
+    Lazily read the records stored in an NDJSON trace file. A partial last
+    line, left by a jnitrace that was killed mid write, is skipped.
+    :param path - the path of the trace file
+    :return - a generator of trace records
+    """
+    with open(path, "r", encoding="utf-8") as trace:
+        for line in trace:
+            if not line.endswith("\n"):
+                break
+            if line.strip():
+                yield decode_record(json.loads(line))
+
+def _read_records(path):
+    if BinaryTraceReader.is_binary_trace(path):
+        with BinaryTraceReader(path) as reader:
+            yield from reader
+    else:
+        yield from read_ndjson(path)
+
+def read_trace(path, blob_dir=None):
+    """
+    Lazily read the records stored in a trace file of either format.
+    :param path - the path of the trace file
+    :param blob_dir - the --blob-dir the trace was written with, to replace
+    the digests of captured buffers with their contents
+    :return - a generator of trace records
+    """
+    if blob_dir is None:
+        yield from _read_records(path)
+        return
+
+    blobs = BlobStore(blob_dir)
+    for record in _read_records(path):
+        yield blobs.resolve_record(record)
+
+def _strip_internal_keys(record):
+    # data_for and has_data only tell readers of -o traces which fields hold
+    # a buffer, and were never part of the JSON array.
+    def strip(field):
+        return {
+            key: value for key, value in field.items()
+            if key not in INTERNAL_KEYS
+        }
+
+    record = dict(record)
+    record["args"] = [strip(arg) for arg in record["args"]]
+    record["ret"] = strip(record["ret"])
+    return record
+
+def write_json_array(records, output):
+    """
+    Write records as the pretty printed JSON array produced by earlier
+    versions of jnitrace. Records are written one at a time, so the trace
+    does not need to fit in memory.
+    :param records - an iterable of trace records
+    :param output - the file object to write to
+    """
+    separator = "[\n"
+    for record in records:
+        output.write(separator)
+        output.write(JSON_INDENT)
+        output.write(
+            json.dumps(
+                _strip_internal_keys(record), indent=4, default=_encode_bytes
+            )
+            .replace("\n", "\n" + JSON_INDENT)
+        )
+        separator = ",\n"
+
+    if separator == "[\n":
+        output.write("[]")
+    else:
+        output.write("\n]")
+
+def convert_main():
+    """
+    Entry point to convert an NDJSON trace into a pretty printed JSON array.
+    """
+    parser = argparse.ArgumentParser(
+        usage="jnitrace-convert input output",
+        description="Convert a trace written by jnitrace -o into a JSON array."
+    )
+    parser.add_argument("input", help="The trace file written by jnitrace.")
+    parser.add_argument("output", type=argparse.FileType("w"),
+                        help="The path to write the JSON array to.")
+    parser.add_argument("--blob-dir",
+                        help="The --blob-dir the trace was written with, to "
+                        "include the buffers its records refer to.")
+    args = parser.parse_args()
+
+    write_json_array(read_trace(args.input, args.blob_dir), args.output)
+    args.output.close()
+
+if __name__ == '__main__':
+    convert_main()
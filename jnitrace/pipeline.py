@@ -0,0 +1,140 @@
+"""
+A bounded queue between Frida's message dispatch thread and the formatter.
+Messages are handed to a worker thread, so slow formatting or output does not
+hold up the delivery of messages from the agent.
+"""
+
+import collections
+import sys
+import threading
+import traceback
+
+POLICIES = ("block", "drop-oldest", "drop-newest")
+
+DROPPABLE_TYPES = ("trace_data", "trace_batch")
+
+def _is_droppable(item):
+    message = item[0]
+    return message["type"] == "send" and \
+        message["payload"].get("type") in DROPPABLE_TYPES
+
+def _count_records(item):
+    payload = item[0]["payload"]
+    if payload["type"] == "trace_batch":
+        return len(payload["records"])
+    return 1
+
+# pylint: disable=too-many-instance-attributes
+class MessagePipeline:
+    """
+    MessagePipeline queues messages from a Frida script and passes them to a
+    handler on a dedicated worker thread. When the queue is full, the policy
+    decides whether the caller blocks, the oldest queued trace message is
+    dropped, or the new trace message is dropped. Messages other than trace
+    records are never dropped, as later records depend on them. If no trace
+    message is queued to make room for a new one, the new one is dropped.
+    """
+    def __init__(self, handler, max_size=10000, policy="block"):
+        self._handler = handler
+        self._max_size = max_size
+        self._policy = policy
+        self._queue = collections.deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._idle = threading.Condition(self._lock)
+        self._busy = False
+        self._closed = False
+
+        self.processed = 0
+        self.dropped = 0
+        self.max_depth = 0
+
+        self._worker = threading.Thread(target=self._run)
+        self._worker.daemon = True
+        self._worker.start()
+
+    def _drop_oldest(self):
+        for i, item in enumerate(self._queue):
+            if _is_droppable(item):
+                del self._queue[i]
+                self.dropped += _count_records(item)
+                return True
+        return False
+
+    def on_message(self, message, data):
+        """
+        Frida on_message callback, queueing the message for the worker.
+        :param message - JSON formatted output
+        :param data - binary data for some JNI method calls
+        """
+        item = (message, data)
+        with self._lock:
+            if len(self._queue) >= self._max_size:
+                if self._policy == "block":
+                    while len(self._queue) >= self._max_size:
+                        self._not_full.wait()
+                elif _is_droppable(item):
+                    if self._policy == "drop-newest" or \
+                            not self._drop_oldest():
+                        self.dropped += _count_records(item)
+                        return
+
+            self._queue.append(item)
+            self.max_depth = max(self.max_depth, len(self._queue))
+            self._not_empty.notify()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._queue and not self._closed:
+                    self._not_empty.wait()
+                if not self._queue:
+                    return
+                message, data = self._queue.popleft()
+                self._busy = True
+                self._not_full.notify()
+
+            try:
+                self._handler(message, data)
+            except Exception: # pylint: disable=broad-except
+                traceback.print_exc(file=sys.stderr)
+
+            with self._lock:
+                self._busy = False
+                self.processed += 1
+                if not self._queue:
+                    self._idle.notify_all()
+
+    def stats(self):
+        """
+        Get the current state of the queue.
+        :return - a dictionary of the queue depth, the deepest the queue has
+        been, the number of messages processed, and the number of trace
+        records dropped
+        """
+        with self._lock:
+            return {
+                "depth": len(self._queue),
+                "max_depth": self.max_depth,
+                "processed": self.processed,
+                "dropped": self.dropped
+            }
+
+    def drain(self):
+        """
+        Wait for the worker to handle every queued message.
+        """
+        with self._lock:
+            while self._queue or self._busy:
+                self._idle.wait()
+
+    def close(self):
+        """
+        Handle every queued message and stop the worker thread.
+        """
+        self.drain()
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify()
+        self._worker.join()
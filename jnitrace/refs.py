@@ -0,0 +1,159 @@
+"""
+Reference pressure reports used by jnitrace --ref-profile. Instead of a
+record per call, the agent keeps the live local references of each thread
+and the live global references, along with the call sites that created them,
+and periodically reports their counts. Threads close to filling their local
+reference table and call sites whose references keep piling up are flagged
+as the reports arrive.
+"""
+
+import time
+
+from jnitrace.summary import describe_caller
+
+# pylint: disable=C0209
+
+NEAR_OVERFLOW = 0.8
+LEAK_REPORTS = 3
+PERCENT = 100
+
+REF_STATUS_FORMAT = "{}[refs] threads: {} | locals: {} live, peak {} | " \
+    "globals: {} live, peak {} | weak globals: {} live, peak {}{}\n".format
+REF_OVERFLOW_FORMAT = "{}[refs] TID {} reached {} live local references, " \
+    "{:.0f}% of the {} entry table{}\n".format
+REF_LEAK_FORMAT = "{}[refs] possible {} reference leak: {} live from {} at " \
+    "{}, growing for {} reports{}\n".format
+THREAD_HEADER_FORMAT = "{}{:>8s}  {:>8s}  {:>8s}  {:>6s}{}\n".format
+THREAD_ROW_FORMAT = "{:8d}  {:8d}  {:8d}  {:6d}\n".format
+SITE_HEADER_FORMAT = "\n{}{:<6s}  {:>8s}  {:>8s}  {:<24s}  {}{}\n".format
+SITE_ROW_FORMAT = "{:<6s}  {:8d}  {:8d}  {:<24s}  {}\n".format
+REF_FOOTER_FORMAT = "\n{} global and {} weak global references live, " \
+    "peaks of {} and {}, after {:.1f}s\n\n".format
+
+# pylint: disable=too-many-instance-attributes
+class RefPressure:
+    """
+    RefPressure keeps the latest reference counts reported by the agent and
+    warns when a thread's local references near the size of its local
+    reference table, or when the live references created at a call site grow
+    in several reports in a row.
+    """
+    def __init__(self, local_limit=512, top=20):
+        self._local_limit = local_limit
+        self._top = top
+        self._threads = {}
+        self._sites = {}
+        self._growth = {}
+        self._warned = {}
+        self._globals = {"live": 0, "peak": 0}
+        self._weak_globals = {"live": 0, "peak": 0}
+        self._start = time.monotonic()
+
+    def _check_overflow(self, thread, color, reset):
+        thread_id = thread["thread_id"]
+        if thread["peak"] < self._local_limit * NEAR_OVERFLOW or \
+                thread["peak"] <= self._warned.get(thread_id, 0):
+            return ""
+
+        self._warned[thread_id] = thread["peak"]
+        return REF_OVERFLOW_FORMAT(
+            color, thread_id, thread["peak"],
+            thread["peak"] * PERCENT / self._local_limit, self._local_limit,
+            reset
+        )
+
+    def _check_leak(self, key, site, color, reset):
+        previous = self._sites.get(key)
+        growth = 0
+        if previous is not None and site["live"] > previous["live"]:
+            growth = self._growth.get(key, 0) + 1
+        self._growth[key] = growth
+
+        # Warn once for every few reports that a site keeps growing, rather
+        # than on every report.
+        if growth == 0 or growth % LEAK_REPORTS:
+            return ""
+        kind, method, caller = key
+        return REF_LEAK_FORMAT(
+            color, kind, site["live"], method, caller, growth, reset
+        )
+
+    def update(self, payload, modules, color="", reset=""):
+        """
+        Add a report of reference counts from the agent.
+        :param payload - the ref_pressure message sent by the agent
+        :param modules - the backtrace modules reported by the agent
+        :param color - the color to print the status and warnings in
+        :param reset - the code to reset the color after each line
+        :return - a status line followed by any warnings
+        """
+        warnings = []
+        self._threads = {}
+        for thread in payload["threads"]:
+            self._threads[thread["thread_id"]] = thread
+            warnings.append(self._check_overflow(thread, color, reset))
+
+        sites = {}
+        for site in payload["sites"]:
+            key = (
+                site["kind"], site["method"],
+                describe_caller(site["caller"], modules)
+            )
+            warnings.append(self._check_leak(key, site, color, reset))
+            sites[key] = site
+        self._sites = sites
+        self._growth = {key: self._growth[key] for key in sites}
+
+        self._globals = payload["globals"]
+        self._weak_globals = payload["weak_globals"]
+
+        threads = self._threads.values()
+        return REF_STATUS_FORMAT(
+            color,
+            len(self._threads),
+            sum(thread["live"] for thread in threads),
+            max((thread["peak"] for thread in threads), default=0),
+            self._globals["live"], self._globals["peak"],
+            self._weak_globals["live"], self._weak_globals["peak"],
+            reset
+        ) + "".join(warnings)
+
+    def render(self, color="", reset=""):
+        """
+        Render the threads with the most local references at their peak, and
+        the call sites with the most live references in the latest report.
+        :param color - the color to print the table headers in
+        :param reset - the code to reset the color after the headers
+        :return - the formatted tables
+        """
+        parts = [THREAD_HEADER_FORMAT(
+            color, "TID", "Live", "Peak", "Frames", reset
+        )]
+        ranked = sorted(
+            self._threads.values(), key=lambda thread: thread["peak"],
+            reverse=True
+        )
+        for thread in ranked[:self._top]:
+            parts.append(THREAD_ROW_FORMAT(
+                thread["thread_id"], thread["live"], thread["peak"],
+                thread["frames"]
+            ))
+
+        parts.append(SITE_HEADER_FORMAT(
+            color, "Kind", "Live", "Created", "Method", "Caller", reset
+        ))
+        ranked = sorted(
+            self._sites.items(), key=lambda item: item[1]["live"],
+            reverse=True
+        )
+        for (kind, method, caller), site in ranked[:self._top]:
+            parts.append(SITE_ROW_FORMAT(
+                kind, site["live"], site["created"], method, caller
+            ))
+
+        parts.append(REF_FOOTER_FORMAT(
+            self._globals["live"], self._weak_globals["live"],
+            self._globals["peak"], self._weak_globals["peak"],
+            time.monotonic() - self._start
+        ))
+        return "".join(parts)
@@ -0,0 +1,308 @@
+"""
+Offline replay of traces saved by jnitrace -o. A sidecar index is built the
+first time a trace is opened, so later queries seek straight to the matching
+records instead of parsing the whole trace.
+"""
+
+import argparse
+import array
+import bisect
+import json
+import os
+import re
+import struct
+import sys
+
+from colorama import init
+
+from jnitrace.binary_trace import BinaryTraceReader
+from jnitrace.blobs import BlobStore
+from jnitrace.formatter import TraceFormatter
+from jnitrace.output import decode_record
+
+# pylint: disable=C0209
+
+INDEX_MAGIC = b"JNIIDX\x00\x01"
+INDEX_HEADER = struct.Struct("<QdIBII")
+NAME_LENGTH = struct.Struct("<H")
+
+class NDJSONTrace:
+    """
+    NDJSONTrace gives indexed access to the records of an NDJSON trace.
+    """
+    def __init__(self, path):
+        # pylint: disable=consider-using-with
+        self._file = open(path, "rb")
+        self.definition_offsets = []
+
+    def load_definitions(self, offsets=None):
+        """
+        NDJSON records are self contained, so there is nothing to load.
+        :param offsets - unused
+        """
+
+    def iter_index(self):
+        """
+        Walk the trace reading the fields needed to index each record. A
+        partial last line, left by a jnitrace that was killed mid write, is
+        skipped.
+        :return - a generator of (offset, method name, thread id, timestamp)
+        tuples
+        """
+        self._file.seek(0)
+        offset = 0
+        for line in self._file:
+            if not line.endswith(b"\n"):
+                break
+            if line.strip():
+                record = json.loads(line)
+                yield offset, record["method"]["name"], \
+                    record["thread_id"], record["timestamp"]
+            offset += len(line)
+
+    def read_record(self, offset):
+        """
+        Read the record stored at an offset.
+        :param offset - the offset of the record's line
+        :return - the decoded record
+        """
+        self._file.seek(offset)
+        return decode_record(json.loads(self._file.readline()))
+
+    def close(self):
+        """
+        Close the trace file.
+        """
+        self._file.close()
+
+def open_trace(path):
+    """
+    Open a saved trace of either format for indexed access.
+    :param path - the path of the trace file
+    :return - the opened trace
+    """
+    if BinaryTraceReader.is_binary_trace(path):
+        return BinaryTraceReader(path)
+    return NDJSONTrace(path)
+
+# pylint: disable=too-many-instance-attributes
+class TraceIndex:
+    """
+    TraceIndex stores the offset, method, thread id and timestamp of every
+    record in a trace, along with the offsets of any definitions the records
+    depend on. It is saved next to the trace and rebuilt whenever the trace
+    changes.
+    """
+    def __init__(self, trace_path, trace):
+        self._trace_path = trace_path
+        self._index_path = trace_path + ".idx"
+        self.methods = []
+        self.offsets = array.array("q")
+        self.timestamps = array.array("q")
+        self.threads = array.array("q")
+        self.method_ids = array.array("i")
+        self.definitions = array.array("q")
+        self.is_sorted = True
+
+        if not self._load():
+            self._build(trace)
+            self._save()
+
+        trace.load_definitions(self.definitions)
+
+    def _trace_stat(self):
+        stat = os.stat(self._trace_path)
+        return stat.st_size, stat.st_mtime
+
+    def _columns(self):
+        return (self.offsets, self.timestamps, self.threads, self.method_ids)
+
+    def _build(self, trace):
+        method_ids = {}
+        last_ts = None
+        for offset, method, thread_id, timestamp in trace.iter_index():
+            method_id = method_ids.get(method)
+            if method_id is None:
+                method_id = len(self.methods)
+                method_ids[method] = method_id
+                self.methods.append(method)
+            if last_ts is not None and timestamp < last_ts:
+                self.is_sorted = False
+            last_ts = timestamp
+            self.offsets.append(offset)
+            self.timestamps.append(timestamp)
+            self.threads.append(thread_id)
+            self.method_ids.append(method_id)
+        self.definitions.extend(trace.definition_offsets)
+
+    def _save(self):
+        size, mtime = self._trace_stat()
+        try:
+            with open(self._index_path, "wb") as index:
+                index.write(INDEX_MAGIC)
+                index.write(INDEX_HEADER.pack(
+                    size, mtime, len(self.offsets), self.is_sorted,
+                    len(self.methods), len(self.definitions)
+                ))
+                for method in self.methods:
+                    name = method.encode("utf-8")
+                    index.write(NAME_LENGTH.pack(len(name)))
+                    index.write(name)
+                for column in self._columns() + (self.definitions,):
+                    column.tofile(index)
+        except OSError:
+            pass
+
+    def _load(self):
+        try:
+            with open(self._index_path, "rb") as index:
+                if index.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                    return False
+                size, mtime, count, is_sorted, nmethods, ndefinitions = \
+                    INDEX_HEADER.unpack(index.read(INDEX_HEADER.size))
+                if (size, mtime) != self._trace_stat():
+                    return False
+                for _ in range(nmethods):
+                    length = NAME_LENGTH.unpack(index.read(NAME_LENGTH.size))[0]
+                    self.methods.append(index.read(length).decode("utf-8"))
+                for column in self._columns():
+                    column.fromfile(index, count)
+                self.definitions.fromfile(index, ndefinitions)
+                self.is_sorted = bool(is_sorted)
+        except (OSError, EOFError, struct.error):
+            self.methods = []
+            for column in self._columns() + (self.definitions,):
+                del column[:]
+            return False
+        return True
+
+    def count_methods(self):
+        """
+        Count the calls made to each method in the trace.
+        :return - a dictionary of method names to call counts
+        """
+        counts = [0] * len(self.methods)
+        for method_id in self.method_ids:
+            counts[method_id] += 1
+        return dict(zip(self.methods, counts))
+
+    def query(self, thread_ids=None, method=None, start=None, end=None):
+        """
+        Find the records matching a set of filters.
+        :param thread_ids - an optional collection of thread ids to include
+        :param method - an optional regex to match against method names
+        :param start - an optional minimum timestamp in ms
+        :param end - an optional maximum timestamp in ms
+        :return - the offsets of the matching records in trace order
+        """
+        first = 0
+        last = len(self.offsets)
+        if self.is_sorted:
+            if start is not None:
+                first = bisect.bisect_left(self.timestamps, start)
+            if end is not None:
+                last = bisect.bisect_right(self.timestamps, end)
+
+        method_ids = None
+        if method is not None:
+            pattern = re.compile(method)
+            method_ids = {
+                i for i, name in enumerate(self.methods) if pattern.search(name)
+            }
+        if thread_ids is not None:
+            thread_ids = set(thread_ids)
+
+        offsets = []
+        for i in range(first, last):
+            if method_ids is not None and self.method_ids[i] not in method_ids:
+                continue
+            if thread_ids is not None and self.threads[i] not in thread_ids:
+                continue
+            if start is not None and self.timestamps[i] < start:
+                continue
+            if end is not None and self.timestamps[i] > end:
+                continue
+            offsets.append(self.offsets[i])
+        return offsets
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        usage="jnitrace-replay [options] trace",
+        description="Print a trace saved with jnitrace -o."
+    )
+    parser.add_argument("-t", "--thread", type=int, action="append",
+                        help="Only show calls made from a thread id. The "
+                        "option can be supplied multiple times.")
+    parser.add_argument("-i", "--method",
+                        help="A regex filter to include JNIEnv or JavaVM "
+                        "method names.")
+    parser.add_argument("--start", type=int,
+                        help="Only show calls made at or after a timestamp "
+                        "in ms.")
+    parser.add_argument("--end", type=int,
+                        help="Only show calls made at or before a timestamp "
+                        "in ms.")
+    parser.add_argument("--list-methods", action="store_true",
+                        help="Print the number of calls made to each method "
+                        "instead of the trace.")
+    parser.add_argument("--hide-backtrace", action="store_true",
+                        help="Do not print the stored backtraces.")
+    parser.add_argument("--hide-data", action="store_true",
+                        help="Do not print the contents of arguments.")
+    parser.add_argument("--no-color", action="store_true",
+                        help="Print plain output without colors.")
+    parser.add_argument("--blob-dir",
+                        help="The --blob-dir the trace was written with, to "
+                        "show the buffers its records refer to.")
+    parser.add_argument("trace",
+                        help="The trace file written by jnitrace.")
+    return parser.parse_args()
+
+def main():
+    """
+    Entry point to replay a saved trace.
+    """
+    args = _parse_args()
+
+    color = not args.no_color and sys.stdout.isatty()
+    init(strip=not color)
+
+    trace = open_trace(args.trace)
+    index = TraceIndex(args.trace, trace)
+
+    if args.list_methods:
+        counts = index.count_methods()
+        for method in sorted(counts, key=counts.get, reverse=True):
+            print("{:10d} {}".format(counts[method], method))
+        trace.close()
+        return
+
+    formatter = TraceFormatter({
+        "show_backtrace": not args.hide_backtrace,
+        "show_data": not args.hide_data,
+        "color": color
+    }, [])
+
+    blobs = None
+    if args.blob_dir:
+        blobs = BlobStore(args.blob_dir)
+
+    try:
+        for offset in index.query(
+                args.thread, args.method, args.start, args.end):
+            record = trace.read_record(offset)
+            if blobs is not None:
+                blobs.resolve_record(record)
+            formatter.render_record(record)
+    except BrokenPipeError:
+        # The reader went away, e.g. a pager was closed. Whatever is still
+        # buffered for stdout is written to /dev/null instead, so flushing it
+        # when the formatter closes and at exit does not fail again.
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+    finally:
+        formatter.close()
+        trace.close()
+
+if __name__ == '__main__':
+    main()
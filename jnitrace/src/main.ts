@@ -13,6 +13,8 @@ let config: Config | null = null;
 
 JNILibraryWatcher.setCallback({
     onLoaded (path: string): void {
+        transport.invalidateBacktraceCache();
+
         // eslint-disable-next-line @typescript-eslint/no-unnecessary-condition
         if (!IS_IN_REPL && !Config.initialised()) {
             // eslint-disable-next-line @typescript-eslint/no-explicit-any
@@ -31,6 +33,31 @@ JNILibraryWatcher.setCallback({
 
                 transport.setIncludeFilter(message.payload.include);
                 transport.setExcludeFilter(message.payload.exclude);
+                transport.setBatching(
+                    message.payload.batch_size,
+                    message.payload.batch_interval
+                );
+                transport.setDataLimit(message.payload.max_data_bytes);
+                transport.setDedup(message.payload.dedup_data);
+                transport.setRefCapacity(message.payload.ref_capacity);
+                transport.setSummary(message.payload.summary);
+                transport.setSampling(
+                    message.payload.sample_every,
+                    message.payload.rate_limit,
+                    message.payload.rate_burst,
+                    message.payload.rate_limit_by === "thread"
+                );
+                transport.setStats(message.payload.stats);
+                transport.setLatency(
+                    message.payload.latency,
+                    message.payload.latency_histogram
+                );
+                transport.setRefProfile(message.payload.ref_profile);
+                transport.setFlightRecorder(
+                    message.payload.flight_recorder,
+                    message.payload.flight_trigger
+                );
+                transport.setReportInterval(message.payload.report_interval);
                 /* eslint-enable @typescript-eslint/no-unsafe-member-access */
                 /* eslint-enable @typescript-eslint/no-unsafe-assignment */
             });
@@ -43,6 +70,8 @@ JNILibraryWatcher.setCallback({
 
         config.libraries.forEach((element: string): void => {
             if (path.includes(element)) {
+                transport.flush();
+                transport.watchLibrary(path);
                 send({
                     type: "tracked_library",
                     library: path
@@ -52,31 +81,148 @@ JNILibraryWatcher.setCallback({
     }
 });
 
+function setBacktrace (backtrace: string): void {
+    const current = Config.getInstance();
+    const builder = new ConfigBuilder();
+
+    builder.libraries = current.libraries;
+    builder.backtrace = backtrace;
+    builder.includeExports = current.includeExports;
+    builder.excludeExports = current.excludeExports;
+    builder.env = current.env;
+    builder.vm = current.vm;
+
+    config = builder.build();
+}
+
+rpc.exports = {
+    flush (): void {
+        transport.flush();
+        transport.report();
+    },
+    // eslint-disable-next-line @typescript-eslint/no-explicit-any
+    configure (options: any): void {
+        // Records traced with the old settings are sent before any change.
+        transport.flush();
+
+        /* eslint-disable @typescript-eslint/no-unsafe-member-access */
+        if (options.backtrace !== undefined) {
+            setBacktrace(options.backtrace);
+        }
+        if (options.include !== undefined) {
+            transport.setIncludeFilter(options.include);
+        }
+        if (options.exclude !== undefined) {
+            transport.setExcludeFilter(options.exclude);
+        }
+        if (options.max_data_bytes !== undefined) {
+            transport.setDataLimit(options.max_data_bytes);
+        }
+        if (options.sample_every !== undefined) {
+            transport.setSampling(
+                options.sample_every,
+                options.rate_limit,
+                options.rate_burst,
+                options.rate_limit_by === "thread"
+            );
+        }
+        /* eslint-enable @typescript-eslint/no-unsafe-member-access */
+    },
+    dumpFlightRecorder (): void {
+        transport.dumpFlightRecorder("manual");
+    },
+    refStats (): object {
+        return transport.getRefStats();
+    }
+};
+
 const jniEnvCallback: JNIInvocationCallback = {
     onEnter (args: NativeArgumentValue[]): void {
         this.args = args;
+        this.enterTime = transport.startCall();
+
+        // FatalError aborts the process and never returns, so onLeave would
+        // never run for it.
+        if (this.methodDef.name === "FatalError") {
+            transport.traceFatalError(
+                new MethodData(
+                    this.methodDef, args, NULL, this.javaMethod,
+                    this.enterTime, transport.endCall(this.enterTime)
+                ),
+                this.backtrace
+            );
+        }
     },
     onLeave (retval: JNINativeReturnValue): void {
-        const data = new MethodData(
-            this.methodDef, this.args, retval.get(), this.javaMethod
-        );
-        transport.reportJNIEnvCall(
-            data, this.backtrace
+        const duration = transport.endCall(this.enterTime);
+        const start = transport.startTiming();
+        const trigger = transport.getFlightTrigger(
+            this.methodDef, retval.get(), this.backtrace
         );
+        try {
+            transport.profileRefs(
+                this.methodDef, this.args, retval.get(), this.backtrace
+            );
+            if (transport.summarizeCall(
+                "JNIEnv", this.methodDef, this.backtrace, duration
+            )) {
+                return;
+            }
+            if (transport.shouldSkipJNIEnvCall(this.methodDef)) {
+                return;
+            }
+            const data = new MethodData(
+                this.methodDef, this.args, retval.get(), this.javaMethod,
+                this.enterTime, duration
+            );
+            transport.reportJNIEnvCall(
+                data, this.backtrace
+            );
+        } finally {
+            if (trigger !== null) {
+                transport.dumpFlightRecorder(trigger);
+            }
+            transport.endTiming("env_callback", start);
+        }
     }
 };
 
 const javaVMCallback: JNIInvocationCallback = {
     onEnter (args: NativeArgumentValue[]): void {
         this.args = args;
+        this.enterTime = transport.startCall();
     },
     onLeave (retval: JNINativeReturnValue): void {
-        const data = new MethodData(
-            this.methodDef, this.args, retval.get(), this.javaMethod
-        );
-        transport.reportJavaVMCall(
-            data, this.backtrace
+        const duration = transport.endCall(this.enterTime);
+        const start = transport.startTiming();
+        const trigger = transport.getFlightTrigger(
+            this.methodDef, retval.get(), this.backtrace
         );
+        try {
+            transport.profileRefs(
+                this.methodDef, this.args, retval.get(), this.backtrace
+            );
+            if (transport.summarizeCall(
+                "JavaVM", this.methodDef, this.backtrace, duration
+            )) {
+                return;
+            }
+            if (transport.shouldSkipJavaVMCall(this.methodDef)) {
+                return;
+            }
+            const data = new MethodData(
+                this.methodDef, this.args, retval.get(), this.javaMethod,
+                this.enterTime, duration
+            );
+            transport.reportJavaVMCall(
+                data, this.backtrace
+            );
+        } finally {
+            if (trigger !== null) {
+                transport.dumpFlightRecorder(trigger);
+            }
+            transport.endTiming("vm_callback", start);
+        }
     }
 };
 
@@ -0,0 +1,151 @@
+import { LruMap } from "../utils/lru_map";
+
+const STACK_CAPACITY = 65536;
+
+class BacktraceJSONContainer {
+    public readonly address: NativePointer;
+
+    public readonly module: number | null;
+
+    public readonly symbol: DebugSymbol | null;
+
+    public constructor (
+        address: NativePointer,
+        module: number | null,
+        symbol: DebugSymbol | null
+    ) {
+        this.address = address;
+        this.module = module;
+        this.symbol = symbol;
+    }
+}
+
+class CallerJSONContainer {
+    public readonly module: number | null;
+
+    public readonly offset: NativePointer;
+
+    public readonly symbol: string | null;
+
+    public constructor (
+        module: number | null,
+        offset: NativePointer,
+        symbol: string | null
+    ) {
+        this.module = module;
+        this.offset = offset;
+        this.symbol = symbol;
+    }
+}
+
+class BacktraceResolver {
+    private readonly frames: Map<string, BacktraceJSONContainer>;
+
+    private readonly moduleIds: Map<string, number>;
+
+    private readonly moduleBases: Map<number, NativePointer>;
+
+    private readonly stackIds: LruMap<number>;
+
+    private nextModuleId: number;
+
+    private nextStackId: number;
+
+    public constructor () {
+        this.frames = new Map<string, BacktraceJSONContainer>();
+        this.moduleIds = new Map<string, number>();
+        this.moduleBases = new Map<number, NativePointer>();
+        this.stackIds = new LruMap<number>(STACK_CAPACITY);
+        this.nextModuleId = 0;
+        this.nextStackId = 0;
+    }
+
+    public invalidate (): void {
+        this.frames.clear();
+        this.stackIds.clear();
+    }
+
+    public intern (backtrace: NativePointer[]): number {
+        const key = backtrace.map((addr: NativePointer): string => {
+            return addr.toString();
+        }).join(",");
+        let id = this.stackIds.get(key);
+
+        if (id === undefined) {
+            id = this.nextStackId++;
+            this.stackIds.set(key, id);
+            send({
+                type: "backtrace_stack",
+                id: id,
+                frames: backtrace.map(
+                    (addr: NativePointer): BacktraceJSONContainer => {
+                        return this.resolve(addr);
+                    }
+                )
+            });
+        }
+
+        return id;
+    }
+
+    public resolve (addr: NativePointer): BacktraceJSONContainer {
+        const key = addr.toString();
+        let frame = this.frames.get(key);
+
+        if (frame === undefined) {
+            const module = Process.findModuleByAddress(addr);
+            let moduleId = null;
+            if (module !== null) {
+                moduleId = this.getModuleId(module);
+            }
+            frame = new BacktraceJSONContainer(
+                addr,
+                moduleId,
+                DebugSymbol.fromAddress(addr)
+            );
+            this.frames.set(key, frame);
+        }
+
+        return frame;
+    }
+
+    public describeCaller (addr: NativePointer): CallerJSONContainer {
+        const frame = this.resolve(addr);
+        let offset = addr;
+        let symbol = null;
+
+        if (frame.module !== null) {
+            offset = addr.sub(this.moduleBases.get(frame.module) as NativePointer);
+        }
+        if (frame.symbol !== null) {
+            symbol = frame.symbol.name;
+        }
+
+        return new CallerJSONContainer(frame.module, offset, symbol);
+    }
+
+    private getModuleId (module: Module): number {
+        const key = module.path + "@" + module.base.toString();
+        let id = this.moduleIds.get(key);
+
+        if (id === undefined) {
+            id = this.nextModuleId++;
+            this.moduleIds.set(key, id);
+            this.moduleBases.set(id, module.base);
+            send({
+                type: "backtrace_module",
+                id: id,
+                module: {
+                    name: module.name,
+                    base: module.base,
+                    size: module.size,
+                    path: module.path
+                }
+            });
+        }
+
+        return id;
+    }
+}
+
+export { BacktraceJSONContainer, BacktraceResolver };
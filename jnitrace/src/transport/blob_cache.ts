@@ -0,0 +1,35 @@
+import { LruMap } from "../utils/lru_map";
+
+const BLOB_CAPACITY = 4096;
+const SEEN = true;
+
+class BlobCache {
+    public readonly minBytes: number;
+
+    private readonly digests: LruMap<boolean>;
+
+    public constructor (minBytes: number) {
+        this.minBytes = minBytes;
+        this.digests = new LruMap<boolean>(BLOB_CAPACITY);
+    }
+
+    public static isSupported (): boolean {
+        return typeof Checksum !== "undefined";
+    }
+
+    public intern (data: ArrayBuffer): string {
+        const digest = Checksum.compute("sha256", data);
+
+        if (this.digests.get(digest) === undefined) {
+            this.digests.set(digest, SEEN);
+            send({
+                type: "blob",
+                digest: digest
+            }, data);
+        }
+
+        return digest;
+    }
+}
+
+export { BlobCache };
@@ -0,0 +1,129 @@
+import { LruMap } from "../utils/lru_map";
+
+const NO_SAMPLING = 1;
+const NO_RATE_LIMIT = 0;
+const FIRST_CALL = 0;
+const TOKEN_COST = 1;
+const MS_PER_SECOND = 1000;
+const EMPTY_REPORT = 0;
+// Keys carry the thread id with --rate-limit-by thread, so the counters of
+// threads that have exited are evicted rather than kept for the session.
+const MAX_KEYS = 65536;
+
+class TokenBucket {
+    public tokens: number;
+
+    public lastRefill: number;
+
+    public constructor (tokens: number, lastRefill: number) {
+        this.tokens = tokens;
+        this.lastRefill = lastRefill;
+    }
+}
+
+class CallSampler {
+    private readonly every: number;
+
+    private readonly rate: number;
+
+    private readonly burst: number;
+
+    private readonly perThread: boolean;
+
+    private readonly calls: LruMap<number>;
+
+    private readonly buckets: LruMap<TokenBucket>;
+
+    private dropped: Map<string, number>;
+
+    public constructor (
+        every: number,
+        rate: number,
+        burst: number,
+        perThread: boolean
+    ) {
+        this.every = every;
+        this.rate = rate;
+        this.burst = Math.max(burst, TOKEN_COST);
+        this.perThread = perThread;
+        this.calls = new LruMap<number>(MAX_KEYS);
+        this.buckets = new LruMap<TokenBucket>(MAX_KEYS);
+        this.dropped = new Map<string, number>();
+    }
+
+    public static isEnabled (every: number, rate: number): boolean {
+        return every > NO_SAMPLING || rate > NO_RATE_LIMIT;
+    }
+
+    public admit (method: string): boolean {
+        let key = method;
+        if (this.perThread) {
+            key += ":" + Process.getCurrentThreadId().toString();
+        }
+
+        if (this.isSkipped(key) || this.isThrottled(key)) {
+            this.dropped.set(method, (this.dropped.get(method) || 0) + 1);
+            return false;
+        }
+
+        return true;
+    }
+
+    public flush (): void {
+        if (this.dropped.size === EMPTY_REPORT) {
+            return;
+        }
+
+        const dropped: object[] = [];
+        this.dropped.forEach((count: number, method: string): void => {
+            dropped.push({ method: method, count: count });
+        });
+        this.dropped = new Map<string, number>();
+
+        send({
+            type: "dropped_calls",
+            dropped: dropped
+        });
+    }
+
+    private isSkipped (key: string): boolean {
+        if (this.every <= NO_SAMPLING) {
+            return false;
+        }
+
+        const count = this.calls.get(key) || FIRST_CALL;
+        this.calls.set(key, (count + 1) % this.every);
+
+        return count !== FIRST_CALL;
+    }
+
+    private isThrottled (key: string): boolean {
+        if (this.rate <= NO_RATE_LIMIT) {
+            return false;
+        }
+
+        const now = Date.now();
+        let bucket = this.buckets.get(key);
+
+        if (bucket === undefined) {
+            bucket = new TokenBucket(this.burst, now);
+            this.buckets.set(key, bucket);
+        } else {
+            bucket.tokens = Math.min(
+                this.burst,
+                bucket.tokens +
+                    (now - bucket.lastRefill) * this.rate / MS_PER_SECOND
+            );
+            bucket.lastRefill = now;
+        }
+
+        if (bucket.tokens < TOKEN_COST) {
+            return true;
+        }
+
+        bucket.tokens -= TOKEN_COST;
+        return false;
+    }
+}
+
+export { CallSampler };
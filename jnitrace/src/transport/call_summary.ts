@@ -0,0 +1,90 @@
+import { BacktraceResolver } from "./backtrace_resolver";
+
+const CALLER_INDEX = 0;
+const EMPTY_SUMMARY = 0;
+
+class CallSummaryEntry {
+    public readonly callType: string;
+
+    public readonly method: string;
+
+    public readonly threadId: number;
+
+    public readonly caller: NativePointer | null;
+
+    public count: number;
+
+    public constructor (
+        callType: string,
+        method: string,
+        threadId: number,
+        caller: NativePointer | null
+    ) {
+        this.callType = callType;
+        this.method = method;
+        this.threadId = threadId;
+        this.caller = caller;
+        this.count = 0;
+    }
+}
+
+class CallSummary {
+    private entries: Map<string, CallSummaryEntry>;
+
+    public constructor () {
+        this.entries = new Map<string, CallSummaryEntry>();
+    }
+
+    public count (
+        callType: string,
+        method: string,
+        backtrace: NativePointer[] | undefined
+    ): void {
+        const threadId = Process.getCurrentThreadId();
+        let caller = null;
+        let key = method + ":" + threadId.toString();
+
+        if (backtrace !== undefined && backtrace.length > CALLER_INDEX) {
+            caller = backtrace[CALLER_INDEX];
+            key += ":" + caller.toString();
+        }
+
+        let entry = this.entries.get(key);
+        if (entry === undefined) {
+            entry = new CallSummaryEntry(callType, method, threadId, caller);
+            this.entries.set(key, entry);
+        }
+        entry.count++;
+    }
+
+    public flush (resolver: BacktraceResolver): void {
+        if (this.entries.size === EMPTY_SUMMARY) {
+            return;
+        }
+
+        const calls: object[] = [];
+        this.entries.forEach((entry: CallSummaryEntry): void => {
+            let caller = null;
+            if (entry.caller !== null) {
+                caller = resolver.describeCaller(entry.caller);
+            }
+            /* eslint-disable @typescript-eslint/camelcase */
+            calls.push({
+                call_type: entry.callType,
+                method: entry.method,
+                thread_id: entry.threadId,
+                caller: caller,
+                count: entry.count
+            });
+            /* eslint-enable @typescript-eslint/camelcase */
+        });
+        this.entries = new Map<string, CallSummaryEntry>();
+
+        send({
+            type: "call_summary",
+            calls: calls
+        });
+    }
+}
+
+export { CallSummary };
@@ -1,6 +1,18 @@
 import { Types }  from "../utils/types";
+import { Hash } from "../utils/hash";
+import { LruMap, LruMapStats } from "../utils/lru_map";
 import { MethodData } from "../utils/method_data";
-import { JNIMethod, Config } from "jnitrace-engine";
+import { RecordBatcher } from "./record_batcher";
+import { CallSummary } from "./call_summary";
+import { CallSampler } from "./call_sampler";
+import { TracerStats } from "./tracer_stats";
+import { FlightRecorder, FlightEntry } from "./flight_recorder";
+import { LatencyHistograms } from "./latency_histogram";
+import { BlobCache } from "./blob_cache";
+import { RefProfiler } from "./ref_profiler";
+import { Clock } from "../utils/clock";
+import { BacktraceResolver } from "./backtrace_resolver";
+import { JNIMethod, JavaMethod, Config } from "jnitrace-engine";
 
 const JNI_OK = 0;
 const TYPE_NAME_START = 0;
@@ -9,6 +21,19 @@ const SKIP_ENV_INDEX = 1;
 const EMPTY_ARRAY_LEN = 0;
 const JAVA_VM_INDEX = 0;
 const JNI_ENV_INDEX = 0;
+const UNBATCHED_SIZE = 1;
+const DEFAULT_REF_CAPACITY = 65536;
+const NO_DATA_LIMIT = 0;
+const HALF = 2;
+const BUFFER_START = 0;
+const NOT_TIMED = 0;
+const NO_FLIGHT_RECORDER = 0;
+const NO_DEDUP = 0;
+const CALLER_INDEX = 0;
+const NO_SENT_DATA = 0;
+const FLIGHT_RECORDER_MAX_BYTES = 67108864;
+
+type StateUpdater = (data: MethodData) => void;
 
 
 class NativeMethodJSONContainer {
@@ -43,6 +68,14 @@ class DataJSONContainer {
 
     private metadata: string | undefined;
 
+    private data_length: number | undefined;
+
+    private data_head: number | undefined;
+
+    private data_checksum: number | undefined;
+
+    private data_digest: string | undefined;
+
     public constructor (
         value: NativeArgumentValue | NativeReturnValue,
         data: ArrayBuffer | NativeArgumentValue | NativeReturnValue
@@ -74,23 +107,15 @@ class DataJSONContainer {
     public setMetadata (metadata: string | undefined): void {
         this.metadata = metadata;
     }
-}
 
-class BacktraceJSONContainer {
-    public readonly address: NativePointer;
-
-    public readonly module: Module | null;
-
-    public readonly symbol: DebugSymbol | null;
+    public setTruncated (length: number, head: number, checksum: number): void {
+        this.data_length = length;
+        this.data_head = head;
+        this.data_checksum = checksum;
+    }
 
-    public constructor (
-        address: NativePointer,
-        module: Module | null,
-        symbol: DebugSymbol | null
-    ) {
-        this.address = address;
-        this.module = module;
-        this.symbol = symbol;
+    public setDigest (digest: string): void {
+        this.data_digest = digest;
     }
 }
 
@@ -111,7 +136,11 @@ class RecordJSONContainer {
 
     public readonly java_params: string[] | undefined;
 
-    public readonly backtrace: BacktraceJSONContainer[] | undefined;
+    public readonly backtrace_id: number | undefined;
+
+    private start_us: number | undefined;
+
+    private duration_us: number | undefined;
 
     public constructor (
         callType: string,
@@ -121,7 +150,7 @@ class RecordJSONContainer {
         threadId: number,
         timestamp: number,
         javaParams?: string[],
-        backtrace?: BacktraceJSONContainer[]
+        backtraceId?: number
     ) {
         this.type = "trace_data";
         this.call_type = callType;
@@ -131,45 +160,519 @@ class RecordJSONContainer {
         this.thread_id = threadId;
         this.timestamp = timestamp;
         this.java_params = javaParams;
-        this.backtrace = backtrace;
+        this.backtrace_id = backtraceId;
+    }
+
+    public setTiming (startUs: number, durationUs: number): void {
+        this.start_us = startUs;
+        this.duration_us = durationUs;
     }
 }
 /* eslint-enable @typescript-eslint/camelcase */
 
+class TracedCall {
+    public readonly type: string;
+
+    public readonly data: MethodData;
+
+    public readonly args: DataJSONContainer[];
+
+    public readonly ret: DataJSONContainer;
+
+    public readonly sendData: ArrayBuffer | null;
+
+    public readonly context: NativePointer[] | undefined;
+
+    public readonly threadId: number;
+
+    public readonly timestamp: number;
+
+    public constructor (
+        type: string,
+        data: MethodData,
+        args: DataJSONContainer[],
+        ret: DataJSONContainer,
+        sendData: ArrayBuffer | null,
+        context: NativePointer[] | undefined,
+        timestamp: number
+    ) {
+        this.type = type;
+        this.data = data;
+        this.args = args;
+        this.ret = ret;
+        this.sendData = sendData;
+        this.context = context;
+        this.threadId = Process.getCurrentThreadId();
+        this.timestamp = timestamp;
+    }
+}
+
+type ArgEncoder = (
+    data: MethodData,
+    outputArgs: DataJSONContainer[]
+) => ArrayBuffer | null;
+
+type RetEncoder = (
+    data: MethodData,
+    outputRet: DataJSONContainer[]
+) => ArrayBuffer | null;
+
+type NameCache = LruMap<string> | null;
+
+function noData (): null {
+    return null;
+}
+
+function withoutData (
+    encode: (data: MethodData, output: DataJSONContainer[]) => void
+): ArgEncoder {
+    return (data: MethodData, output: DataJSONContainer[]): null => {
+        encode(data, output);
+        return null;
+    };
+}
+
+class EnrichmentSlot {
+    public readonly index: number;
+
+    public readonly names: LruMap<string>;
+
+    public constructor (index: number, names: LruMap<string>) {
+        this.index = index;
+        this.names = names;
+    }
+}
+
+class MethodCodec {
+    public readonly updateState: StateUpdater | null;
+
+    public readonly encodeArgs: ArgEncoder;
+
+    public readonly encodeRet: RetEncoder;
+
+    public readonly argSlots: EnrichmentSlot[];
+
+    public readonly javaParamsOffset: number;
+
+    public readonly retNames: NameCache;
+
+    public constructor (
+        updateState: StateUpdater | null,
+        encodeArgs: ArgEncoder,
+        encodeRet: RetEncoder,
+        argSlots: EnrichmentSlot[],
+        javaParamsOffset: number,
+        retNames: NameCache
+    ) {
+        this.updateState = updateState;
+        this.encodeArgs = encodeArgs;
+        this.encodeRet = encodeRet;
+        this.argSlots = argSlots;
+        this.javaParamsOffset = javaParamsOffset;
+        this.retNames = retNames;
+    }
+}
+
 class DataTransport {
     private readonly start: number;
 
-    private readonly byteArraySizes: Map<string, number>;
+    private readonly byteArraySizes: LruMap<number>;
+
+    private readonly jobjects: LruMap<string>;
+
+    private readonly jfieldIDs: LruMap<string>;
+
+    private readonly jmethodIDs: LruMap<string>;
+
+    private readonly jstrings: LruMap<string>;
+
+    private include: RegExp[];
+
+    private exclude: RegExp[];
+
+    private readonly ignoredMethods: Map<string, boolean>;
+
+    private readonly jniEnvCodecs: Map<string, MethodCodec>;
 
-    private readonly jobjects: Map<string, string>;
+    private readonly javaVMCodecs: Map<string, MethodCodec>;
 
-    private readonly jfieldIDs: Map<string, string>;
+    private readonly javaParamNames: WeakMap<JavaMethod, NameCache[]>;
 
-    private readonly jmethodIDs: Map<string, string>;
+    private batcher: RecordBatcher | null;
 
-    private readonly jstrings: Map<string, string>;
+    private readonly backtraceResolver: BacktraceResolver;
 
-    private include: string[];
+    private summary: CallSummary | null;
 
-    private exclude: string[];
+    private sampler: CallSampler | null;
+
+    private stats: TracerStats | null;
+
+    private reportTimer: ReturnType<typeof setInterval> | null;
+
+    private maxDataBytes: number;
+
+    private flightRecorder: FlightRecorder<TracedCall> | null;
+
+    private flightTriggers: RegExp[];
+
+    private blobCache: BlobCache | null;
+
+    private latency: boolean;
+
+    private histograms: LatencyHistograms | null;
+
+    private refProfiler: RefProfiler | null;
+
+    private clockStart: number;
 
     public constructor () {
         this.start = Date.now();
-        this.byteArraySizes = new Map<string, number>();
-        this.jobjects = new Map<string, string>();
-        this.jfieldIDs = new Map<string, string>();
-        this.jmethodIDs = new Map<string, string>();
-        this.jstrings = new Map<string, string>();
+        this.byteArraySizes = new LruMap<number>(DEFAULT_REF_CAPACITY);
+        this.jobjects = new LruMap<string>(DEFAULT_REF_CAPACITY);
+        this.jfieldIDs = new LruMap<string>(DEFAULT_REF_CAPACITY);
+        this.jmethodIDs = new LruMap<string>(DEFAULT_REF_CAPACITY);
+        this.jstrings = new LruMap<string>(DEFAULT_REF_CAPACITY);
         this.include = [];
         this.exclude = [];
+        this.ignoredMethods = new Map<string, boolean>();
+        this.jniEnvCodecs = new Map<string, MethodCodec>();
+        this.javaVMCodecs = new Map<string, MethodCodec>();
+        this.javaParamNames = new WeakMap<JavaMethod, NameCache[]>();
+        this.batcher = null;
+        this.backtraceResolver = new BacktraceResolver();
+        this.summary = null;
+        this.sampler = null;
+        this.stats = null;
+        this.reportTimer = null;
+        this.maxDataBytes = NO_DATA_LIMIT;
+        this.flightRecorder = null;
+        this.flightTriggers = [];
+        this.blobCache = null;
+        this.latency = false;
+        this.histograms = null;
+        this.refProfiler = null;
+        this.clockStart = NOT_TIMED;
     }
 
     public setIncludeFilter (include: string[]): void {
-        this.include = include;
+        this.include = include.map((i: string): RegExp => new RegExp(i));
+        this.ignoredMethods.clear();
     }
 
     public setExcludeFilter (exclude: string[]): void {
-        this.exclude = exclude;
+        this.exclude = exclude.map((e: string): RegExp => new RegExp(e));
+        this.ignoredMethods.clear();
+    }
+
+    public shouldSkipJavaVMCall (method: JNIMethod): boolean {
+        const config = Config.getInstance();
+
+        return !config.vm || this.isIgnoredMethod(method.name) ||
+            this.isSampledOut(method.name);
+    }
+
+    public shouldSkipJNIEnvCall (method: JNIMethod): boolean {
+        const config = Config.getInstance();
+
+        if (this.getJNIEnvCodec(method).updateState !== null) {
+            return false;
+        }
+
+        return !config.env || this.isIgnoredMethod(method.name) ||
+            this.isSampledOut(method.name);
+    }
+
+    public setBatching (size: number, interval: number): void {
+        this.flush();
+        if (size > UNBATCHED_SIZE) {
+            this.batcher = new RecordBatcher(
+                size, interval, this.countSent.bind(this)
+            );
+        } else {
+            this.batcher = null;
+        }
+    }
+
+    public flush (): void {
+        if (this.batcher !== null) {
+            this.batcher.flush();
+        }
+    }
+
+    public setSummary (enabled: boolean): void {
+        this.report();
+        if (enabled) {
+            this.summary = new CallSummary();
+        } else {
+            this.summary = null;
+        }
+    }
+
+    public setSampling (
+        every: number,
+        rate: number,
+        burst: number,
+        perThread: boolean
+    ): void {
+        this.report();
+        if (CallSampler.isEnabled(every, rate)) {
+            this.sampler = new CallSampler(every, rate, burst, perThread);
+        } else {
+            this.sampler = null;
+        }
+    }
+
+    public setStats (enabled: boolean): void {
+        this.report();
+        if (enabled) {
+            this.stats = new TracerStats();
+        } else {
+            this.stats = null;
+        }
+    }
+
+    public startTiming (): number {
+        if (this.stats === null) {
+            return NOT_TIMED;
+        }
+        return Clock.nowMicros();
+    }
+
+    public endTiming (stage: string, start: number): void {
+        if (this.stats !== null && start !== NOT_TIMED) {
+            this.stats.time(stage, start);
+        }
+    }
+
+    public setLatency (enabled: boolean, histogram: boolean): void {
+        this.report();
+        this.latency = enabled;
+        if (histogram) {
+            this.histograms = new LatencyHistograms();
+        } else {
+            this.histograms = null;
+        }
+        if (enabled || histogram) {
+            this.clockStart = Clock.nowMicros();
+        }
+    }
+
+    public startCall (): number {
+        if (!this.latency && this.histograms === null) {
+            return NOT_TIMED;
+        }
+        return Clock.nowMicros();
+    }
+
+    public endCall (start: number): number {
+        if (start === NOT_TIMED) {
+            return NOT_TIMED;
+        }
+        return Clock.nowMicros() - start;
+    }
+
+    public setRefCapacity (capacity: number): void {
+        this.byteArraySizes.setCapacity(capacity);
+        this.jobjects.setCapacity(capacity);
+        this.jfieldIDs.setCapacity(capacity);
+        this.jmethodIDs.setCapacity(capacity);
+        this.jstrings.setCapacity(capacity);
+    }
+
+    public getRefStats (): { [id: string]: LruMapStats } {
+        return {
+            "byteArraySizes": this.byteArraySizes.getStats(),
+            "jobjects": this.jobjects.getStats(),
+            "jfieldIDs": this.jfieldIDs.getStats(),
+            "jmethodIDs": this.jmethodIDs.getStats(),
+            "jstrings": this.jstrings.getStats()
+        };
+    }
+
+    public setRefProfile (enabled: boolean): void {
+        this.report();
+        if (enabled) {
+            this.refProfiler = new RefProfiler();
+        } else {
+            this.refProfiler = null;
+        }
+    }
+
+    public watchLibrary (path: string): void {
+        if (this.refProfiler !== null) {
+            this.refProfiler.watchLibrary(path);
+        }
+    }
+
+    public profileRefs (
+        method: JNIMethod,
+        args: NativeArgumentValue[],
+        ret: NativeReturnValue,
+        backtrace: NativePointer[] | undefined
+    ): void {
+        // Every call is counted, whatever the filters, as a reference
+        // created by an ignored method still takes a slot in the tables.
+        if (this.refProfiler !== null) {
+            this.refProfiler.update(method, args, ret, backtrace);
+        }
+    }
+
+    public setDataLimit (maxBytes: number): void {
+        this.maxDataBytes = maxBytes;
+    }
+
+    public setDedup (minBytes: number): void {
+        if (minBytes > NO_DEDUP && BlobCache.isSupported()) {
+            this.blobCache = new BlobCache(minBytes);
+        } else {
+            this.blobCache = null;
+        }
+    }
+
+    public setFlightRecorder (capacity: number, triggers: string[]): void {
+        this.flush();
+        this.flightTriggers = triggers.map(
+            (t: string): RegExp => new RegExp(t)
+        );
+        if (capacity > NO_FLIGHT_RECORDER) {
+            this.flightRecorder = new FlightRecorder<TracedCall>(
+                capacity, FLIGHT_RECORDER_MAX_BYTES, this.countSent.bind(this)
+            );
+        } else {
+            this.flightRecorder = null;
+        }
+    }
+
+    public dumpFlightRecorder (reason: string): void {
+        if (this.flightRecorder !== null) {
+            this.flightRecorder.dump(reason, (call: TracedCall): FlightEntry => {
+                return this.encodeCall(
+                    call, this.createCallBacktrace(call.context)
+                );
+            });
+        }
+    }
+
+    /*
+     * Triggers are checked for every call before it is filtered or sampled,
+     * so a thrown exception still dumps the recorder when the call itself
+     * is not traced. FatalError never returns, and is handled on entry by
+     * traceFatalError.
+     */
+    public getFlightTrigger (
+        method: JNIMethod,
+        ret: NativeReturnValue,
+        context: NativePointer[] | undefined
+    ): string | null {
+        if (this.flightRecorder === null) {
+            return null;
+        }
+
+        const name = method.name;
+        if (name === "ThrowNew") {
+            return name;
+        }
+        if (name === "ExceptionOccurred" && !(ret as NativePointer).isNull()) {
+            return name;
+        }
+        if (this.flightTriggers.length === EMPTY_ARRAY_LEN) {
+            return null;
+        }
+        if (this.matchesFlightTrigger(name)) {
+            return name;
+        }
+
+        // Calls made from a native method are matched on the export the
+        // call came from, which is the symbol of the first frame.
+        if (context !== undefined && context.length > EMPTY_ARRAY_LEN) {
+            const caller = this.backtraceResolver.describeCaller(
+                context[CALLER_INDEX]
+            );
+            if (caller.symbol !== null &&
+                    this.matchesFlightTrigger(caller.symbol)) {
+                return caller.symbol;
+            }
+        }
+
+        return null;
+    }
+
+    /*
+     * FatalError is traced when it is entered, as it aborts the process
+     * instead of returning. The flight recorder and any batched records are
+     * sent before the call goes through.
+     */
+    public traceFatalError (
+        data: MethodData,
+        context: NativePointer[] | undefined
+    ): void {
+        if (!this.shouldSkipJNIEnvCall(data.method)) {
+            this.reportJNIEnvCall(data, context);
+        }
+        this.dumpFlightRecorder(data.method.name);
+        this.flush();
+    }
+
+    public setReportInterval (interval: number): void {
+        if (this.reportTimer !== null) {
+            clearInterval(this.reportTimer);
+        }
+        this.reportTimer = setInterval((): void => {
+            this.report();
+        }, interval);
+    }
+
+    public report (): void {
+        if (this.summary !== null) {
+            this.summary.flush(this.backtraceResolver);
+        }
+        if (this.histograms !== null) {
+            this.histograms.flush(this.backtraceResolver);
+        }
+        if (this.refProfiler !== null) {
+            this.refProfiler.flush(this.backtraceResolver);
+        }
+        if (this.sampler !== null) {
+            this.sampler.flush();
+        }
+        if (this.stats !== null) {
+            this.stats.flush();
+        }
+    }
+
+    public summarizeCall (
+        type: string,
+        method: JNIMethod,
+        backtrace: NativePointer[] | undefined,
+        duration: number
+    ): boolean {
+        if (this.summary === null && this.histograms === null &&
+                this.refProfiler === null) {
+            return false;
+        }
+
+        const config = Config.getInstance();
+        let enabled = config.vm;
+        if (type === "JNIEnv") {
+            enabled = config.env;
+        }
+
+        if (!enabled || this.isIgnoredMethod(method.name)) {
+            return true;
+        }
+
+        if (this.summary !== null) {
+            this.summary.count(type, method.name, backtrace);
+        } else if (this.histograms !== null) {
+            this.histograms.record(type, method.name, backtrace, duration);
+        }
+
+        return true;
+    }
+
+    public invalidateBacktraceCache (): void {
+        this.backtraceResolver.invalidate();
     }
 
     public reportJavaVMCall (
@@ -189,7 +692,8 @@ class DataTransport {
 
         outputArgs.push(new DataJSONContainer(javaVM, null));
 
-        const sendData = this.addJavaVMArgs(data, outputArgs);
+        const codec = this.getJavaVMCodec(data.method);
+        const sendData = codec.encodeArgs(data, outputArgs);
 
         this.sendToHost(
             "JavaVM",
@@ -210,14 +714,28 @@ class DataTransport {
         const outputArgs: DataJSONContainer[] = [];
         const outputRet: DataJSONContainer[] = [];
         const jniEnv = data.getArgAsPtr(JNI_ENV_INDEX);
+        const codec = this.getJNIEnvCodec(data.method);
+
+        if (codec.updateState !== null) {
+            codec.updateState(data);
+        }
+
+        if (!config.env || this.shouldIgnoreMethod(data)) {
+            return;
+        }
 
-        this.updateState(data);
+        // Calls without a state updater were already sampled in
+        // shouldSkipJNIEnvCall, before their MethodData was built.
+        if (codec.updateState !== null &&
+                this.isSampledOut(data.method.name)) {
+            return;
+        }
 
         outputArgs.push(new DataJSONContainer(jniEnv, null));
 
         let sendData = null;
-        const argData = this.addJNIEnvArgs(data, outputArgs);
-        const retData = this.addJNIEnvRet(data, outputRet);
+        const argData = codec.encodeArgs(data, outputArgs);
+        const retData = codec.encodeRet(data, outputRet);
 
         if (argData !== null && retData === null) {
             sendData = argData;
@@ -225,11 +743,7 @@ class DataTransport {
             sendData = retData;
         }
 
-        this.enrichTraceData(data, outputArgs, outputRet);
-
-        if (!config.env || this.shouldIgnoreMethod(data)) {
-            return;
-        }
+        this.enrichTraceData(codec, data, outputArgs, outputRet);
 
         this.sendToHost(
             "JNIEnv",
@@ -245,10 +759,10 @@ class DataTransport {
         const JARRAY_INDEX = 1;
 
         if (isGet) {
-            this.byteArraySizes.set(data.args[JARRAY_INDEX].toString(),
+            this.byteArraySizes.set(LruMap.toKey(data.args[JARRAY_INDEX]),
                 data.ret as number);
         } else {    //isSet
-            this.byteArraySizes.set(data.ret.toString(),
+            this.byteArraySizes.set(LruMap.toKey(data.ret),
                 data.args[JARRAY_INDEX] as number);
         }
     }
@@ -256,7 +770,7 @@ class DataTransport {
     private updateMethodIDs (data: MethodData): void {
         const NAME_INDEX = 2;
         const SIG_INDEX = 3;
-        const methodID = data.ret.toString();
+        const methodID = LruMap.toKey(data.ret);
         const name = (data.args[NAME_INDEX] as NativePointer).readCString();
         const sig = (data.args[SIG_INDEX] as NativePointer).readCString();
         if (name !== null && sig !== null) {
@@ -267,7 +781,7 @@ class DataTransport {
     private updateFieldIDs (data: MethodData): void {
         const NAME_INDEX = 2;
         const SIG_INDEX = 3;
-        const fieldID = data.ret.toString();
+        const fieldID = LruMap.toKey(data.ret);
         const name = (data.args[NAME_INDEX] as NativePointer).readCString();
         const sig = (data.args[SIG_INDEX] as NativePointer).readCString();
         if (name !== null && sig !== null) {
@@ -277,7 +791,7 @@ class DataTransport {
 
     private updateClassIDs (data: MethodData): void {
         const NAME_INDEX = 1;
-        const jclass = data.ret.toString();
+        const jclass = LruMap.toKey(data.ret);
         const name = (data.args[NAME_INDEX] as NativePointer).readCString();
         if (name !== null) {
             this.jobjects.set(jclass, name);
@@ -288,23 +802,23 @@ class DataTransport {
     private updateObjectIDsFromRefs (data: MethodData, isCreate: boolean): void {
         const OBJECT_INDEX = 1;
         if (isCreate) {
-            const newRef = data.ret.toString();
-            const oldRef = data.args[OBJECT_INDEX].toString();
-            if (this.jobjects.has(oldRef)) {
-                this.jobjects.set(newRef, this.jobjects.get(oldRef) as string);
+            const newRef = LruMap.toKey(data.ret);
+            const oldRef = LruMap.toKey(data.args[OBJECT_INDEX]);
+            const name = this.jobjects.get(oldRef);
+            if (name !== undefined) {
+                this.jobjects.set(newRef, name);
             }
         } else {
-            const jobject = data.args[OBJECT_INDEX].toString();
+            const jobject = LruMap.toKey(data.args[OBJECT_INDEX]);
             this.jobjects.delete(jobject);
         }
     }
 
     private updateObjectIDsFromClass (data: MethodData): void {
         const OBJECT_INDEX = 1;
-        const jobject = data.args[OBJECT_INDEX].toString();
-        const jclass = data.ret.toString();
-        if (this.jobjects.has(jobject)) {
-            this.jobjects.set(jclass, jobject);
+        const jobject = data.args[OBJECT_INDEX];
+        if (this.jobjects.get(LruMap.toKey(jobject)) !== undefined) {
+            this.jobjects.set(LruMap.toKey(data.ret), jobject.toString());
         }
     }
 
@@ -320,8 +834,8 @@ class DataTransport {
                 start = CALL_PTRS_OFFSET;
             }
             for (let i = start; i < data.args.length; i++) {
-                const arg = data.args[i].toString();
-                if (this.jobjects.has(arg)) {
+                const arg = LruMap.toKey(data.args[i]);
+                if (this.jobjects.get(arg) !== undefined) {
                     // skip where we have an existing class name
                     continue;
                 }
@@ -331,8 +845,9 @@ class DataTransport {
                 }
             }
             if (data.method.name.includes("Object")) {
-                if (!this.jobjects.has(data.ret.toString())) {
-                    this.jobjects.set(data.ret.toString(),
+                const ret = LruMap.toKey(data.ret);
+                if (this.jobjects.get(ret) === undefined) {
+                    this.jobjects.set(ret,
                         data.javaMethod.ret.slice(TYPE_START, TYPE_END));
                 }
             }
@@ -345,52 +860,157 @@ class DataTransport {
         const utf8Ptr = data.getArgAsPtr(UTF8_INDEX).readUtf8String();
 
         if (utf8Ptr !== null) {
-            this.jstrings.set(data.ret.toString(), utf8Ptr);
+            this.jstrings.set(LruMap.toKey(data.ret), utf8Ptr);
         }
     }
 
-    private updateState (data: MethodData): void {
-        const name = data.method.name;
-
+    private createStateUpdater (name: string): StateUpdater | null {
         if (name === "GetArrayLength") {
-            this.updateArrayLengths(data, true);
+            return (data: MethodData): void => {
+                this.updateArrayLengths(data, true);
+            };
         } else if (name.startsWith("New") && name.endsWith("Array")) {
-            this.updateArrayLengths(data, false);
+            return (data: MethodData): void => {
+                this.updateArrayLengths(data, false);
+            };
         } else if (["GetMethodID", "GetStaticMethodID"].includes(name)) {
-            this.updateMethodIDs(data);
+            return (data: MethodData): void => {
+                this.updateMethodIDs(data);
+            };
         } else if (["GetFieldID", "GetStaticFieldID"].includes(name)) {
-            this.updateFieldIDs(data);
+            return (data: MethodData): void => {
+                this.updateFieldIDs(data);
+            };
         } else if (["FindClass", "DefineClass"].includes(name)) {
-            this.updateClassIDs(data);
+            return (data: MethodData): void => {
+                this.updateClassIDs(data);
+            };
         } else if (name.startsWith("New") && name.endsWith("Ref")) {
-            this.updateObjectIDsFromRefs(data, true);
+            return (data: MethodData): void => {
+                this.updateObjectIDsFromRefs(data, true);
+            };
         } else if (name.startsWith("Delete") && name.endsWith("Ref")) {
-            this.updateObjectIDsFromRefs(data, false);
+            return (data: MethodData): void => {
+                this.updateObjectIDsFromRefs(data, false);
+            };
         } else if (name === "GetObjectClass") {
-            this.updateObjectIDsFromClass(data);
+            return (data: MethodData): void => {
+                this.updateObjectIDsFromClass(data);
+            };
         } else if (name.startsWith("Call")) {
-            this.updateObjectIDsFromCall(data);
+            return (data: MethodData): void => {
+                this.updateObjectIDsFromCall(data);
+            };
         } else if (name === "NewStringUTF") {
-            this.updateStringIDs(data);
+            return (data: MethodData): void => {
+                this.updateStringIDs(data);
+            };
         }
+        return null;
     }
 
-    private shouldIgnoreMethod (data: MethodData): boolean {
-        const name = data.method.name;
+    private getNameCache (type: string): NameCache {
+        if (Types.isComplexObjectType(type)) {
+            return this.jobjects;
+        } else if (type === "jmethodID") {
+            return this.jmethodIDs;
+        } else if (type === "jfieldID") {
+            return this.jfieldIDs;
+        } else if (type === "jstring") {
+            return this.jstrings;
+        }
+        return null;
+    }
+
+    private createCodec (
+        method: JNIMethod,
+        updateState: StateUpdater | null,
+        encodeArgs: ArgEncoder,
+        encodeRet: RetEncoder
+    ): MethodCodec {
+        const argSlots: EnrichmentSlot[] = [];
+        let i = 0;
+
+        for (; i < method.args.length; i++) {
+            if (method.args[i] === "...") {
+                break;
+            }
 
+            const names = this.getNameCache(method.args[i]);
+            if (names !== null) {
+                argSlots.push(new EnrichmentSlot(i, names));
+            }
+        }
+
+        return new MethodCodec(
+            updateState,
+            encodeArgs,
+            encodeRet,
+            argSlots,
+            i,
+            this.getNameCache(method.ret)
+        );
+    }
+
+    private getJNIEnvCodec (method: JNIMethod): MethodCodec {
+        let codec = this.jniEnvCodecs.get(method.name);
+
+        if (codec === undefined) {
+            codec = this.createCodec(
+                method,
+                this.createStateUpdater(method.name),
+                this.createJNIEnvArgEncoder(method.name),
+                this.createJNIEnvRetEncoder(method.name)
+            );
+            this.jniEnvCodecs.set(method.name, codec);
+        }
+
+        return codec;
+    }
+
+    private getJavaVMCodec (method: JNIMethod): MethodCodec {
+        let codec = this.javaVMCodecs.get(method.name);
+
+        if (codec === undefined) {
+            codec = this.createCodec(
+                method,
+                null,
+                this.createJavaVMArgEncoder(method.name),
+                noData
+            );
+            this.javaVMCodecs.set(method.name, codec);
+        }
+
+        return codec;
+    }
+
+    private getJavaParamNames (javaMethod: JavaMethod): NameCache[] {
+        let names = this.javaParamNames.get(javaMethod);
+
+        if (names === undefined) {
+            names = javaMethod.nativeParams.map(
+                (param: string): NameCache => this.getNameCache(param)
+            );
+            this.javaParamNames.set(javaMethod, names);
+        }
+
+        return names;
+    }
+
+    private matchesFilters (name: string): boolean {
         if (this.include.length > EMPTY_ARRAY_LEN) {
-            const included = this.include.filter(
-                (i: string): boolean => new RegExp(i).test(name)
+            const included = this.include.some(
+                (i: RegExp): boolean => i.test(name)
             );
-            if (included.length === EMPTY_ARRAY_LEN) {
+            if (!included) {
                 return true;
             }
         }
         if (this.exclude.length > EMPTY_ARRAY_LEN) {
-            const excluded = this.exclude.filter(
-                (e: string): boolean => new RegExp(e).test(name)
+            const excluded = this.exclude.some(
+                (e: RegExp): boolean => e.test(name)
             );
-            if (excluded.length > EMPTY_ARRAY_LEN) {
+            if (excluded) {
                 return true;
             }
         }
@@ -398,66 +1018,67 @@ class DataTransport {
         return false;
     }
 
+    private isIgnoredMethod (name: string): boolean {
+        let ignored = this.ignoredMethods.get(name);
+
+        if (ignored === undefined) {
+            ignored = this.matchesFilters(name);
+            this.ignoredMethods.set(name, ignored);
+        }
+
+        return ignored;
+    }
+
+    private isSampledOut (name: string): boolean {
+        return this.sampler !== null && !this.sampler.admit(name);
+    }
+
+    private shouldIgnoreMethod (data: MethodData): boolean {
+        return this.isIgnoredMethod(data.method.name);
+    }
+
     private enrichSingleItem (
-        type: string,
-        key: string,
+        names: LruMap<string>,
+        value: NativeArgumentValue | NativeReturnValue,
         item: DataJSONContainer
     ): void {
-        if (Types.isComplexObjectType(type)) {
-            if (this.jobjects.has(key)) {
-                item.setMetadata(this.jobjects.get(key));
-            }
-        } else if (type === "jmethodID") {
-            if (this.jmethodIDs.has(key)) {
-                item.setMetadata(this.jmethodIDs.get(key));
-            }
-        } else if (type === "jfieldID") {
-            if (this.jfieldIDs.has(key)) {
-                item.setMetadata(this.jfieldIDs.get(key));
-            }
-        } else if (type === "jstring") {
-            if (this.jstrings.has(key)) {
-                item.setMetadata(this.jstrings.get(key));
-            }
+        const metadata = names.get(LruMap.toKey(value));
+        if (metadata !== undefined) {
+            item.setMetadata(metadata);
         }
     }
 
-    private enrichTraceData (data: MethodData,
+    private enrichTraceData (
+        codec: MethodCodec,
+        data: MethodData,
         args: DataJSONContainer[],
         ret: DataJSONContainer[]
     ): void {
         const ONLY_RET = 0;
-        let i = 0;
-        for (; i < data.method.args.length; i++) {
-            if (["jvalue*, va_list"].includes(data.method.args[i])) {
-                i++;
-                continue;
-            } else if (data.method.args[i] === "...") {
-                break;
-            }
 
+        codec.argSlots.forEach((slot: EnrichmentSlot): void => {
             this.enrichSingleItem(
-                data.method.args[i],
-                data.args[i].toString(),
-                args[i]
+                slot.names,
+                data.args[slot.index],
+                args[slot.index]
             );
-        }
+        });
 
-        const OFFSET = i;
-        for (; i < args.length; i++) {
-            if (data.javaMethod !== undefined) {
-                this.enrichSingleItem(
-                    data.javaMethod.nativeParams[i - OFFSET],
-                    data.args[i].toString(),
-                    args[i]
-                );
+        if (data.javaMethod !== undefined) {
+            const paramNames = this.getJavaParamNames(data.javaMethod);
+            const offset = codec.javaParamsOffset;
+            for (let i = offset; i < args.length; i++) {
+                const names = paramNames[i - offset];
+                if (names !== undefined && names !== null) {
+                    this.enrichSingleItem(names, data.args[i], args[i]);
+                }
             }
         }
 
-        if (data.ret !== undefined) {
+        if (codec.retNames !== null && data.ret !== undefined) {
             this.enrichSingleItem(
-                data.method.ret,
-                data.ret.toString(),
+                codec.retNames,
+                data.ret,
                 ret[ONLY_RET]
             );
         }
@@ -738,7 +1359,7 @@ class DataTransport {
         const nType = Types.convertNativeJTypeToFridaType(type);
         const size = Types.sizeOf(nType);
         const buf = data.getArgAsPtr(BUFFER_PTR_INDEX);
-        const byteArray = data.getArgAsPtr(BYTE_ARRAY_INDEX).toString();
+        const byteArray = LruMap.toKey(data.getArgAsPtr(BYTE_ARRAY_INDEX));
         const len = this.byteArraySizes.get(byteArray);
 
         let region = null;
@@ -773,94 +1394,94 @@ class DataTransport {
         }
     }
 
-    private addJNIEnvArgs (
-        data: MethodData,
-        outputArgs: DataJSONContainer[]
-    ): ArrayBuffer | null {
-        const name = data.method.name;
-
+    private createJNIEnvArgEncoder (name: string): ArgEncoder {
         if (name === "DefineClass") {
-            return this.addDefineClassArgs(data, outputArgs);
+            return this.addDefineClassArgs.bind(this);
         } else if (name === "FindClass") {
-            this.addFindClassArgs(data, outputArgs);
+            return withoutData(this.addFindClassArgs.bind(this));
         } else if (name === "ThrowNew") {
-            this.addThrowNewArgs(data, outputArgs);
+            return withoutData(this.addThrowNewArgs.bind(this));
         } else if (name === "FatalError") {
-            this.addFatalErrorArgs(data, outputArgs);
+            return withoutData(this.addFatalErrorArgs.bind(this));
         } else if (name.endsWith("ID")) {
-            this.addGetGenericIDArgs(data, outputArgs);
+            return withoutData(this.addGetGenericIDArgs.bind(this));
         } else if (name === "NewString") {
-            return this.addNewStringArgs(data, outputArgs);
+            return this.addNewStringArgs.bind(this);
         } else if (name.startsWith("Get") && name.endsWith("Chars") ||
                   name.startsWith("Get") && name.endsWith("Elements") ||
                   name.startsWith("Get") && name.endsWith("ArrayCritical") ||
                   name === "GetStringCritical") {
-            this.addGetGenericBufferArgs(data, outputArgs);
+            return withoutData(this.addGetGenericBufferArgs.bind(this));
         } else if (name.startsWith("Release") && name.endsWith("Chars")) {
-            this.addReleaseCharsArgs(data, outputArgs);
+            return withoutData(this.addReleaseCharsArgs.bind(this));
         } else if (name.endsWith("Region")) {
-            return this.addGetGenericBufferRegionArgs(data, outputArgs);
+            return this.addGetGenericBufferRegionArgs.bind(this);
         } else if (name === "NewStringUTF") {
-            this.addNewStringUTFArgs(data, outputArgs);
+            return withoutData(this.addNewStringUTFArgs.bind(this));
         } else if (name === "RegisterNatives") {
-            this.addRegisterNativesArgs(data, outputArgs);
+            return withoutData(this.addRegisterNativesArgs.bind(this));
         } else if (name === "GetJavaVM") {
-            this.addGetJavaVMArgs(data, outputArgs);
+            return withoutData(this.addGetJavaVMArgs.bind(this));
         } else if (name === "ReleaseStringCritical") {
-            this.addReleaseStringCriticalArgs(data, outputArgs);
+            return withoutData(this.addReleaseStringCriticalArgs.bind(this));
         } else if (name.startsWith("Release") && name.endsWith("Elements") ||
                 name.startsWith("Release") && name.endsWith("ArrayCritical")) {
-            return this.addReleaseElementsArgs(data, outputArgs);
-        } else {
-            this.addGenericArgs(data, outputArgs);
+            return this.addReleaseElementsArgs.bind(this);
         }
-        return null;
+        return withoutData(this.addGenericArgs.bind(this));
+    }
+
+    private createJNIEnvRetEncoder (name: string): RetEncoder {
+        if (name.startsWith("Get") && name.endsWith("Elements") ||
+          name.startsWith("Get") && name.endsWith("ArrayCritical")) {
+            return this.addGetElementsRet.bind(this);
+        }
+        return withoutData(this.addGenericRet.bind(this));
     }
 
-    private addJNIEnvRet (
+    private addGetElementsRet (
         data: MethodData,
         outputRet: DataJSONContainer[]
     ): ArrayBuffer | null {
         const RET_INDEX = -1;
         const ENVPTR_ARG_INDEX = 1;
-        const name = data.method.name;
+        const key = LruMap.toKey(data.args[ENVPTR_ARG_INDEX]);
+        const len = this.byteArraySizes.get(key);
 
-        if (name.startsWith("Get") && name.endsWith("Elements") ||
-          name.startsWith("Get") && name.endsWith("ArrayCritical")) {
-            const key = data.args[ENVPTR_ARG_INDEX].toString();
+        if (len === undefined) {
+            this.addGenericRet(data, outputRet);
+            return null;
+        }
 
-            if (this.byteArraySizes.has(key)) {
-                const type = data.method.ret.slice(
-                    TYPE_NAME_START,
-                    TYPE_NAME_END
-                );
-                const nType = Types.convertNativeJTypeToFridaType(type);
-                const size = Types.sizeOf(nType);
-                const buf = data.ret as NativePointer;
-                const len = this.byteArraySizes.get(
-                    data.getArgAsPtr(ENVPTR_ARG_INDEX).toString()
-                ) as number;
-
-                outputRet.push(
-                    new DataJSONContainer(
-                        data.ret,
-                        null,
-                        RET_INDEX
-                    )
-                );
+        const type = data.method.ret.slice(
+            TYPE_NAME_START,
+            TYPE_NAME_END
+        );
+        const nType = Types.convertNativeJTypeToFridaType(type);
+        const size = Types.sizeOf(nType);
+        const buf = data.ret as NativePointer;
 
-                return buf.readByteArray(len * size);
-            }
-        }
-    
         outputRet.push(
             new DataJSONContainer(
                 data.ret,
-                null
+                null,
+                RET_INDEX
             )
         );
 
-        return null;
+        return buf.readByteArray(len * size);
+    }
+
+    private addGenericRet (
+        data: MethodData,
+        outputRet: DataJSONContainer[]
+    ): void {
+        outputRet.push(
+            new DataJSONContainer(
+                data.ret,
+                null
+            )
+        );
     }
 
     private addAttachCurrentThreadArgs (
@@ -926,25 +1547,19 @@ class DataTransport {
         ));
     }
 
-    private addJavaVMArgs (
-        data: MethodData,
-        outputArgs: DataJSONContainer[]
-    ): ArrayBuffer | null {
-        const name = data.method.name;
-
+    private createJavaVMArgEncoder (name: string): ArgEncoder {
         if (name.startsWith("AttachCurrentThread")) {
-            return this.addAttachCurrentThreadArgs(data, outputArgs);
+            return this.addAttachCurrentThreadArgs.bind(this);
         } else if (name === "GetEnv") {
-            this.addGetEnvArgs(data, outputArgs);
+            return withoutData(this.addGetEnvArgs.bind(this));
         }
-
-        return null;
+        return noData;
     }
 
     private createBacktrace (
         context: CpuContext | NativePointer[],
         type: string
-    ): BacktraceJSONContainer[] {
+    ): number {
         let bt = context;
 
         if (!(bt instanceof Array)) {
@@ -957,13 +1572,97 @@ class DataTransport {
             bt = Thread.backtrace(context as CpuContext, backtraceType);
         }
 
-        return bt.map((addr: NativePointer): BacktraceJSONContainer => {
-            return new BacktraceJSONContainer(
-                addr,
-                Process.findModuleByAddress(addr),
-                DebugSymbol.fromAddress(addr)
-            );
+        return this.backtraceResolver.intern(bt);
+    }
+
+    private getDataOwner (
+        args: DataJSONContainer[],
+        ret: DataJSONContainer
+    ): DataJSONContainer {
+        let owner = ret;
+        args.forEach((arg: DataJSONContainer): void => {
+            if (arg.data_for !== undefined) {
+                owner = arg;
+            }
         });
+        return owner;
+    }
+
+    private limitData (
+        data: ArrayBuffer,
+        args: DataJSONContainer[],
+        ret: DataJSONContainer
+    ): ArrayBuffer {
+        if (this.maxDataBytes === NO_DATA_LIMIT ||
+                data.byteLength <= this.maxDataBytes) {
+            return data;
+        }
+
+        const bytes = new Uint8Array(data);
+        const captured = new Uint8Array(this.maxDataBytes);
+        const head = Math.ceil(this.maxDataBytes / HALF);
+        const tail = this.maxDataBytes - head;
+
+        captured.set(bytes.subarray(BUFFER_START, head));
+        captured.set(bytes.subarray(bytes.length - tail), head);
+
+        this.getDataOwner(args, ret).setTruncated(
+            data.byteLength, head, Hash.fnv1a32(data)
+        );
+
+        return captured.buffer;
+    }
+
+    private matchesFlightTrigger (name: string): boolean {
+        return this.flightTriggers.some((t: RegExp): boolean => t.test(name));
+    }
+
+    private createCallBacktrace (
+        context: NativePointer[] | undefined
+    ): number | undefined {
+        if (context === undefined) {
+            return undefined;
+        }
+
+        const config = Config.getInstance();
+        const backtraceStart = this.startTiming();
+        const backtraceId = this.createBacktrace(context, config.backtrace);
+        this.endTiming("backtrace", backtraceStart);
+        return backtraceId;
+    }
+
+    private encodeCall (
+        call: TracedCall,
+        backtraceId: number | undefined
+    ): FlightEntry {
+        let sendData = call.sendData;
+        // Buffers seen before are sent once, and later calls only carry
+        // their digest.
+        if (sendData !== null && this.blobCache !== null &&
+                sendData.byteLength >= this.blobCache.minBytes) {
+            this.getDataOwner(call.args, call.ret).setDigest(
+                this.blobCache.intern(sendData)
+            );
+            sendData = null;
+        }
+
+        const data = call.data;
+        const output = new RecordJSONContainer(
+            call.type,
+            data.method,
+            call.args,
+            call.ret,
+            call.threadId,
+            call.timestamp,
+            data.jParams,
+            backtraceId
+        );
+        if (data.startTime !== undefined && data.startTime !== NOT_TIMED &&
+                data.duration !== undefined) {
+            output.setTiming(data.startTime - this.clockStart, data.duration);
+        }
+
+        return new FlightEntry(output, sendData);
     }
 
     private sendToHost (
@@ -974,26 +1673,45 @@ class DataTransport {
         sendData: ArrayBuffer | null,
         context: NativePointer[] | undefined
     ): void {
-        const config = Config.getInstance();
-        const jParams = data.jParams;
-        let backtrace = undefined;
-
-        if (context !== undefined) {
-            backtrace = this.createBacktrace(context, config.backtrace);
+        // Stacks are only interned for calls that are sent now. The flight
+        // recorder resolves them when it is dumped.
+        let backtraceId = undefined;
+        if (this.flightRecorder === null) {
+            backtraceId = this.createCallBacktrace(context);
         }
 
-        const output = new RecordJSONContainer(
-            type,
-            data.method,
-            args,
-            ret,
-            Process.getCurrentThreadId(),
-            Date.now() - this.start,
-            jParams,
-            backtrace
+        const sendStart = this.startTiming();
+        // Buffers are cut down to --max-data-bytes before the call is kept,
+        // so the flight recorder never holds more of a buffer than is sent.
+        const limited = sendData === null ? null
+            : this.limitData(sendData, args, ret);
+        const call = new TracedCall(
+            type, data, args, ret, limited, context, Date.now() - this.start
         );
 
-        send(output, sendData);
+        if (this.flightRecorder !== null) {
+            this.flightRecorder.push(
+                call, limited === null ? NO_SENT_DATA : limited.byteLength
+            );
+        } else {
+            const entry = this.encodeCall(call, backtraceId);
+            if (this.batcher !== null) {
+                this.batcher.push(entry.record, entry.data);
+            } else {
+                send(entry.record, entry.data);
+                this.countSent(
+                    [entry.record],
+                    entry.data === null ? NO_SENT_DATA : entry.data.byteLength
+                );
+            }
+        }
+        this.endTiming("send", sendStart);
+    }
+
+    private countSent (records: object[], dataBytes: number): void {
+        if (this.stats !== null) {
+            this.stats.countSent(records, dataBytes);
+        }
     }
 }
 
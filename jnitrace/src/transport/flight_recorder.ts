@@ -0,0 +1,121 @@
+import { RecordBatcher, SendListener } from "./record_batcher";
+
+const DUMP_BATCH_SIZE = 500;
+const DUMP_BATCH_INTERVAL = 0;
+const EMPTY = 0;
+const LAST_ENTRY = 1;
+
+class FlightEntry {
+    public readonly record: object;
+
+    public readonly data: ArrayBuffer | null;
+
+    public constructor (record: object, data: ArrayBuffer | null) {
+        this.record = record;
+        this.data = data;
+    }
+}
+
+type FlightEncoder<T> = (call: T) => FlightEntry;
+
+/*
+ * Calls are held as they were traced, and only turned into records when the
+ * recorder is dumped, so resolving backtraces and interning stacks and
+ * buffers is skipped for the calls that are overwritten before a trigger.
+ * Along with the number of calls, the bytes of the buffers they captured are
+ * capped, and the oldest calls are dropped early to stay under the cap.
+ */
+class FlightRecorder<T> {
+    private readonly entries: (T | undefined)[];
+
+    private readonly sizes: number[];
+
+    private readonly maxBytes: number;
+
+    private bytes: number;
+
+    private next: number;
+
+    private count: number;
+
+    private overwritten: number;
+
+    private readonly onSend: SendListener | null;
+
+    public constructor (
+        capacity: number,
+        maxBytes: number,
+        onSend: SendListener | null = null
+    ) {
+        this.entries = new Array<T | undefined>(capacity);
+        this.sizes = new Array<number>(capacity).fill(EMPTY);
+        this.maxBytes = maxBytes;
+        this.bytes = 0;
+        this.onSend = onSend;
+        this.next = 0;
+        this.count = 0;
+        this.overwritten = 0;
+    }
+
+    public push (call: T, bytes: number): void {
+        this.bytes += bytes - this.sizes[this.next];
+        this.entries[this.next] = call;
+        this.sizes[this.next] = bytes;
+        this.next = (this.next + 1) % this.entries.length;
+
+        if (this.count < this.entries.length) {
+            this.count++;
+        } else {
+            this.overwritten++;
+        }
+
+        while (this.bytes > this.maxBytes && this.count > LAST_ENTRY) {
+            this.dropOldest();
+        }
+    }
+
+    public dump (reason: string, encode: FlightEncoder<T>): void {
+        send({
+            type: "flight_recorder_dump",
+            reason: reason,
+            records: this.count,
+            overwritten: this.overwritten
+        });
+
+        if (this.count === EMPTY) {
+            return;
+        }
+
+        const capacity = this.entries.length;
+        const first = (this.next - this.count + capacity) % capacity;
+        const batcher = new RecordBatcher(
+            DUMP_BATCH_SIZE, DUMP_BATCH_INTERVAL, this.onSend
+        );
+
+        for (let i = 0; i < this.count; i++) {
+            const index = (first + i) % capacity;
+            const entry = encode(this.entries[index] as T);
+            batcher.push(entry.record, entry.data);
+            this.entries[index] = undefined;
+            this.sizes[index] = EMPTY;
+        }
+        batcher.flush();
+
+        this.count = 0;
+        this.overwritten = 0;
+        this.bytes = 0;
+    }
+
+    private dropOldest (): void {
+        const capacity = this.entries.length;
+        const first = (this.next - this.count + capacity) % capacity;
+
+        this.bytes -= this.sizes[first];
+        this.entries[first] = undefined;
+        this.sizes[first] = EMPTY;
+        this.count--;
+        this.overwritten++;
+    }
+}
+
+export { FlightRecorder, FlightEntry };
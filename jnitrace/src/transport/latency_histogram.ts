@@ -0,0 +1,132 @@
+import { BacktraceResolver } from "./backtrace_resolver";
+
+const CALLER_INDEX = 0;
+const EMPTY_HISTOGRAM = 0;
+const NS_PER_US = 1000;
+const SUB_BUCKET_BITS = 3;
+const SUB_BUCKETS = 8;
+const LINEAR_LIMIT = 16;
+
+/*
+ * Durations are counted in log-linear buckets of nanoseconds: exact values
+ * below 16ns, then 8 buckets for every power of two, which keeps the error
+ * of a percentile within 12.5%. The host maps bucket indices back to
+ * durations with the same layout, so it can merge reports from any number
+ * of intervals before computing percentiles.
+ */
+function getBucket (durationUs: number): number {
+    const nanos = Math.max(Math.round(durationUs * NS_PER_US), 0);
+
+    if (nanos < LINEAR_LIMIT) {
+        return nanos;
+    }
+
+    const exponent = Math.floor(Math.log2(nanos));
+    const shift = Math.pow(2, exponent - SUB_BUCKET_BITS);
+    const sub = Math.floor(nanos / shift) - SUB_BUCKETS;
+
+    return LINEAR_LIMIT + (exponent - SUB_BUCKET_BITS - 1) * SUB_BUCKETS + sub;
+}
+
+class LatencyHistogramEntry {
+    public readonly callType: string;
+
+    public readonly method: string;
+
+    public readonly caller: NativePointer | null;
+
+    public readonly buckets: Map<number, number>;
+
+    public count: number;
+
+    public totalUs: number;
+
+    public maxUs: number;
+
+    public constructor (
+        callType: string,
+        method: string,
+        caller: NativePointer | null
+    ) {
+        this.callType = callType;
+        this.method = method;
+        this.caller = caller;
+        this.buckets = new Map<number, number>();
+        this.count = 0;
+        this.totalUs = 0;
+        this.maxUs = 0;
+    }
+
+    public add (durationUs: number): void {
+        const bucket = getBucket(durationUs);
+        const count = this.buckets.get(bucket);
+
+        this.buckets.set(bucket, count === undefined ? 1 : count + 1);
+        this.count++;
+        this.totalUs += durationUs;
+        this.maxUs = Math.max(this.maxUs, durationUs);
+    }
+}
+
+class LatencyHistograms {
+    private entries: Map<string, LatencyHistogramEntry>;
+
+    public constructor () {
+        this.entries = new Map<string, LatencyHistogramEntry>();
+    }
+
+    public record (
+        callType: string,
+        method: string,
+        backtrace: NativePointer[] | undefined,
+        durationUs: number
+    ): void {
+        let caller = null;
+        let key = method;
+
+        if (backtrace !== undefined && backtrace.length > CALLER_INDEX) {
+            caller = backtrace[CALLER_INDEX];
+            key += ":" + caller.toString();
+        }
+
+        let entry = this.entries.get(key);
+        if (entry === undefined) {
+            entry = new LatencyHistogramEntry(callType, method, caller);
+            this.entries.set(key, entry);
+        }
+        entry.add(durationUs);
+    }
+
+    public flush (resolver: BacktraceResolver): void {
+        if (this.entries.size === EMPTY_HISTOGRAM) {
+            return;
+        }
+
+        const calls: object[] = [];
+        this.entries.forEach((entry: LatencyHistogramEntry): void => {
+            let caller = null;
+            if (entry.caller !== null) {
+                caller = resolver.describeCaller(entry.caller);
+            }
+            /* eslint-disable @typescript-eslint/camelcase */
+            calls.push({
+                call_type: entry.callType,
+                method: entry.method,
+                caller: caller,
+                count: entry.count,
+                total_us: entry.totalUs,
+                max_us: entry.maxUs,
+                buckets: Array.from(entry.buckets.entries())
+            });
+            /* eslint-enable @typescript-eslint/camelcase */
+        });
+        this.entries = new Map<string, LatencyHistogramEntry>();
+
+        send({
+            type: "latency_histogram",
+            calls: calls
+        });
+    }
+}
+
+export { LatencyHistograms };
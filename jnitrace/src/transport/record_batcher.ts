@@ -0,0 +1,100 @@
+const NO_DATA = -1;
+const EMPTY_BATCH = 0;
+const MAX_BATCH_BYTES = 1048576;
+
+type SendListener = (records: object[], dataBytes: number) => void;
+
+class RecordBatcher {
+    private readonly maxRecords: number;
+
+    private readonly interval: number;
+
+    private records: object[];
+
+    private blobs: ArrayBuffer[];
+
+    private dataLengths: number[];
+
+    private byteCount: number;
+
+    private timer: ReturnType<typeof setTimeout> | null;
+
+    private readonly onSend: SendListener | null;
+
+    public constructor (
+        maxRecords: number,
+        interval: number,
+        onSend: SendListener | null = null
+    ) {
+        this.maxRecords = maxRecords;
+        this.interval = interval;
+        this.onSend = onSend;
+        this.records = [];
+        this.blobs = [];
+        this.dataLengths = [];
+        this.byteCount = 0;
+        this.timer = null;
+    }
+
+    public push (record: object, data: ArrayBuffer | null): void {
+        this.records.push(record);
+
+        if (data === null) {
+            this.dataLengths.push(NO_DATA);
+        } else {
+            this.blobs.push(data);
+            this.dataLengths.push(data.byteLength);
+            this.byteCount += data.byteLength;
+        }
+
+        if (this.records.length >= this.maxRecords ||
+                this.byteCount >= MAX_BATCH_BYTES) {
+            this.flush();
+        } else if (this.timer === null) {
+            this.timer = setTimeout((): void => {
+                this.timer = null;
+                this.flush();
+            }, this.interval);
+        }
+    }
+
+    public flush (): void {
+        if (this.timer !== null) {
+            clearTimeout(this.timer);
+            this.timer = null;
+        }
+
+        if (this.records.length === EMPTY_BATCH) {
+            return;
+        }
+
+        let sendData = null;
+        if (this.blobs.length > EMPTY_BATCH) {
+            const buffer = new Uint8Array(this.byteCount);
+            let offset = 0;
+            this.blobs.forEach((blob: ArrayBuffer): void => {
+                buffer.set(new Uint8Array(blob), offset);
+                offset += blob.byteLength;
+            });
+            sendData = buffer.buffer;
+        }
+
+        /* eslint-disable @typescript-eslint/camelcase */
+        send({
+            type: "trace_batch",
+            records: this.records,
+            data_lengths: this.dataLengths
+        }, sendData);
+        /* eslint-enable @typescript-eslint/camelcase */
+        if (this.onSend !== null) {
+            this.onSend(this.records, this.byteCount);
+        }
+
+        this.records = [];
+        this.blobs = [];
+        this.dataLengths = [];
+        this.byteCount = 0;
+    }
+}
+
+export { RecordBatcher, SendListener };
@@ -0,0 +1,421 @@
+import { JNIMethod } from "jnitrace-engine";
+import { Types } from "../utils/types";
+import { LruMap, PointerKey } from "../utils/lru_map";
+import { BacktraceResolver } from "./backtrace_resolver";
+
+const CALLER_INDEX = 0;
+const REF_INDEX = 1;
+const METHODS_PTR_INDEX = 2;
+const SIZE_INDEX = 3;
+const JNI_METHOD_SIZE = 3;
+const FN_PTR_OFFSET = 2;
+const JNI_OK = 0;
+const BASE_FRAME = 1;
+const MAX_REPORTED_SITES = 32;
+const NO_REFS = 0;
+
+type RefKind = "local" | "global" | "weak";
+
+class RefSite {
+    public readonly kind: RefKind;
+
+    public readonly method: string;
+
+    public readonly caller: NativePointer | null;
+
+    public live: number;
+
+    public created: number;
+
+    public constructor (
+        kind: RefKind,
+        method: string,
+        caller: NativePointer | null
+    ) {
+        this.kind = kind;
+        this.method = method;
+        this.caller = caller;
+        this.live = 0;
+        this.created = 0;
+    }
+}
+
+class LocalFrame {
+    public readonly isNative: boolean;
+
+    public readonly refs: Map<PointerKey, RefSite>;
+
+    public constructor (isNative: boolean) {
+        this.isNative = isNative;
+        this.refs = new Map<PointerKey, RefSite>();
+    }
+}
+
+class ThreadRefs {
+    public readonly frames: LocalFrame[];
+
+    public live: number;
+
+    public peak: number;
+
+    public constructor () {
+        this.frames = [new LocalFrame(false)];
+        this.live = 0;
+        this.peak = 0;
+    }
+}
+
+class GlobalRefs {
+    public readonly refs: Map<PointerKey, RefSite>;
+
+    public peak: number;
+
+    public constructor () {
+        this.refs = new Map<PointerKey, RefSite>();
+        this.peak = 0;
+    }
+
+    public add (ref: PointerKey, site: RefSite): void {
+        const previous = this.refs.get(ref);
+        if (previous !== undefined) {
+            previous.live--;
+        }
+        this.refs.set(ref, site);
+        site.live++;
+        this.peak = Math.max(this.peak, this.refs.size);
+    }
+
+    public delete (ref: PointerKey): boolean {
+        const site = this.refs.get(ref);
+        if (site === undefined) {
+            return false;
+        }
+        site.live--;
+        this.refs.delete(ref);
+        return true;
+    }
+}
+
+/*
+ * RefProfiler keeps the live local references of each thread and the live
+ * global and weak global references, along with the call site that created
+ * each of them. Local references are kept in a stack of frames, so the ones
+ * freed by PopLocalFrame or by a native method returning to Java are dropped
+ * together. Native methods are found from the Java_ exports and JNI_OnLoad
+ * of the tracked libraries and from RegisterNatives, and only the counts per
+ * thread and per call site are reported to the host.
+ */
+class RefProfiler {
+    private readonly threads: Map<number, ThreadRefs>;
+
+    private readonly globals: GlobalRefs;
+
+    private readonly weakGlobals: GlobalRefs;
+
+    private readonly sites: Map<string, RefSite>;
+
+    private readonly nativeMethods: Set<string>;
+
+    private changed: boolean;
+
+    public constructor () {
+        this.threads = new Map<number, ThreadRefs>();
+        this.globals = new GlobalRefs();
+        this.weakGlobals = new GlobalRefs();
+        this.sites = new Map<string, RefSite>();
+        this.nativeMethods = new Set<string>();
+        this.changed = false;
+    }
+
+    public watchLibrary (path: string): void {
+        const name = path.substring(path.lastIndexOf("/") + 1);
+        const module = Process.findModuleByName(name);
+        if (module === null) {
+            return;
+        }
+
+        module.enumerateExports().forEach((e: ModuleExportDetails): void => {
+            if (e.type === "function" &&
+                    (e.name.startsWith("Java_") || e.name === "JNI_OnLoad")) {
+                this.watchNativeMethod(e.address);
+            }
+        });
+    }
+
+    public update (
+        method: JNIMethod,
+        args: NativeArgumentValue[],
+        ret: NativeReturnValue,
+        backtrace: NativePointer[] | undefined
+    ): void {
+        const name = method.name;
+
+        if (name === "NewGlobalRef" || name === "NewWeakGlobalRef") {
+            const kind = name === "NewGlobalRef" ? "global" : "weak";
+            if (!(ret as NativePointer).isNull()) {
+                this.getGlobals(kind).add(
+                    LruMap.toKey(ret),
+                    this.getSite(kind, name, backtrace)
+                );
+                this.changed = true;
+            }
+        } else if (name === "DeleteGlobalRef") {
+            this.deleteGlobal("global", LruMap.toKey(args[REF_INDEX]));
+        } else if (name === "DeleteWeakGlobalRef") {
+            this.deleteGlobal("weak", LruMap.toKey(args[REF_INDEX]));
+        } else if (name === "DeleteLocalRef") {
+            this.deleteLocal(LruMap.toKey(args[REF_INDEX]));
+        } else if (name === "PushLocalFrame") {
+            if ((ret as number) === JNI_OK) {
+                this.getThread().frames.push(new LocalFrame(false));
+            }
+        } else if (name === "PopLocalFrame") {
+            this.popLocalFrame(ret as NativePointer, backtrace);
+        } else if (name === "RegisterNatives") {
+            this.watchRegisteredNatives(args);
+        } else if (name === "DetachCurrentThread") {
+            this.detachThread();
+        } else if (Types.isReferenceType(method.ret) &&
+                !(ret as NativePointer).isNull()) {
+            this.addLocal(
+                this.getThread(),
+                LruMap.toKey(ret),
+                this.getSite("local", name, backtrace)
+            );
+        }
+    }
+
+    public flush (resolver: BacktraceResolver): void {
+        if (!this.changed) {
+            return;
+        }
+        this.changed = false;
+
+        const threads: object[] = [];
+        this.threads.forEach((thread: ThreadRefs, threadId: number): void => {
+            /* eslint-disable @typescript-eslint/camelcase */
+            threads.push({
+                thread_id: threadId,
+                live: thread.live,
+                peak: thread.peak,
+                frames: thread.frames.length - BASE_FRAME
+            });
+            /* eslint-enable @typescript-eslint/camelcase */
+        });
+
+        const live = Array.from(this.sites.values()).filter(
+            (site: RefSite): boolean => site.live > NO_REFS
+        );
+        live.sort((a: RefSite, b: RefSite): number => b.live - a.live);
+
+        const sites = live.slice(0, MAX_REPORTED_SITES).map(
+            (site: RefSite): object => {
+                let caller = null;
+                if (site.caller !== null) {
+                    caller = resolver.describeCaller(site.caller);
+                }
+                return {
+                    kind: site.kind,
+                    method: site.method,
+                    caller: caller,
+                    live: site.live,
+                    created: site.created
+                };
+            }
+        );
+
+        /* eslint-disable @typescript-eslint/camelcase */
+        send({
+            type: "ref_pressure",
+            threads: threads,
+            globals: {
+                live: this.globals.refs.size,
+                peak: this.globals.peak
+            },
+            weak_globals: {
+                live: this.weakGlobals.refs.size,
+                peak: this.weakGlobals.peak
+            },
+            sites: sites
+        });
+        /* eslint-enable @typescript-eslint/camelcase */
+    }
+
+    private getGlobals (kind: RefKind): GlobalRefs {
+        return kind === "weak" ? this.weakGlobals : this.globals;
+    }
+
+    private deleteGlobal (kind: RefKind, ref: PointerKey): void {
+        if (this.getGlobals(kind).delete(ref)) {
+            this.changed = true;
+        }
+    }
+
+    private getSite (
+        kind: RefKind,
+        method: string,
+        backtrace: NativePointer[] | undefined
+    ): RefSite {
+        let caller = null;
+        let key = kind + ":" + method;
+
+        if (backtrace !== undefined && backtrace.length > CALLER_INDEX) {
+            caller = backtrace[CALLER_INDEX];
+            key += ":" + caller.toString();
+        }
+
+        let site = this.sites.get(key);
+        if (site === undefined) {
+            site = new RefSite(kind, method, caller);
+            this.sites.set(key, site);
+        }
+        site.created++;
+        return site;
+    }
+
+    private getThread (): ThreadRefs {
+        const threadId = Process.getCurrentThreadId();
+        let thread = this.threads.get(threadId);
+
+        if (thread === undefined) {
+            thread = new ThreadRefs();
+            this.threads.set(threadId, thread);
+        }
+        return thread;
+    }
+
+    private addLocal (
+        thread: ThreadRefs,
+        ref: PointerKey,
+        site: RefSite
+    ): void {
+        const frame = thread.frames[thread.frames.length - 1];
+        const previous = frame.refs.get(ref);
+
+        if (previous === undefined) {
+            thread.live++;
+            thread.peak = Math.max(thread.peak, thread.live);
+        } else {
+            previous.live--;
+        }
+        frame.refs.set(ref, site);
+        site.live++;
+        this.changed = true;
+    }
+
+    private deleteLocal (ref: PointerKey): void {
+        const thread = this.threads.get(Process.getCurrentThreadId());
+        if (thread === undefined) {
+            return;
+        }
+
+        for (let i = thread.frames.length - 1; i >= 0; i--) {
+            const site = thread.frames[i].refs.get(ref);
+            if (site !== undefined) {
+                site.live--;
+                thread.frames[i].refs.delete(ref);
+                thread.live--;
+                this.changed = true;
+                return;
+            }
+        }
+    }
+
+    private releaseFrame (thread: ThreadRefs): LocalFrame {
+        const frame = thread.frames.pop() as LocalFrame;
+
+        frame.refs.forEach((site: RefSite): void => {
+            site.live--;
+        });
+        if (frame.refs.size > NO_REFS) {
+            thread.live -= frame.refs.size;
+            this.changed = true;
+        }
+        return frame;
+    }
+
+    private popLocalFrame (
+        result: NativePointer,
+        backtrace: NativePointer[] | undefined
+    ): void {
+        const thread = this.getThread();
+        const top = thread.frames[thread.frames.length - 1];
+
+        if (thread.frames.length > BASE_FRAME && !top.isNative) {
+            this.releaseFrame(thread);
+        }
+        // The result is a new local reference in the enclosing frame.
+        if (!result.isNull()) {
+            this.addLocal(
+                thread,
+                LruMap.toKey(result),
+                this.getSite("local", "PopLocalFrame", backtrace)
+            );
+        }
+    }
+
+    private enterNative (): void {
+        this.getThread().frames.push(new LocalFrame(true));
+    }
+
+    private leaveNative (): void {
+        const thread = this.threads.get(Process.getCurrentThreadId());
+        if (thread === undefined) {
+            return;
+        }
+
+        // Returning to Java frees the locals of the native method, including
+        // any frame it pushed and never popped.
+        while (thread.frames.length > BASE_FRAME) {
+            if (this.releaseFrame(thread).isNative) {
+                return;
+            }
+        }
+    }
+
+    private detachThread (): void {
+        const threadId = Process.getCurrentThreadId();
+        const thread = this.threads.get(threadId);
+        if (thread === undefined) {
+            return;
+        }
+
+        thread.frames.forEach((frame: LocalFrame): void => {
+            frame.refs.forEach((site: RefSite): void => {
+                site.live--;
+            });
+        });
+        this.threads.delete(threadId);
+        this.changed = true;
+    }
+
+    private watchRegisteredNatives (args: NativeArgumentValue[]): void {
+        const methods = args[METHODS_PTR_INDEX] as NativePointer;
+        const size = args[SIZE_INDEX] as number;
+
+        for (let i = 0; i < size; i++) {
+            this.watchNativeMethod(methods.add(
+                (i * JNI_METHOD_SIZE + FN_PTR_OFFSET) * Process.pointerSize
+            ).readPointer());
+        }
+    }
+
+    private watchNativeMethod (address: NativePointer): void {
+        const key = address.toString();
+        if (this.nativeMethods.has(key)) {
+            return;
+        }
+        this.nativeMethods.add(key);
+
+        Interceptor.attach(address, {
+            onEnter: (): void => {
+                this.enterNative();
+            },
+            onLeave: (): void => {
+                this.leaveNative();
+            }
+        });
+    }
+}
+
+export { RefProfiler };
@@ -0,0 +1,113 @@
+import { Clock } from "../utils/clock";
+
+const EMPTY_REPORT = 0;
+const SIZE_SAMPLE_INTERVAL = 64;
+const SAMPLED = 0;
+
+class StageTiming {
+    public count: number;
+
+    public totalMicros: number;
+
+    public maxMicros: number;
+
+    public constructor () {
+        this.count = 0;
+        this.totalMicros = 0;
+        this.maxMicros = 0;
+    }
+}
+
+class TracerStats {
+    private stages: Map<string, StageTiming>;
+
+    private records: number;
+
+    private bytes: number;
+
+    private last: number;
+
+    private seen: number;
+
+    private sampledRecords: number;
+
+    private sampledBytes: number;
+
+    public constructor () {
+        this.stages = new Map<string, StageTiming>();
+        this.records = 0;
+        this.bytes = 0;
+        this.seen = 0;
+        this.sampledRecords = 0;
+        this.sampledBytes = 0;
+        this.last = Clock.nowMicros();
+    }
+
+    public time (stage: string, start: number): void {
+        const elapsed = Clock.nowMicros() - start;
+        let timing = this.stages.get(stage);
+
+        if (timing === undefined) {
+            timing = new StageTiming();
+            this.stages.set(stage, timing);
+        }
+        timing.count++;
+        timing.totalMicros += elapsed;
+        timing.maxMicros = Math.max(timing.maxMicros, elapsed);
+    }
+
+    /*
+     * Serializing every record again to measure it would double the cost of
+     * sending it, so only one record in SIZE_SAMPLE_INTERVAL is measured and
+     * the others are counted at the mean size of the measured records.
+     */
+    public countSent (records: object[], dataBytes: number): void {
+        records.forEach((record: object): void => {
+            if (this.seen++ % SIZE_SAMPLE_INTERVAL === SAMPLED) {
+                this.sampledRecords++;
+                this.sampledBytes += JSON.stringify(record).length;
+            }
+        });
+        this.records += records.length;
+        this.bytes += dataBytes +
+            records.length * this.sampledBytes / this.sampledRecords;
+    }
+
+    public flush (): void {
+        const now = Clock.nowMicros();
+
+        if (this.stages.size === EMPTY_REPORT) {
+            this.last = now;
+            return;
+        }
+
+        const stages: object[] = [];
+        this.stages.forEach((timing: StageTiming, stage: string): void => {
+            /* eslint-disable @typescript-eslint/camelcase */
+            stages.push({
+                stage: stage,
+                count: timing.count,
+                total_us: timing.totalMicros,
+                max_us: timing.maxMicros
+            });
+            /* eslint-enable @typescript-eslint/camelcase */
+        });
+
+        /* eslint-disable @typescript-eslint/camelcase */
+        send({
+            type: "tracer_stats",
+            interval_us: now - this.last,
+            stages: stages,
+            records: this.records,
+            bytes: this.bytes
+        });
+        /* eslint-enable @typescript-eslint/camelcase */
+
+        this.stages = new Map<string, StageTiming>();
+        this.records = 0;
+        this.bytes = 0;
+        this.last = now;
+    }
+}
+
+export { TracerStats };
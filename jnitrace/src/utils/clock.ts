@@ -0,0 +1,57 @@
+const CLOCK_MONOTONIC = 1;
+const TIMESPEC_FIELDS = 2;
+const US_PER_SECOND = 1000000;
+const NS_PER_US = 1000;
+const US_PER_MS = 1000;
+
+type ClockGettime = (clock: number, timespec: NativePointer) => number;
+
+let clockGettime: ClockGettime | null = null;
+let timespec: NativePointer | null = null;
+let resolved = false;
+
+function resolveClock (): void {
+    resolved = true;
+
+    const address = Module.findExportByName(null, "clock_gettime");
+    if (address === null) {
+        return;
+    }
+
+    // The timespec buffer is shared by every thread, so the JS lock is kept
+    // across the call rather than letting another thread overwrite the
+    // buffer before it is read.
+    const native = new NativeFunction(
+        address, "int", ["int", "pointer"], { scheduling: "exclusive" }
+    );
+    clockGettime = (clock: number, spec: NativePointer): number => {
+        return native(clock, spec) as number;
+    };
+    timespec = Memory.alloc(Process.pointerSize * TIMESPEC_FIELDS);
+}
+
+const Clock = {
+    /*
+     * Date.now() only has millisecond resolution, which is far coarser than
+     * the work done for a single JNI call, so the monotonic clock is read
+     * through libc instead. Timings fall back to Date.now() when libc's
+     * clock_gettime cannot be found.
+     */
+    nowMicros (): number {
+        if (!resolved) {
+            resolveClock();
+        }
+
+        if (clockGettime === null || timespec === null) {
+            return Date.now() * US_PER_MS;
+        }
+
+        clockGettime(CLOCK_MONOTONIC, timespec);
+        const seconds = Number(timespec.readLong());
+        const nanos = Number(timespec.add(Process.pointerSize).readLong());
+
+        return seconds * US_PER_SECOND + nanos / NS_PER_US;
+    }
+};
+
+export { Clock };
@@ -0,0 +1,19 @@
+const FNV_OFFSET_BASIS = 0x811c9dc5;
+const FNV_PRIME = 0x01000193;
+const UNSIGNED_SHIFT = 0;
+
+const Hash = {
+    fnv1a32 (data: ArrayBuffer): number {
+        const bytes = new Uint8Array(data);
+        let hash = FNV_OFFSET_BASIS;
+
+        for (let i = 0; i < bytes.length; i++) {
+            hash ^= bytes[i];
+            hash = Math.imul(hash, FNV_PRIME);
+        }
+
+        return hash >>> UNSIGNED_SHIFT;
+    }
+};
+
+export { Hash };
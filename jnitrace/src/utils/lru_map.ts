@@ -0,0 +1,123 @@
+const UNLIMITED = 0;
+const HIGH_SHIFT = 32;
+const LOW_RANGE = 4294967296;
+const MAX_SAFE_HIGH = 2097152;
+
+type PointerKey = number | string;
+
+class LruMapStats {
+    public readonly size: number;
+
+    public readonly capacity: number;
+
+    public readonly hits: number;
+
+    public readonly misses: number;
+
+    public readonly evictions: number;
+
+    public constructor (
+        size: number,
+        capacity: number,
+        hits: number,
+        misses: number,
+        evictions: number
+    ) {
+        this.size = size;
+        this.capacity = capacity;
+        this.hits = hits;
+        this.misses = misses;
+        this.evictions = evictions;
+    }
+}
+
+class LruMap<V> {
+    private readonly entries: Map<PointerKey, V>;
+
+    private capacity: number;
+
+    private hits: number;
+
+    private misses: number;
+
+    private evictions: number;
+
+    public constructor (capacity: number) {
+        this.entries = new Map<PointerKey, V>();
+        this.capacity = capacity;
+        this.hits = 0;
+        this.misses = 0;
+        this.evictions = 0;
+    }
+
+    public static toKey (
+        value: NativeArgumentValue | NativeReturnValue
+    ): PointerKey {
+        if (value instanceof NativePointer) {
+            const high = value.shr(HIGH_SHIFT).toUInt32();
+            if (high < MAX_SAFE_HIGH) {
+                return high * LOW_RANGE + value.toUInt32();
+            }
+        } else if (typeof value === "number") {
+            return value;
+        }
+        return value.toString();
+    }
+
+    public get (key: PointerKey): V | undefined {
+        const value = this.entries.get(key);
+
+        if (value === undefined) {
+            this.misses++;
+        } else {
+            this.hits++;
+            this.entries.delete(key);
+            this.entries.set(key, value);
+        }
+
+        return value;
+    }
+
+    public set (key: PointerKey, value: V): void {
+        this.entries.delete(key);
+        this.entries.set(key, value);
+        this.evict();
+    }
+
+    public delete (key: PointerKey): void {
+        this.entries.delete(key);
+    }
+
+    public clear (): void {
+        this.entries.clear();
+    }
+
+    public setCapacity (capacity: number): void {
+        this.capacity = capacity;
+        this.evict();
+    }
+
+    public getStats (): LruMapStats {
+        return new LruMapStats(
+            this.entries.size,
+            this.capacity,
+            this.hits,
+            this.misses,
+            this.evictions
+        );
+    }
+
+    private evict (): void {
+        if (this.capacity === UNLIMITED) {
+            return;
+        }
+
+        while (this.entries.size > this.capacity) {
+            const oldest = this.entries.keys().next().value as PointerKey;
+            this.entries.delete(oldest);
+            this.evictions++;
+        }
+    }
+}
+
+export { LruMap, LruMapStats, PointerKey };
@@ -13,16 +13,24 @@ class MethodData {
 
     private readonly _ret: NativeReturnValue;
 
+    private readonly _startTime: number | undefined;
+
+    private readonly _duration: number | undefined;
+
     public constructor (
         method: JNIMethod,
         args: NativeArgumentValue[],
         ret: NativeReturnValue,
-        jmethod?: JavaMethod
+        jmethod?: JavaMethod,
+        startTime?: number,
+        duration?: number
     ) {
         this._method = method;
         this._jmethod = jmethod;
         this._args = args;
         this._ret = ret;
+        this._startTime = startTime;
+        this._duration = duration;
         if (jmethod === undefined) {
             this._jparams = [];
         } else {
@@ -57,6 +65,14 @@ class MethodData {
     public get ret (): NativeReturnValue {
         return this._ret;
     }
+
+    public get startTime (): number | undefined {
+        return this._startTime;
+    }
+
+    public get duration (): number | undefined {
+        return this._duration;
+    }
 }
 
 export { MethodData };
\ No newline at end of file
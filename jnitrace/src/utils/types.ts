@@ -12,6 +12,19 @@ const Types = {
 
         return JOBJECT.includes(type);
     },
+    isReferenceType (type: string): boolean {
+        const REFERENCES = [
+            "jobject",
+            "jclass",
+            "jstring",
+            "jthrowable",
+            "jarray",
+            "jweak"
+        ];
+
+        return REFERENCES.includes(type) ||
+            (type.startsWith("j") && type.endsWith("Array"));
+    },
     sizeOf (type: string): number {
         if (type === "double" || type === "float" || type === "int64") {
             return TYPE_SIZE_64_BIT;
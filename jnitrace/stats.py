@@ -0,0 +1,147 @@
+"""
+Self-profiling used by jnitrace --stats. The agent periodically reports the
+time it spent in each stage of tracing a call, and the host adds the time it
+spent formatting and writing the records it received.
+"""
+
+import time
+
+# pylint: disable=C0209
+
+AGENT_STAGES = ("env_callback", "vm_callback", "backtrace", "send")
+HOST_STAGES = ("format", "output")
+
+STATUS_STAGE_FORMAT = "{} {:.1f}us".format
+STATUS_FORMAT = "{}[stats] agent: {} | {:.0f} records/s {:.1f} KiB/s | " \
+    "host: {}{}\n\n".format
+STATS_HEADER_FORMAT = "{}{:<8s}{:<16s}{:>10s}{:>12s}{:>12s}{:>12s}{}\n".format
+STATS_ROW_FORMAT = "{:<8s}{:<16s}{:10d}{:12.1f}{:12.1f}{:12.1f}\n".format
+STATS_FOOTER_FORMAT = "\n{} records, {:.1f} KiB sent by the agent in " \
+    "{:.1f}s\n\n".format
+
+US_PER_SECOND = 1000000
+BYTES_PER_KIB = 1024
+
+class StageTiming:
+    """
+    StageTiming accumulates the time spent in a stage of tracing.
+    """
+    def __init__(self):
+        self.count = 0
+        self.total_us = 0.0
+        self.max_us = 0.0
+
+    def add(self, count, total_us, max_us):
+        """
+        Add timings to the stage.
+        :param count - the number of times the stage ran
+        :param total_us - the total time spent in the stage
+        :param max_us - the longest single run of the stage
+        """
+        self.count += count
+        self.total_us += total_us
+        self.max_us = max(self.max_us, max_us)
+
+    def mean_us(self):
+        """
+        Get the mean time spent in the stage.
+        :return - the mean time in microseconds
+        """
+        if not self.count:
+            return 0.0
+        return self.total_us / self.count
+
+def _describe_stages(stages, names):
+    return ", ".join(
+        STATUS_STAGE_FORMAT(name, stages[name].mean_us())
+        for name in names if name in stages
+    ) or "-"
+
+class TracerStats:
+    """
+    TracerStats combines the stage timings reported by the agent with the
+    host's own, both for the latest report and for the whole run.
+    """
+    def __init__(self):
+        self._agent = {}
+        self._host = {}
+        self._interval_agent = {}
+        self._interval_host = {}
+        self._records = 0
+        self._bytes = 0
+        self._start = time.monotonic()
+
+    @classmethod
+    def _add(cls, stages, name, count, total_us, max_us):
+        timing = stages.get(name)
+        if timing is None:
+            timing = stages[name] = StageTiming()
+        timing.add(count, total_us, max_us)
+
+    def time_host(self, stage, start):
+        """
+        Record the time the host spent in a stage.
+        :param stage - the name of the stage
+        :param start - the time.perf_counter() value the stage started at
+        """
+        elapsed = (time.perf_counter() - start) * US_PER_SECOND
+        self._add(self._host, stage, 1, elapsed, elapsed)
+        self._add(self._interval_host, stage, 1, elapsed, elapsed)
+
+    def update(self, payload, color="", reset=""):
+        """
+        Add a report of stage timings from the agent.
+        :param payload - the tracer_stats message sent by the agent
+        :param color - the color to print the status line in
+        :param reset - the code to reset the color after the status line
+        :return - a status line describing the reported interval
+        """
+        for stage in payload["stages"]:
+            for stages in (self._agent, self._interval_agent):
+                self._add(
+                    stages, stage["stage"], stage["count"],
+                    stage["total_us"], stage["max_us"]
+                )
+        self._records += payload["records"]
+        self._bytes += payload["bytes"]
+
+        seconds = max(payload["interval_us"] / US_PER_SECOND, 1e-6)
+        line = STATUS_FORMAT(
+            color,
+            _describe_stages(self._interval_agent, AGENT_STAGES),
+            payload["records"] / seconds,
+            payload["bytes"] / BYTES_PER_KIB / seconds,
+            _describe_stages(self._interval_host, HOST_STAGES),
+            reset
+        )
+        self._interval_agent = {}
+        self._interval_host = {}
+        return line
+
+    def render(self, color="", reset=""):
+        """
+        Render the time spent in each stage over the whole run.
+        :param color - the color to print the table header in
+        :param reset - the code to reset the color after the header
+        :return - the formatted table
+        """
+        parts = [STATS_HEADER_FORMAT(
+            color, "Side", "Stage", "Count", "Total ms", "Mean us", "Max us",
+            reset
+        )]
+        for side, stages, names in (("agent", self._agent, AGENT_STAGES),
+                                    ("host", self._host, HOST_STAGES)):
+            for name in names:
+                if name not in stages:
+                    continue
+                timing = stages[name]
+                parts.append(STATS_ROW_FORMAT(
+                    side, name, timing.count, timing.total_us / 1000,
+                    timing.mean_us(), timing.max_us
+                ))
+
+        parts.append(STATS_FOOTER_FORMAT(
+            self._records, self._bytes / BYTES_PER_KIB,
+            time.monotonic() - self._start
+        ))
+        return "".join(parts)
@@ -0,0 +1,346 @@
+"""
+Columnar in-memory store of trace records for analysis after a capture.
+Timestamps, thread ids and interned method ids are kept in compact columns
+and queried with NumPy, while the arguments and captured buffers of each
+record are packed into shared heaps and only decoded when a record is read.
+
+NumPy is an optional dependency, installed with pip install jnitrace[analysis].
+"""
+
+import array
+import json
+import math
+import re
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from jnitrace.output import read_trace
+
+# pylint: disable=C0209
+
+NUMPY_REQUIRED = "TraceStore requires NumPy, install it with " \
+    "pip install jnitrace[analysis]"
+
+NO_ID = -1
+
+COLUMNS = {
+    "timestamps": "q",
+    "thread_ids": "q",
+    "method_ids": "i",
+    "target_ids": "i",
+    "durations": "d",
+    "detail_offsets": "q",
+    "detail_lengths": "i",
+    "data_offsets": "q",
+    "data_lengths": "q"
+}
+
+def _omit_bytes(_):
+    return None
+
+def _find_data_field(record):
+    for field in record["args"] + [record["ret"]]:
+        if ("data_for" in field or "has_data" in field) and \
+                field.get("data") is not None:
+            return field
+    return None
+
+# pylint: disable=too-many-instance-attributes
+class TraceStore:
+    """
+    TraceStore holds the records of a trace in columns. It has the same
+    interface as the output writers, so it can be passed to TraceFormatter to
+    collect records while tracing, or it can be loaded from a saved trace.
+    """
+    def __init__(self):
+        if numpy is None:
+            raise ImportError(NUMPY_REQUIRED)
+
+        self._columns = {
+            name: array.array(typecode) for name, typecode in COLUMNS.items()
+        }
+        self._arrays = {}
+        self._details = bytearray()
+        self._data = bytearray()
+
+        self.methods = []
+        self._method_ids = {}
+        self._method_defs = []
+        self.targets = []
+        self._target_ids = {}
+
+    @classmethod
+    def load(cls, path, blob_dir=None):
+        """
+        Load every record of a saved trace into a new store.
+        :param path - the path of an NDJSON or binary trace
+        :param blob_dir - the --blob-dir the trace was written with, if any
+        :return - the populated store
+        """
+        store = cls()
+        for record in read_trace(path, blob_dir):
+            store.write_record(record)
+        return store
+
+    @classmethod
+    def _intern(cls, value, ids, values):
+        value_id = ids.get(value)
+        if value_id is None:
+            value_id = len(values)
+            ids[value] = value_id
+            values.append(value)
+        return value_id
+
+    def _intern_method(self, struct, method):
+        method_id = self._intern(method["name"], self._method_ids, self.methods)
+        if method_id == len(self._method_defs):
+            self._method_defs.append((struct, method))
+        return method_id
+
+    def write_record(self, record):
+        """
+        Add a record to the store.
+        :param record - the trace record, as passed to the output writers
+        """
+        columns = self._columns
+        self._arrays = {}
+
+        columns["timestamps"].append(record["timestamp"])
+        columns["thread_ids"].append(record["thread_id"])
+        columns["method_ids"].append(
+            self._intern_method(record["struct"], record["method"])
+        )
+        target_id = NO_ID
+        if "target" in record:
+            target_id = self._intern(
+                record["target"], self._target_ids, self.targets
+            )
+        columns["target_ids"].append(target_id)
+        columns["durations"].append(record.get("duration_us", math.nan))
+
+        field = _find_data_field(record)
+        if field is None:
+            columns["data_offsets"].append(NO_ID)
+            columns["data_lengths"].append(NO_ID)
+        else:
+            columns["data_offsets"].append(len(self._data))
+            columns["data_lengths"].append(len(field["data"]))
+            self._data += field["data"]
+
+        details = {
+            key: value for key, value in record.items()
+            if key not in ("struct", "method", "thread_id", "timestamp",
+                           "duration_us")
+        }
+        # Captured buffers are kept in the data heap, so they are left out of
+        # the details as null.
+        encoded = json.dumps(
+            details, separators=(",", ":"), default=_omit_bytes
+        ).encode()
+        columns["detail_offsets"].append(len(self._details))
+        columns["detail_lengths"].append(len(encoded))
+        self._details += encoded
+
+    def flush(self):
+        """
+        Records are held in memory, so there is nothing to flush.
+        """
+
+    def close(self):
+        """
+        Records stay available after tracing stops, so there is nothing to
+        close.
+        """
+
+    def __len__(self):
+        return len(self._columns["timestamps"])
+
+    def _column(self, name):
+        column = self._arrays.get(name)
+        if column is None:
+            column = numpy.frombuffer(
+                self._columns[name], dtype=self._columns[name].typecode
+            ).copy()
+            self._arrays[name] = column
+        return column
+
+    @property
+    def timestamps(self):
+        """
+        The timestamp in ms of every record.
+        """
+        return self._column("timestamps")
+
+    @property
+    def thread_ids(self):
+        """
+        The id of the thread that made every call.
+        """
+        return self._column("thread_ids")
+
+    @property
+    def method_ids(self):
+        """
+        The index into methods of the method of every record.
+        """
+        return self._column("method_ids")
+
+    @property
+    def target_ids(self):
+        """
+        The index into targets of the target of every record, or -1 for
+        records without a target.
+        """
+        return self._column("target_ids")
+
+    @property
+    def durations(self):
+        """
+        The duration in us of every record traced with --latency, or NaN for
+        records without a duration.
+        """
+        return self._column("durations")
+
+    def data(self, index):
+        """
+        Get the buffer captured by a record.
+        :param index - the index of the record
+        :return - the captured bytes, or None if nothing was captured
+        """
+        length = self._columns["data_lengths"][index]
+        if length == NO_ID:
+            return None
+        offset = self._columns["data_offsets"][index]
+        return bytes(self._data[offset:offset + length])
+
+    def record(self, index):
+        """
+        Rebuild a record in the form it was added.
+        :param index - the index of the record
+        :return - the trace record
+        """
+        offset = self._columns["detail_offsets"][index]
+        length = self._columns["detail_lengths"][index]
+        struct, method = \
+            self._method_defs[self._columns["method_ids"][index]]
+
+        record = {
+            "struct": struct,
+            "method": method,
+            "thread_id": self._columns["thread_ids"][index],
+            "timestamp": self._columns["timestamps"][index]
+        }
+        record.update(json.loads(self._details[offset:offset + length]))
+
+        duration = self._columns["durations"][index]
+        if not math.isnan(duration):
+            record["duration_us"] = duration
+
+        data = self.data(index)
+        if data is not None:
+            for field in record["args"] + [record["ret"]]:
+                if "data_for" in field or "has_data" in field:
+                    field["data"] = data
+        return record
+
+    def records(self, indices=None):
+        """
+        Rebuild a set of records.
+        :param indices - the indices of the records, or None for all records
+        :return - a generator of trace records
+        """
+        if indices is None:
+            indices = range(len(self))
+        for index in indices:
+            yield self.record(int(index))
+
+    # pylint: disable=too-many-arguments
+    def mask(self, method=None, thread_ids=None, start=None, end=None,
+             target=None):
+        """
+        Match the records against a set of filters.
+        :param method - an optional regex to match against method names
+        :param thread_ids - an optional collection of thread ids to include
+        :param start - an optional minimum timestamp in ms
+        :param end - an optional maximum timestamp in ms
+        :param target - an optional name of the traced target
+        :return - a boolean array with an entry for every record
+        """
+        mask = numpy.ones(len(self), dtype=bool)
+        if method is not None:
+            pattern = re.compile(method)
+            method_ids = [
+                i for i, name in enumerate(self.methods) if pattern.search(name)
+            ]
+            mask &= numpy.isin(self.method_ids, method_ids)
+        if thread_ids is not None:
+            mask &= numpy.isin(self.thread_ids, list(thread_ids))
+        if start is not None:
+            mask &= self.timestamps >= start
+        if end is not None:
+            mask &= self.timestamps <= end
+        if target is not None:
+            if target in self._target_ids:
+                mask &= self.target_ids == self._target_ids[target]
+            else:
+                mask[:] = False
+        return mask
+
+    def select(self, **filters):
+        """
+        Find the records matching a set of filters.
+        :param filters - the filters accepted by mask
+        :return - an array of the indices of the matching records
+        """
+        return numpy.flatnonzero(self.mask(**filters))
+
+    def count_by(self, column="method", mask=None):
+        """
+        Count the records sharing each value of a column.
+        :param column - one of method, thread_id or target
+        :param mask - an optional boolean array selecting the records counted
+        :return - a dictionary of values to record counts, in descending
+        order of count
+        """
+        if column == "method":
+            values, names = self.method_ids, self.methods
+        elif column == "target":
+            values, names = self.target_ids, self.targets
+        elif column == "thread_id":
+            values, names = self.thread_ids, None
+        else:
+            raise ValueError("cannot group by {}".format(column))
+
+        if mask is not None:
+            values = values[mask]
+        keys, counts = numpy.unique(values, return_counts=True)
+
+        order = numpy.argsort(-counts, kind="stable")
+        return {
+            (int(keys[i]) if names is None or keys[i] == NO_ID
+             else names[keys[i]]): int(counts[i])
+            for i in order
+        }
+
+    def rate(self, bucket_ms=1000, mask=None):
+        """
+        Count the records made in consecutive windows of time.
+        :param bucket_ms - the length of each window in ms
+        :param mask - an optional boolean array selecting the records counted
+        :return - a tuple of an array of window start times and an array of
+        the number of records in each window
+        """
+        timestamps = self.timestamps
+        if mask is not None:
+            timestamps = timestamps[mask]
+        if timestamps.size == 0:
+            return numpy.zeros(0, dtype=numpy.int64), \
+                numpy.zeros(0, dtype=numpy.int64)
+
+        first = timestamps.min()
+        counts = numpy.bincount((timestamps - first) // bucket_ms)
+        starts = first + numpy.arange(len(counts), dtype=numpy.int64) * bucket_ms
+        return starts, counts
@@ -0,0 +1,82 @@
+"""
+Aggregated call counts used by jnitrace --summary. Instead of a record per
+call, the agent periodically reports how many times each method was called
+from each thread and return address since its last report.
+"""
+
+import time
+
+# pylint: disable=C0209
+
+CLEAR_SCREEN = "\x1b[2J\x1b[H"
+
+SUMMARY_HEADER_FORMAT = "{}{:>10s}  {:>8s}  {:<40s}  {}{}\n".format
+SUMMARY_ROW_FORMAT = "{:10d}  {:8d}  {:<40s}  {}\n".format
+SUMMARY_FOOTER_FORMAT = "\n{} calls to {} call sites in {:.1f}s\n\n".format
+
+def describe_caller(caller, modules):
+    """
+    Describe the return address of a call reported by the agent.
+    :param caller - the caller reported by the agent, or None
+    :param modules - the backtrace modules reported by the agent
+    :return - the symbol or module and offset of the caller
+    """
+    if caller is None:
+        return "unknown"
+
+    module = modules.get(caller["module"])
+    if module is None:
+        return caller["offset"]
+    if caller["symbol"] and "+" in caller["symbol"]:
+        return caller["symbol"]
+    if caller["symbol"]:
+        return module["name"] + "!" + caller["symbol"]
+    return module["name"] + "+" + caller["offset"]
+
+class CallSummary:
+    """
+    CallSummary accumulates the call counts reported by the agent and renders
+    the busiest call sites as a table.
+    """
+    def __init__(self, top=20):
+        self._top = top
+        self._counts = {}
+        self._total = 0
+        self._start = time.monotonic()
+
+    def update(self, calls, modules):
+        """
+        Add a report of call counts from the agent.
+        :param calls - the counts reported since the last update
+        :param modules - the backtrace modules reported by the agent
+        """
+        for call in calls:
+            key = (
+                call["call_type"] + "->" + call["method"],
+                call["thread_id"],
+                describe_caller(call["caller"], modules)
+            )
+            self._counts[key] = self._counts.get(key, 0) + call["count"]
+            self._total += call["count"]
+
+    def render(self, color="", reset=""):
+        """
+        Render the busiest call sites seen so far.
+        :param color - the color to print the table header in
+        :param reset - the code to reset the color after the header
+        :return - the formatted table
+        """
+        parts = [SUMMARY_HEADER_FORMAT(
+            color, "Calls", "TID", "Method", "Caller", reset
+        )]
+
+        ranked = sorted(
+            self._counts.items(), key=lambda item: item[1], reverse=True
+        )
+        for (method, thread_id, caller), count in ranked[:self._top]:
+            parts.append(SUMMARY_ROW_FORMAT(count, thread_id, method, caller))
+
+        parts.append(SUMMARY_FOOTER_FORMAT(
+            self._total, len(self._counts), time.monotonic() - self._start
+        ))
+        return "".join(parts)
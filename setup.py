@@ -34,9 +34,11 @@ setup(
     python_requires='>=3.0, <4',
     install_requires=[
         'frida>=14.0.5',
-        'colorama',
-        'hexdump'
+        'colorama'
     ],
+    extras_require={
+        'analysis': ['numpy'],
+    },
     package_data={
         '': ['jnitrace.js'],
     },
@@ -44,6 +46,8 @@ setup(
     entry_points={
         'console_scripts': [
             'jnitrace=jnitrace.jnitrace:main',
+            'jnitrace-convert=jnitrace.output:convert_main',
+            'jnitrace-replay=jnitrace.replay:main',
         ],
     },
     project_urls={